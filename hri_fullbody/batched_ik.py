@@ -0,0 +1,239 @@
+import numpy as np
+
+
+def _quaternion_matrix(q):
+    x, y, z, w = q
+    return np.array([
+        [1 - 2*(y*y + z*z), 2*(x*y - z*w), 2*(x*z + y*w)],
+        [2*(x*y + z*w), 1 - 2*(x*x + z*z), 2*(y*z - x*w)],
+        [2*(x*z - y*w), 2*(y*z + x*w), 1 - 2*(x*x + y*y)]])
+
+
+def _axis_angle_matrices(axes, angles):
+    """ Rotation matrices of angles around (unit) axes, for
+        axes of shape (..., 3) and angles of shape (...) """
+    x, y, z = axes[..., 0], axes[..., 1], axes[..., 2]
+    c = np.cos(angles)
+    s = np.sin(angles)
+    C = 1 - c
+    R = np.empty(axes.shape[:-1] + (3, 3))
+    R[..., 0, 0] = c + x*x*C
+    R[..., 0, 1] = x*y*C - z*s
+    R[..., 0, 2] = x*z*C + y*s
+    R[..., 1, 0] = y*x*C + z*s
+    R[..., 1, 1] = c + y*y*C
+    R[..., 1, 2] = y*z*C - x*s
+    R[..., 2, 0] = z*x*C - y*s
+    R[..., 2, 1] = z*y*C + x*s
+    R[..., 2, 2] = c + z*z*C
+    return R
+
+
+class IKChain():
+    """ Geometry of a serial chain of revolute joints, as a list of
+        URDFJoint (see URDFKinematics.chain). active_mask tells which
+        joints are solved by the IK, the others staying at 0 """
+
+    def __init__(self, joints, active_mask):
+        assert len(joints) == len(active_mask)
+        self.translations = np.array([j.translation for j in joints])
+        self.rotations = np.array(
+            [_quaternion_matrix(j.rotation) for j in joints])
+        self.axes = np.array([j.axis for j in joints])
+        self.active = np.array(active_mask, dtype=bool)
+        self.lower = np.array([j.lower for j in joints])
+        self.upper = np.array([j.upper for j in joints])
+
+    def __len__(self):
+        return len(self.active)
+
+
+class BatchedIKSolver():
+    """ Position-only inverse kinematics of a batch of serial chains,
+        solved together with damped least squares (Levenberg-Marquardt)
+        iterations vectorized over the batch.
+
+        All the chains must have the same number of active joints (the
+        4-DoF human arms and legs). Chains of different length are padded
+        with inactive identity joints. Solvers are stateless: they can be
+        shared between bodies with the same geometry, and several solvers
+        can be concatenated with stack() to solve all the limbs of all the
+        bodies in a single pass. """
+
+    def __init__(self, chains):
+        n_joints = max(len(c) for c in chains)
+        n_active = int(chains[0].active.sum())
+        assert all(c.active.sum() == n_active for c in chains)
+
+        batch = len(chains)
+        self.translations = np.zeros((batch, n_joints, 3))
+        self.rotations = np.tile(np.eye(3), (batch, n_joints, 1, 1))
+        self.axes = np.tile([1.0, 0.0, 0.0], (batch, n_joints, 1))
+        self.active = np.zeros((batch, n_joints), dtype=bool)
+        self.lower = np.full((batch, n_joints), -np.inf)
+        self.upper = np.full((batch, n_joints), np.inf)
+
+        for idx, c in enumerate(chains):
+            n = len(c)
+            self.translations[idx, :n] = c.translations
+            self.rotations[idx, :n] = c.rotations
+            self.axes[idx, :n] = c.axes
+            self.active[idx, :n] = c.active
+            self.lower[idx, :n] = np.where(c.active, c.lower, -np.inf)
+            self.upper[idx, :n] = np.where(c.active, c.upper, np.inf)
+
+        self.n_active = n_active
+
+    @classmethod
+    def stack(cls, solvers):
+        """ Concatenate several solvers (eg, one per body) into one """
+        solver = cls.__new__(cls)
+        n_joints = max(s.active.shape[1] for s in solvers)
+        assert all(s.n_active == solvers[0].n_active for s in solvers)
+
+        def pad(a, value):
+            width = [(0, 0)] * a.ndim
+            width[1] = (0, n_joints - a.shape[1])
+            return np.pad(a, width, constant_values=value)
+
+        solver.translations = np.concatenate(
+            [pad(s.translations, 0.0) for s in solvers])
+        solver.rotations = np.concatenate(
+            [np.concatenate([s.rotations, np.tile(
+                np.eye(3),
+                (len(s), n_joints - s.active.shape[1], 1, 1))], axis=1)
+             for s in solvers])
+        solver.axes = np.concatenate([pad(s.axes, 1.0) for s in solvers])
+        solver.active = np.concatenate([pad(s.active, False) for s in solvers])
+        solver.lower = np.concatenate([pad(s.lower, -np.inf) for s in solvers])
+        solver.upper = np.concatenate([pad(s.upper, np.inf) for s in solvers])
+        solver.n_active = solvers[0].n_active
+        return solver
+
+    def __len__(self):
+        return self.active.shape[0]
+
+    def forward(self, q, rows=slice(None)):
+        """ Forward kinematics for the (batch, n_joints) joint positions q
+            of the chains selected by rows. Returns the end effectors
+            positions (batch, 3), and the position and world axis of every
+            joint (batch, n_joints, 3) """
+        translations = self.translations[rows]
+        rotations = self.rotations[rows]
+        axes = self.axes[rows]
+        batch, n_joints = q.shape
+        R = np.tile(np.eye(3), (batch, 1, 1))
+        p = np.zeros((batch, 3))
+        joints_p = np.empty((batch, n_joints, 3))
+        joints_z = np.empty((batch, n_joints, 3))
+        joint_R = _axis_angle_matrices(axes, q)
+        for j in range(n_joints):
+            p = p + np.einsum('bij,bj->bi', R, translations[:, j])
+            R = R @ rotations[:, j]
+            joints_p[:, j] = p
+            joints_z[:, j] = np.einsum('bij,bj->bi', R, axes[:, j])
+            R = R @ joint_R[:, j]
+        return p, joints_p, joints_z
+
+    def solve(self, targets, q0=None, tol=1e-3, max_iter=20, damping=1e-2):
+        """ Solve the IK for the (batch, 3) end effectors targets, each
+            expressed in its chain base frame.
+
+            q0 is the (batch, n_active) initial guess of the active
+            joints (zeros if None). Iterations stop, for each chain,
+            once the end effector is within tol meters of its target, or
+            after max_iter iterations. Converged chains are dropped from
+            the following iterations.
+
+            Returns the (batch, n_active) active joints positions and the
+            (batch,) number of iterations performed for each chain. """
+        targets = np.asarray(targets, dtype=float)
+        q = np.zeros(self.active.shape)
+        if q0 is not None:
+            q[self.active] = np.asarray(q0, dtype=float).reshape(-1)
+        iterations = np.zeros(len(self), dtype=int)
+        damping_matrix = damping**2 * np.eye(3)
+        rows = np.arange(len(self))
+
+        for _ in range(max_iter):
+            end, joints_p, joints_z = self.forward(q[rows], rows)
+            error = targets[rows] - end
+            todo = np.linalg.norm(error, axis=1) > tol
+            if not todo.all():
+                rows = rows[todo]
+                if not rows.size:
+                    break
+                end = end[todo]
+                joints_p = joints_p[todo]
+                joints_z = joints_z[todo]
+                error = error[todo]
+            iterations[rows] += 1
+
+            # revolute joints Jacobian, one (3,) column per joint
+            jac = np.cross(joints_z, end[:, None, :] - joints_p)
+            jac *= self.active[rows, :, None]
+
+            # dq = J^T (J J^T + lambda^2 I)^-1 e
+            jjt = np.einsum('bjk,bjl->bkl', jac, jac) + damping_matrix
+            y = np.linalg.solve(jjt, error[..., None])[..., 0]
+            q[rows] = np.clip(
+                q[rows] + np.einsum('bjk,bk->bj', jac, y),
+                self.lower[rows],
+                self.upper[rows])
+
+        return q[self.active].reshape(len(self), self.n_active), iterations
+
+
+class IKBatch():
+    """ IK problems of several bodies, gathered while the bodies of a
+        camera frame are processed, and solved together in a single
+        pass of their stacked solvers by solve().
+
+        Each problem comes with a callback, called by solve() with its
+        own rows of the solution: the (n, n_active) joints positions and
+        the (n,) iterations of its n chains. """
+
+    def __init__(self, tol=1e-3, max_iter=20):
+        self.tol = tol
+        self.max_iter = max_iter
+        # (solver, targets, initial guess, callback)
+        self.problems = []
+        # stacked solver of the latest solvers, as long as the bodies
+        # of the frames do not change
+        self.solvers = ()
+        self.stacked = None
+
+    def __len__(self):
+        return len(self.problems)
+
+    def add(self, solver, targets, initial_guess, callback):
+        """ Queue the IK of solver for targets, from initial_guess
+            (None for zeros), see BatchedIKSolver.solve """
+        self.problems.append((solver, targets, initial_guess, callback))
+
+    def solve(self):
+        """ Solve the queued problems and call their callbacks """
+        if not self.problems:
+            return
+        solvers, targets, initial_guesses, callbacks = zip(*self.problems)
+        self.problems = []
+
+        if len(solvers) != len(self.solvers) or any(
+                a is not b for a, b in zip(solvers, self.solvers)):
+            self.solvers = solvers
+            self.stacked = BatchedIKSolver.stack(solvers)
+
+        q0 = None
+        if any(guess is not None for guess in initial_guesses):
+            q0 = np.concatenate([
+                np.zeros((len(s), s.n_active)) if guess is None
+                else np.asarray(guess, dtype=float).reshape(len(s), -1)
+                for s, guess in zip(solvers, initial_guesses)])
+        joints, iterations = self.stacked.solve(
+            np.concatenate(targets), q0, tol=self.tol, max_iter=self.max_iter)
+
+        start = 0
+        for solver, callback in zip(solvers, callbacks):
+            end = start + len(solver)
+            callback(joints[start:end], iterations[start:end])
+            start = end
@@ -0,0 +1,655 @@
+""" Offline benchmarks for the hri_fullbody processing stages.
+
+    Usage: ros2 run hri_fullbody benchmark <stage> [options]
+    Run with --help for the list of available stages. """
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+
+def _latency_stats(samples):
+    """ Summarize a list of per-frame latencies, in seconds """
+    samples = np.asarray(samples, dtype=float)
+    return {
+        "frames": int(samples.size),
+        "fps": float(samples.size / samples.sum()) if samples.sum() else 0.0,
+        "mean_ms": float(samples.mean() * 1e3),
+        "p50_ms": float(np.percentile(samples, 50) * 1e3),
+        "p95_ms": float(np.percentile(samples, 95) * 1e3),
+    }
+
+
+def _print_report(title, rows):
+    print(title)
+    for name, stats in rows:
+        print("  %-24s %s" % (name, "  ".join(
+            "%s=%.3f" % (k, v) if isinstance(v, float) else "%s=%d" % (k, v)
+            for k, v in stats.items())))
+
+
+def _load_image_sequence(path):
+    """ Load a recorded image sequence (one image file per frame,
+        sorted by file name) as a list of RGB arrays """
+    import cv2
+
+    images = []
+    for name in sorted(os.listdir(path)):
+        image = cv2.imread(os.path.join(path, name), cv2.IMREAD_COLOR)
+        if image is not None:
+            images.append(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    if not images:
+        raise RuntimeError("No image found in %s" % path)
+    return images
+
+
+def bench_holistic(args):
+    """ Compare Holistic static image mode (full pose detector on every
+        frame) with tracking mode on a recorded image sequence """
+    from hri_fullbody.holistic_pool import HolisticPool
+
+    images = _load_image_sequence(args.images)
+    rows = []
+    for name, static_image_mode in [("static_image_mode", True),
+                                    ("tracking_mode", False)]:
+        pool = HolisticPool(1, args.min_detection, static_image_mode)
+        samples = []
+        for _ in range(args.runs):
+            pool.reset()
+            for image in images:
+                start = time.perf_counter()
+                pool.process(image)
+                samples.append(time.perf_counter() - start)
+        pool.close()
+        rows.append((name, _latency_stats(samples)))
+    _print_report("Holistic inference (%d frames)" % len(images), rows)
+
+
+def bench_pool(args):
+    """ Holistic pool throughput on a recorded image sequence, with all
+        the frames submitted at once (as many bodies would), for the
+        threads and processes backends and several pool sizes """
+    from hri_fullbody.holistic_pool import HolisticPool, HolisticProcessPool
+
+    images = _load_image_sequence(args.images)
+    rows = []
+    for name, pool_class in [("threads", HolisticPool),
+                             ("processes", HolisticProcessPool)]:
+        for size in args.sizes:
+            pool = pool_class(size, args.min_detection)
+            # warm-up: first inference of every model
+            for future in [pool.submit(images[0]) for _ in range(size)]:
+                future.result()
+            start = time.perf_counter()
+            for _ in range(args.runs):
+                for future in [pool.submit(image) for image in images]:
+                    future.result()
+            elapsed = time.perf_counter() - start
+            pool.close()
+            frames = args.runs * len(images)
+            rows.append(("%s, %d workers" % (name, size), {
+                "frames": frames,
+                "fps": frames / elapsed}))
+    _print_report("Holistic pool throughput", rows)
+
+
+def _random_ik_motion(solver, frames, rng, step=0.02):
+    """ Sequence of reachable IK targets, obtained from a random walk of
+        the joint positions (step in radians per frame) """
+    lower = np.where(np.isfinite(solver.lower), solver.lower, -np.pi)
+    upper = np.where(np.isfinite(solver.upper), solver.upper, np.pi)
+    q = rng.uniform(lower, upper)
+    motion = []
+    for _ in range(frames):
+        q = np.clip(q + rng.normal(0.0, step, q.shape), lower, upper)
+        targets, _, _ = solver.forward(q * solver.active)
+        motion.append(targets)
+    return motion
+
+
+def bench_ik(args):
+    """ Per-frame inverse kinematics time against the number of bodies:
+        ikpy (one optimization per limb) vs batched solver, from the
+        default initial guess or warm-started from the previous frame """
+    from hri_fullbody.batched_ik import BatchedIKSolver
+    from hri_fullbody.human_model import get_human_model_template
+
+    template = get_human_model_template()
+    rng = np.random.default_rng(0)
+    rows = []
+    for bodies in args.bodies:
+        solver = BatchedIKSolver.stack([template.ik_solver] * bodies)
+        frames = _random_ik_motion(solver, args.frames, rng)
+
+        samples = []
+        for targets in frames:
+            start = time.perf_counter()
+            for limb, target in enumerate(targets):
+                template.ik_chains[limb % 4].inverse_kinematics(target)
+            samples.append(time.perf_counter() - start)
+        rows.append(("ikpy, %d bodies" % bodies, _latency_stats(samples)))
+
+        for name, warm_start in [("batched", False),
+                                 ("batched warm", True)]:
+            samples = []
+            iterations = []
+            joints = None
+            for targets in frames:
+                start = time.perf_counter()
+                joints, it = solver.solve(
+                    targets, joints if warm_start else None)
+                samples.append(time.perf_counter() - start)
+                iterations.append(it.mean())
+            stats = _latency_stats(samples)
+            stats["iterations"] = float(np.mean(iterations))
+            rows.append(("%s, %d bodies" % (name, bodies), stats))
+    _print_report("Inverse kinematics, per frame", rows)
+
+
+def _random_landmark_list(size, rng):
+    from mediapipe.framework.formats import landmark_pb2
+
+    landmark_list = landmark_pb2.NormalizedLandmarkList()
+    for x, y, z, visibility in rng.uniform(0.0, 1.0, (size, 4)):
+        landmark_list.landmark.add(x=x, y=y, z=z, visibility=visibility)
+    return landmark_list
+
+
+def bench_landmarks(args):
+    """ Per-frame cost of turning Holistic results into keypoints:
+        protobuf_to_dict (three pose conversions and a world pose one,
+        as done before) vs HolisticLandmarks arrays """
+    from types import SimpleNamespace
+    from hri_fullbody.landmarks import HolisticLandmarks
+    from hri_fullbody.protobuf_to_dict import protobuf_to_dict
+
+    rng = np.random.default_rng(0)
+    results = SimpleNamespace(
+        face_landmarks=_random_landmark_list(468, rng),
+        left_hand_landmarks=_random_landmark_list(21, rng),
+        right_hand_landmarks=_random_landmark_list(21, rng),
+        pose_landmarks=_random_landmark_list(33, rng),
+        pose_world_landmarks=_random_landmark_list(33, rng))
+
+    samples = []
+    for _ in range(args.frames):
+        start = time.perf_counter()
+        for _ in range(3):
+            protobuf_to_dict(results.pose_landmarks)
+        protobuf_to_dict(results.pose_world_landmarks)
+        samples.append(time.perf_counter() - start)
+    rows = [("protobuf_to_dict", _latency_stats(samples))]
+
+    samples = []
+    for _ in range(args.frames):
+        start = time.perf_counter()
+        HolisticLandmarks.from_results(results)
+        samples.append(time.perf_counter() - start)
+    rows.append(("HolisticLandmarks", _latency_stats(samples)))
+    _print_report("Landmarks conversion, per frame", rows)
+
+
+def _synthetic_depth_frame(rng, width=640, height=480, holes=0.2):
+    """ Synthetic depth image (in mm) of a person standing 1.5 m in front
+        of a wall at 3 m, with sensor noise and a fraction of invalid
+        (zero) pixels, as a (depth image, person mask) pair """
+    depth = np.full((height, width), 3000.0)
+    person = np.zeros((height, width), dtype=bool)
+    person[height // 8:, width // 3:2 * width // 3] = True
+    depth[person] = 1500.0
+    depth += rng.normal(0.0, 10.0, depth.shape)
+    depth[rng.uniform(size=depth.shape) < holes] = 0.0
+    return depth.astype(np.uint16), person
+
+
+def bench_depth(args):
+    """ Timing and accuracy of the keypoints depth sampling, single
+        pixel vs windowed robust statistics, on synthetic depth
+        images with holes. Keypoints lie on the person, with pixel
+        noise that moves some of them across its silhouette """
+    from hri_fullbody.depth_sampling import sample_depth
+
+    rng = np.random.default_rng(0)
+    samplers = [("single_pixel", 1, "median")] + [
+        ("%s_%dx%d" % (statistic, window, window), window, statistic)
+        for window in args.windows
+        for statistic in ("median", "trimmed_mean")]
+    samples = {name: [] for name, _, _ in samplers}
+    errors = {name: [] for name, _, _ in samplers}
+    missing = {name: 0 for name, _, _ in samplers}
+
+    for _ in range(args.frames):
+        depth, person = _synthetic_depth_frame(rng, holes=args.holes)
+        ys, xs = np.nonzero(person)
+        picked = rng.integers(0, xs.size, args.keypoints)
+        x = np.clip(xs[picked] + rng.integers(-2, 3, args.keypoints),
+                    0, depth.shape[1] - 1)
+        y = np.clip(ys[picked] + rng.integers(-2, 3, args.keypoints),
+                    0, depth.shape[0] - 1)
+        for name, window, statistic in samplers:
+            start = time.perf_counter()
+            if window > 1:
+                z = sample_depth(depth, x, y, window, statistic)
+            else:
+                z = depth[y, x].astype(float)
+                z[z == 0] = np.nan
+            samples[name].append(time.perf_counter() - start)
+            found = ~np.isnan(z)
+            missing[name] += int((~found).sum())
+            errors[name].extend(np.abs(z[found] - 1500.0))
+
+    rows = []
+    for name, _, _ in samplers:
+        stats = _latency_stats(samples[name])
+        stats["missing_%"] = \
+            100.0 * missing[name] / (args.frames * args.keypoints)
+        stats["mean_err_mm"] = float(np.mean(errors[name]))
+        stats["p95_err_mm"] = float(np.percentile(errors[name], 95))
+        rows.append((name, stats))
+    _print_report("Keypoints depth sampling, per frame", rows)
+
+
+def bench_filters(args):
+    """ Cost per frame and per filtered channel of One Euro filtering,
+        one scalar OneEuroFilter per channel, the same behind the
+        OneEuroFilterArray interface, and a OneEuroFilterBank """
+    from hri_fullbody.one_euro_filter import OneEuroFilter, \
+        OneEuroFilterArray, OneEuroFilterBank
+
+    rng = np.random.default_rng(0)
+    rows = []
+    for channels in args.channels:
+        signal = rng.normal(size=(args.frames + 1, channels)).cumsum(axis=0)
+        times = np.arange(args.frames + 1) / 30.0
+
+        filters = [OneEuroFilter(times[0], x0) for x0 in signal[0]]
+        samples = []
+        for t, x in zip(times[1:], signal[1:]):
+            start = time.perf_counter()
+            for f, value in zip(filters, x):
+                f(t, value)
+            samples.append(time.perf_counter() - start)
+        stats = _latency_stats(samples)
+        stats["us_per_channel"] = stats["mean_ms"] * 1e3 / channels
+        rows.append(("scalar, %d channels" % channels, stats))
+
+        for name, filter_class in (("array", OneEuroFilterArray),
+                                   ("bank", OneEuroFilterBank)):
+            bank = filter_class(channels)
+            bank(times[0], signal[0])
+            samples = []
+            for t, x in zip(times[1:], signal[1:]):
+                start = time.perf_counter()
+                bank(t, x)
+                samples.append(time.perf_counter() - start)
+            stats = _latency_stats(samples)
+            stats["us_per_channel"] = stats["mean_ms"] * 1e3 / channels
+            rows.append(("%s, %d channels" % (name, channels), stats))
+    _print_report("One Euro filtering, per frame", rows)
+
+
+def bench_face_pose(args):
+    """ Cost, jitter and error of the face PnP, solved from scratch on
+        every frame vs warm-started from the previous frame pose, with
+        and without smoothing, on a synthetic face slowly turning in
+        front of a 640x480 camera at 30 fps, with landmarks pixel
+        noise """
+    import cv2
+    from hri_fullbody.face_pose_estimation import FacePoseTracker, \
+        FACE_MESH_POINTS, points_3D
+
+    width, height = 640, 480
+    K = np.array([[600.0, 0.0, width / 2],
+                  [0.0, 600.0, height / 2],
+                  [0.0, 0.0, 1.0]])
+    rng = np.random.default_rng(0)
+    translation = np.array([30.0, -20.0, 900.0])
+    faces = []
+    for idx in range(args.frames):
+        # face looking at the camera, turning its head left and right
+        yaw = 0.3 * np.sin(2 * np.pi * idx / 90)
+        rot_vec = cv2.Rodrigues(
+            cv2.Rodrigues(np.array([0.0, np.pi, 0.0]))[0]
+            @ cv2.Rodrigues(np.array([0.0, 0.0, yaw]))[0])[0]
+        points, _ = cv2.projectPoints(
+            points_3D, rot_vec, translation, K, None)
+        points = points[:, 0] + rng.normal(0.0, args.noise, points.shape[::2])
+        face = np.zeros((468, 4))
+        face[FACE_MESH_POINTS, :2] = points / [width, height]
+        faces.append(face)
+
+    rows = []
+    for name, warm_start, smoothing in (
+            ("from scratch", False, "none"),
+            ("warm-started", True, "none"),
+            ("warm-started, one_euro", True, "one_euro"),
+            ("warm-started, kalman", True, "kalman")):
+        tracker = FacePoseTracker(smoothing=smoothing)
+        samples = []
+        poses = []
+        rotations = []
+        rejected = 0
+        for idx, face in enumerate(faces):
+            if not warm_start:
+                tracker.reset()
+            start = time.perf_counter()
+            pose = tracker(face, width, height, K, idx / 30)
+            samples.append(time.perf_counter() - start)
+            if pose is None:
+                rejected += 1
+                continue
+            poses.append(np.ravel(pose[0]))
+            rotations.append(tracker.rotation)
+        stats = _latency_stats(samples)
+        stats["rejected"] = rejected
+        # translation error, including the smoothing lag, in mm
+        stats["error_mm"] = float(np.mean(np.linalg.norm(
+            np.array(poses) - translation, axis=1)))
+        # frame to frame translation changes, in mm
+        stats["jitter_mm"] = float(np.mean(np.linalg.norm(
+            np.diff(poses, axis=0), axis=1)))
+        # frame to frame rotation angles, in degrees
+        stats["jitter_deg"] = float(np.degrees(np.mean([
+            np.linalg.norm(cv2.Rodrigues(r1 @ r0.T)[0])
+            for r0, r1 in zip(rotations, rotations[1:])])))
+        rows.append((name, stats))
+    _print_report("Face pose estimation, per frame", rows)
+
+
+def _fresh_body_messages(body_id, joint_names, skeleton_joints, header,
+                         pose_2d, position):
+    """ Messages of a body for a frame, built from new objects on every
+        frame as done before """
+    import copy
+    from hri_msgs.msg import Skeleton2D, NormalizedPointOfInterest2D, \
+        IdsList
+    from sensor_msgs.msg import JointState, RegionOfInterest
+    from hri_fullbody.tf_batch import make_transform
+
+    skel = Skeleton2D()
+    skel.header = header
+    skel.skeleton = [NormalizedPointOfInterest2D()] * len(skeleton_joints)
+    for idx, joint in enumerate(skeleton_joints):
+        if joint is not None:
+            skel.skeleton[idx] = NormalizedPointOfInterest2D(
+                x=float(pose_2d[joint, 0]),
+                y=float(pose_2d[joint, 1]),
+                c=float(pose_2d[joint, 3]))
+    left = skel.skeleton[Skeleton2D.LEFT_SHOULDER]
+    right = skel.skeleton[Skeleton2D.RIGHT_SHOULDER]
+    skel.skeleton[Skeleton2D.NECK] = NormalizedPointOfInterest2D(
+        x=(left.x + right.x) / 2, y=(left.y + right.y) / 2,
+        c=min(left.c, right.c))
+
+    js = JointState()
+    js.header = copy.copy(header)
+    js.name = [name + "_%s" % body_id for name in joint_names]
+    js.position = position
+
+    body_tf = make_transform(
+        header.frame_id, "body_%s" % body_id, header.stamp,
+        (1.0, 0.0, 2.0))
+
+    roi = RegionOfInterest()
+    roi.x_offset, roi.y_offset, roi.width, roi.height = 10, 20, 100, 200
+    ids = IdsList()
+    ids.ids = [body_id]
+    return skel, js, body_tf, roi, ids
+
+
+def _reused_body_messages(messages, header, pose_2d, position):
+    """ Same messages, updated in place (see BodyMessages) """
+    from hri_fullbody.tf_batch import set_transform
+
+    skel = messages.fill_skeleton(header, pose_2d)
+    js = messages.fill_jointstate(header, position)
+    body_tf = messages.body_tf
+    body_tf.header.stamp = header.stamp
+    body_tf.header.frame_id = header.frame_id
+    set_transform(body_tf, (1.0, 0.0, 2.0))
+    roi = messages.fill_roi(10, 20, 100, 200)
+    return skel, js, body_tf, roi, messages.ids
+
+
+def bench_messages(args):
+    """ Python time and memory allocated per frame to build the messages
+        published for a body (2D skeleton, joint state, body TF, ROI and
+        ids), new messages on every frame vs preallocated BodyMessages.
+        The skeleton maps the Skeleton2D points to the first pose
+        landmarks. """
+    import tracemalloc
+    from hri_msgs.msg import Skeleton2D
+    from std_msgs.msg import Header
+    from hri_fullbody.body_messages import BodyMessages
+    from hri_fullbody.jointstate import HUMAN_JOINT_NAMES
+
+    rng = np.random.default_rng(0)
+    skeleton_joints = [None if idx == Skeleton2D.NECK else idx
+                       for idx in range(18)]
+    header = Header()
+    header.frame_id = "camera"
+    pose_2d = rng.uniform(size=(33, 4))
+    position = rng.uniform(size=len(HUMAN_JOINT_NAMES)).tolist()
+    messages = BodyMessages("abcde", HUMAN_JOINT_NAMES, skeleton_joints)
+
+    builders = [
+        ("new messages", lambda: _fresh_body_messages(
+            "abcde", HUMAN_JOINT_NAMES, skeleton_joints, header, pose_2d,
+            position)),
+        ("preallocated", lambda: _reused_body_messages(
+            messages, header, pose_2d, position)),
+    ]
+    rows = []
+    for name, build in builders:
+        samples = []
+        for _ in range(args.frames):
+            start = time.perf_counter()
+            build()
+            samples.append(time.perf_counter() - start)
+        stats = _latency_stats(samples)
+
+        tracemalloc.start()
+        allocated = []
+        for _ in range(min(args.frames, 100)):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            build()
+            allocated.append(tracemalloc.get_traced_memory()[1] - before)
+        tracemalloc.stop()
+        stats["peak_alloc_kb"] = float(np.mean(allocated) / 1024)
+        rows.append((name, stats))
+    _print_report("Body messages construction, per frame", rows)
+
+
+RESOLUTIONS = {"720p": (1280, 720), "1080p": (1920, 1080), "4k": (3840, 2160)}
+
+
+def bench_preprocessing(args):
+    """ Per-frame preprocessing time (image message to Holistic input)
+        and size of the resulting image, at full resolution vs
+        downscaled to the given input_max_size values, on synthetic
+        bgr8 camera frames """
+    from cv_bridge import CvBridge
+    from hri_fullbody.image_conversion import imgmsg_to_rgb
+
+    bridge = CvBridge()
+    rng = np.random.default_rng(0)
+    rows = []
+    for resolution in args.resolutions:
+        width, height = RESOLUTIONS[resolution]
+        frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        msg = bridge.cv2_to_imgmsg(frame, "bgr8")
+        for max_size in [0] + args.max_sizes:
+            samples = []
+            for _ in range(args.frames):
+                start = time.perf_counter()
+                image = imgmsg_to_rgb(bridge, msg, max_size)
+                samples.append(time.perf_counter() - start)
+            stats = _latency_stats(samples)
+            stats["output_mb"] = image.nbytes / 1e6
+            rows.append(("%s, %s" % (
+                resolution, "max %d" % max_size if max_size else "full"),
+                stats))
+    _print_report("Image preprocessing, per frame", rows)
+
+
+def _replay_config(path, max_frames, bodies, use_depth, runs):
+    from hri_fullbody.replay import Recording, replay
+
+    return replay(Recording(path, max_frames), bodies, use_depth, runs)
+
+
+def bench_replay(args):
+    """ Throughput, per-stage latency and peak memory of the full
+        pipeline, replaying a recording (see hri_fullbody.replay) in
+        single body and N bodies configurations. Each configuration
+        runs in a fresh process, so that peak memory is its own. """
+    import json
+    import multiprocessing
+    import platform
+    from concurrent.futures import ProcessPoolExecutor
+
+    results = []
+    rows = []
+    for bodies in args.bodies:
+        with ProcessPoolExecutor(
+                1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            result = pool.submit(
+                _replay_config,
+                args.recording,
+                args.max_frames,
+                bodies,
+                args.depth,
+                args.runs).result()
+        frame_stats = _latency_stats(result["latencies"])
+        name = "single body" if bodies == 1 else "%d bodies" % bodies
+        rows.append((name, dict(frame_stats,
+                                peak_rss_mb=result["peak_rss_mb"])))
+        for stage, stats in sorted(
+                next(iter(result["stages"].values())).items()):
+            rows.append(("  " + stage, stats))
+        results.append({
+            "bodies": bodies,
+            "single_body": bodies == 1,
+            "use_depth": args.depth,
+            "frame": frame_stats,
+            "stages": result["stages"],
+            "published": result["published"],
+            "peak_rss_mb": result["peak_rss_mb"],
+        })
+    _print_report("Full pipeline replay of %s" % args.recording, rows)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "recording": os.path.abspath(args.recording),
+                "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "platform": platform.platform(),
+                "python": platform.python_version(),
+                "results": results,
+            }, f, indent=2)
+        print("Results written to %s" % args.output)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    stages = parser.add_subparsers(dest="stage", required=True)
+
+    holistic = stages.add_parser(
+        "holistic",
+        help="Holistic static image mode vs tracking mode")
+    holistic.add_argument(
+        "images", help="directory containing a recorded image sequence")
+    holistic.add_argument("--runs", type=int, default=1)
+    holistic.add_argument("--min-detection", type=float, default=0.7)
+    holistic.set_defaults(run=bench_holistic)
+
+    pool = stages.add_parser(
+        "pool",
+        help="Holistic pool throughput, threads vs processes backend")
+    pool.add_argument(
+        "images", help="directory containing a recorded image sequence")
+    pool.add_argument("--sizes", type=int, nargs="+", default=[1, 2, 4])
+    pool.add_argument("--runs", type=int, default=1)
+    pool.add_argument("--min-detection", type=float, default=0.7)
+    pool.set_defaults(run=bench_pool)
+
+    ik = stages.add_parser(
+        "ik",
+        help="ikpy vs batched inverse kinematics")
+    ik.add_argument("--bodies", type=int, nargs="+", default=[1, 2, 4, 8])
+    ik.add_argument("--frames", type=int, default=50)
+    ik.set_defaults(run=bench_ik)
+
+    landmarks = stages.add_parser(
+        "landmarks",
+        help="protobuf_to_dict vs landmark arrays conversion")
+    landmarks.add_argument("--frames", type=int, default=1000)
+    landmarks.set_defaults(run=bench_landmarks)
+
+    depth = stages.add_parser(
+        "depth",
+        help="single pixel vs windowed keypoints depth sampling")
+    depth.add_argument("--frames", type=int, default=100)
+    depth.add_argument("--keypoints", type=int, default=34)
+    depth.add_argument("--windows", type=int, nargs="+", default=[3, 5, 7])
+    depth.add_argument("--holes", type=float, default=0.2,
+                       help="fraction of invalid depth pixels")
+    depth.set_defaults(run=bench_depth)
+
+    filters = stages.add_parser(
+        "filters",
+        help="scalar One Euro filters vs filter bank")
+    filters.add_argument("--channels", type=int, nargs="+",
+                         default=[3, 6, 99, 792])
+    filters.add_argument("--frames", type=int, default=1000)
+    filters.set_defaults(run=bench_filters)
+
+    face_pose = stages.add_parser(
+        "face_pose",
+        help="face PnP from scratch vs warm-started")
+    face_pose.add_argument("--frames", type=int, default=1000)
+    face_pose.add_argument("--noise", type=float, default=1.0,
+                           help="landmarks noise standard deviation, px")
+    face_pose.set_defaults(run=bench_face_pose)
+
+    messages = stages.add_parser(
+        "messages",
+        help="new vs preallocated body messages")
+    messages.add_argument("--frames", type=int, default=1000)
+    messages.set_defaults(run=bench_messages)
+
+    preprocessing = stages.add_parser(
+        "preprocessing",
+        help="full resolution vs downscaled image preprocessing")
+    preprocessing.add_argument("--resolutions", nargs="+",
+                               choices=sorted(RESOLUTIONS),
+                               default=["720p", "1080p", "4k"])
+    preprocessing.add_argument("--max-sizes", type=int, nargs="+",
+                               default=[640, 960])
+    preprocessing.add_argument("--frames", type=int, default=100)
+    preprocessing.set_defaults(run=bench_preprocessing)
+
+    replay = stages.add_parser(
+        "replay",
+        help="full pipeline on a recording, single body and N bodies")
+    replay.add_argument(
+        "recording",
+        help="recording directory (rgb/, depth/, camera_info.yaml,"
+        " depth_info.yaml)")
+    replay.add_argument("--bodies", type=int, nargs="+", default=[1, 4])
+    replay.add_argument("--depth", action="store_true",
+                        help="replay the depth images too (use_depth)")
+    replay.add_argument("--runs", type=int, default=1)
+    replay.add_argument("--max-frames", type=int, default=None)
+    replay.add_argument("--output", help="JSON results file")
+    replay.set_defaults(run=bench_replay)
+
+    args = parser.parse_args(args)
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+from builtin_interfaces.msg import Time
+from hri_msgs.msg import Skeleton2D, NormalizedPointOfInterest2D, IdsList
+from sensor_msgs.msg import JointState, RegionOfInterest
+
+from hri_fullbody.landmarks import X, Y, VISIBILITY
+from hri_fullbody.tf_batch import make_transform
+
+# (parent, child) body parts frames of the stickman debugging mode, with
+# the torso frame, child of the camera frame, first
+STICKMAN_FRAMES = [
+    (None, "mediapipe_torso_"),
+    ("left_shoulder_", "our_torso_"),
+    ("right_shoulder_", "our_torso_"),
+    ("left_elbow_", "left_shoulder_"),
+    ("right_elbow_", "right_shoulder_"),
+    ("left_wrist_", "left_elbow_"),
+    ("right_wrist_", "right_elbow_"),
+    ("left_ankle_", "mediapipe_torso_"),
+    ("right_ankle_", "mediapipe_torso_"),
+]
+
+
+class BodyMessages():
+    """ Messages published for a body, allocated once, with their
+        constant fields (joint names, frame ids, ...) set at creation.
+        The fill_* methods only update their header and numeric fields
+        on every frame.
+
+        rclpy serializes messages when they are published, so they can
+        be updated again right after publish(). The transforms are only
+        sent when the frame TransformBatch is flushed, before the next
+        frame is processed. """
+
+    def __init__(self, body_id, joint_names, skeleton_joints):
+        # Skeleton2D point index -> Mediapipe pose landmark index
+        self.skeleton_joints = [
+            (idx, joint) for idx, joint in enumerate(skeleton_joints)
+            if joint is not None]
+
+        self.skeleton = Skeleton2D()
+        self.skeleton.skeleton = [
+            NormalizedPointOfInterest2D() for _ in skeleton_joints]
+
+        self.jointstate = JointState()
+        self.jointstate.name = [
+            "%s_%s" % (name, body_id) for name in joint_names]
+
+        self.body_tf = make_transform(
+            "", "body_%s" % body_id, Time(), (0.0, 0.0, 0.0))
+        self.face_tf = make_transform(
+            "", "face_%s" % body_id, Time(), (0.0, 0.0, 0.0))
+        self.stickman_tfs = [
+            make_transform(
+                "" if parent is None else parent + body_id,
+                child + body_id,
+                Time(),
+                (0.0, 0.0, 0.0))
+            for parent, child in STICKMAN_FRAMES]
+
+        self.roi = RegionOfInterest()
+        self.ids = IdsList()
+        self.ids.ids = [body_id]
+        self.no_ids = IdsList()
+
+    def fill_skeleton(self, header, pose_2d):
+        """ The skeleton message of the (N, 4) pose landmarks array.
+            There is no neck landmark in Mediapipe: the neck is the
+            middle of the shoulders. """
+        skel = self.skeleton
+        skel.header = header
+        points = skel.skeleton
+        for idx, joint in self.skeleton_joints:
+            point = points[idx]
+            point.x = float(pose_2d[joint, X])
+            point.y = float(pose_2d[joint, Y])
+            point.c = float(pose_2d[joint, VISIBILITY])
+
+        left = points[Skeleton2D.LEFT_SHOULDER]
+        right = points[Skeleton2D.RIGHT_SHOULDER]
+        neck = points[Skeleton2D.NECK]
+        neck.x = (left.x + right.x) / 2
+        neck.y = (left.y + right.y) / 2
+        neck.c = min(left.c, right.c)
+        return skel
+
+    def fill_jointstate(self, header, position):
+        js = self.jointstate
+        js.header.stamp = header.stamp
+        js.header.frame_id = header.frame_id
+        js.position = position
+        return js
+
+    def fill_roi(self, x_offset, y_offset, width, height):
+        roi = self.roi
+        roi.x_offset = int(x_offset)
+        roi.y_offset = int(y_offset)
+        roi.width = int(width)
+        roi.height = int(height)
+        return roi
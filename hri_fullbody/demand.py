@@ -0,0 +1,27 @@
+class OutputDemand():
+    """ Which outputs of a body are consumed, from the number of
+        subscriptions to their topics.
+
+        Counting subscriptions is a ROS graph query, too costly to run on
+        every frame: the counts are refreshed periodically with
+        refresh(), by a node timer. When disabled, all the outputs are
+        considered consumed. """
+
+    def __init__(self, node, topics, enabled=True):
+        self.node = node
+        # output name -> topic name
+        self.topics = topics
+        self.enabled = enabled
+        self.consumed = {name: True for name in topics}
+        self.refresh()
+
+    def refresh(self):
+        if not self.enabled:
+            return
+        # replaced at once, as it is read from the processing threads
+        self.consumed = {
+            name: self.node.count_subscribers(topic) > 0
+            for name, topic in self.topics.items()}
+
+    def __getitem__(self, name):
+        return self.consumed[name]
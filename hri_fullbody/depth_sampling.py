@@ -0,0 +1,51 @@
+import numpy as np
+
+# "median", or "trimmed_mean": mean without the trimmed extreme values
+DEPTH_STATISTICS = ("median", "trimmed_mean")
+
+
+def sample_depth(depth_data, x, y, window=5, statistic="median", trim=0.2):
+    """ Robust depth values around the (x, y) pixels of depth_data.
+
+        For each pixel, the depth values of the window x window
+        neighbourhood are gathered, zeros (invalid depth) are discarded,
+        and the remaining ones are reduced with statistic: "median", or
+        "trimmed_mean" (mean without the trim fraction of lowest and
+        highest values). Returns a float array, NaN where the whole window
+        is invalid. """
+
+    x = np.asarray(x, dtype=int)
+    y = np.asarray(y, dtype=int)
+    # eg no keypoint falling inside of the depth image
+    if not x.size:
+        return np.empty(x.shape)
+    height, width = depth_data.shape[:2]
+    offsets = np.arange(window) - window // 2
+    xs = np.clip(x[..., None] + offsets, 0, width - 1)
+    ys = np.clip(y[..., None] + offsets, 0, height - 1)
+    patches = depth_data[ys[..., :, None], xs[..., None, :]]
+    patches = patches.reshape(x.shape + (-1,)).astype(float)
+
+    # sorting pushes the invalid (NaN) values at the end of each window
+    patches[patches == 0] = np.nan
+    patches.sort(axis=-1)
+    valid = np.count_nonzero(~np.isnan(patches), axis=-1)
+
+    if statistic == "median":
+        low = np.maximum(valid - 1, 0) // 2
+        high = valid // 2
+        depth = (np.take_along_axis(patches, low[..., None], -1)
+                 + np.take_along_axis(patches, high[..., None], -1))[..., 0] / 2
+    elif statistic == "trimmed_mean":
+        cut = (valid * trim).astype(int)
+        idx = np.arange(patches.shape[-1])
+        kept = (idx >= cut[..., None]) & (idx < (valid - cut)[..., None])
+        with np.errstate(invalid="ignore"):
+            depth = np.where(kept, patches, 0.0).sum(axis=-1) \
+                / kept.sum(axis=-1)
+    else:
+        raise ValueError("Unknown depth statistic: %s (expected one of %s)"
+                         % (statistic, ", ".join(DEPTH_STATISTICS)))
+
+    depth[valid == 0] = np.nan
+    return depth
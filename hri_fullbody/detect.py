@@ -1,8 +1,17 @@
 import rclpy
 from rclpy.node import Node
+from rclpy.executors import MultiThreadedExecutor
 from hri_fullbody.fullbody_detector import FullbodyDetector
+from hri_fullbody.holistic_pool import HolisticPool, HolisticProcessPool
+from hri_fullbody.human_model import get_human_model_template
+from hri_fullbody.jointstate import IK_SOLVERS
+from hri_fullbody.depth_sampling import DEPTH_STATISTICS
+from hri_fullbody.frame_batcher import MultibodyFrameBatcher
+from hri_fullbody.tf_batch import StaticTransforms
 import random
 from hri_msgs.msg import IdsList
+from diagnostic_msgs.msg import DiagnosticArray
+from tf2_ros import StaticTransformBroadcaster
 
 
 def generate_id():
@@ -22,17 +31,131 @@ class MultibodyManager(Node):
         self.declare_parameter('fullbody_manager/stickman_debug', False)
         self.declare_parameter('fullbody_manager/single_body', True)
         self.declare_parameter('fullbody_manager/min_detection', 0.7)
+        self.declare_parameter('fullbody_manager/holistic_pool_size', 1)
+        self.declare_parameter('fullbody_manager/inference_backend', 'threads')
+        self.declare_parameter('fullbody_manager/tracking_mode', False)
+        self.declare_parameter('fullbody_manager/tracking_roi_jump', 0.5)
+        self.declare_parameter('fullbody_manager/ik_solver', 'batched')
+        self.declare_parameter('fullbody_manager/ik_tolerance', 1e-3)
+        self.declare_parameter('fullbody_manager/ik_max_iterations', 20)
+        self.declare_parameter('fullbody_manager/depth_window', 5)
+        self.declare_parameter('fullbody_manager/depth_statistic', 'median')
+        self.declare_parameter('fullbody_manager/smoothing', 'none')
+        self.declare_parameter('fullbody_manager/profiling', False)
+        self.declare_parameter('fullbody_manager/profiling_period', 1.0)
+        self.declare_parameter('fullbody_manager/latest_only', False)
+        self.declare_parameter('fullbody_manager/num_threads', 0)
+        self.declare_parameter('fullbody_manager/batched_multibody', False)
+        self.declare_parameter('fullbody_manager/input_max_size', 0)
+        self.declare_parameter('fullbody_manager/roi_cropping', False)
+        self.declare_parameter('fullbody_manager/roi_margin', 0.25)
+        self.declare_parameter('fullbody_manager/roi_min_confidence', 0.5)
+        self.declare_parameter('fullbody_manager/demand_driven', False)
+        self.declare_parameter('fullbody_manager/demand_period', 1.0)
 
         self.use_depth = self.get_parameter('fullbody_manager/use_depth').get_parameter_value().bool_value
         self.stickman_debug = self.get_parameter('fullbody_manager/stickman_debug').get_parameter_value().bool_value
         self.min_detection = self.get_parameter('fullbody_manager/min_detection').get_parameter_value().double_value
         self.single_body = self.get_parameter('fullbody_manager/single_body').get_parameter_value().bool_value
+        self.holistic_pool_size = self.get_parameter('fullbody_manager/holistic_pool_size').get_parameter_value().integer_value
+        self.inference_backend = self.get_parameter('fullbody_manager/inference_backend').get_parameter_value().string_value
+        self.tracking_mode = self.get_parameter('fullbody_manager/tracking_mode').get_parameter_value().bool_value
+        self.tracking_roi_jump = self.get_parameter('fullbody_manager/tracking_roi_jump').get_parameter_value().double_value
+        self.ik_solver = self.get_parameter('fullbody_manager/ik_solver').get_parameter_value().string_value
+        self.ik_tolerance = self.get_parameter('fullbody_manager/ik_tolerance').get_parameter_value().double_value
+        self.ik_max_iterations = self.get_parameter('fullbody_manager/ik_max_iterations').get_parameter_value().integer_value
+        self.depth_window = self.get_parameter('fullbody_manager/depth_window').get_parameter_value().integer_value
+        self.depth_statistic = self.get_parameter('fullbody_manager/depth_statistic').get_parameter_value().string_value
+        self.smoothing = self.get_parameter('fullbody_manager/smoothing').get_parameter_value().string_value
+        self.profiling = self.get_parameter('fullbody_manager/profiling').get_parameter_value().bool_value
+        self.profiling_period = self.get_parameter('fullbody_manager/profiling_period').get_parameter_value().double_value
+        self.latest_only = self.get_parameter('fullbody_manager/latest_only').get_parameter_value().bool_value
+        self.num_threads = self.get_parameter('fullbody_manager/num_threads').get_parameter_value().integer_value
+        self.batched_multibody = self.get_parameter('fullbody_manager/batched_multibody').get_parameter_value().bool_value
+        self.input_max_size = self.get_parameter('fullbody_manager/input_max_size').get_parameter_value().integer_value
+        self.roi_cropping = self.get_parameter('fullbody_manager/roi_cropping').get_parameter_value().bool_value
+        self.roi_margin = self.get_parameter('fullbody_manager/roi_margin').get_parameter_value().double_value
+        self.roi_min_confidence = self.get_parameter('fullbody_manager/roi_min_confidence').get_parameter_value().double_value
+        self.demand_driven = self.get_parameter('fullbody_manager/demand_driven').get_parameter_value().bool_value
+        self.demand_period = self.get_parameter('fullbody_manager/demand_period').get_parameter_value().double_value
 
         self.get_logger().info("Using depth camera for body position estimation: %s "% str(self.use_depth))
 
+        # Holistic models are loaded once here and shared by all the
+        # body detectors, whatever the number of tracked bodies
+        if self.single_body:
+            self.holistic_pool_size = 1
+        elif self.tracking_mode:
+            self.get_logger().warning(
+                "Tracking mode is only available in single body mode,"
+                + " Holistic models will process each frame independently")
+            self.tracking_mode = False
+        if self.ik_solver not in IK_SOLVERS:
+            raise ValueError("Unknown IK solver: %s (expected one of %s)"
+                             % (self.ik_solver, ", ".join(IK_SOLVERS)))
+        if self.depth_statistic not in DEPTH_STATISTICS:
+            raise ValueError("Unknown depth statistic: %s (expected one of %s)"
+                             % (self.depth_statistic,
+                                ", ".join(DEPTH_STATISTICS)))
+        if self.ik_solver != 'batched':
+            self.get_logger().warning(
+                "ik_tolerance and ik_max_iterations only apply to the"
+                + " batched IK solver, they are ignored by %s"
+                % self.ik_solver)
+        if self.inference_backend == 'processes':
+            pool_class = HolisticProcessPool
+        else:
+            pool_class = HolisticPool
+        self.holistic_pool = pool_class(
+            self.holistic_pool_size,
+            self.min_detection,
+            static_image_mode=not self.tracking_mode)
+        self.get_logger().info("Loaded %d Holistic model(s) (%s backend)" % (
+            self.holistic_pool.size, self.inference_backend))
+
+        # Static transforms of all the bodies, sent by a single
+        # /tf_static publisher instead of one per body
+        self.static_tf = StaticTransforms(StaticTransformBroadcaster(self))
+
+        # Building the human model template (xacro processing and IK
+        # chains parsing) once here, new bodies only rename it
+        get_human_model_template()
+
+        # Per-stage latency statistics of each body, published
+        # periodically on /diagnostics
+        if self.profiling:
+            self.diagnostics_pub = self.create_publisher(
+                DiagnosticArray,
+                "/diagnostics",
+                1)
+            self.diagnostics_timer = self.create_timer(
+                self.profiling_period,
+                self.publish_diagnostics)
+
+        # Subscription counts of the body outputs, deciding which
+        # processing stages run (see FullbodyDetector.demand)
+        if self.demand_driven:
+            self.demand_timer = self.create_timer(
+                self.demand_period,
+                self.refresh_demand)
+
         if not self.single_body:
 
             self.get_logger().info("Setting up for multibody pose estimation")
+            # In batched mode, the bodies of each camera frame are
+            # processed together, from the full frame and the bodies ROIs
+            self.frame_batcher = None
+            if self.batched_multibody:
+                self.frame_batcher = MultibodyFrameBatcher(
+                    self,
+                    self.holistic_pool,
+                    self.use_depth,
+                    self.profiling,
+                    self.input_max_size,
+                    self.ik_tolerance,
+                    self.ik_max_iterations)
+                self.get_logger().info(
+                    "Batched multibody mode: waiting for frames on /image")
             # Dictionary for the detected people
             self.detected_bodies = {}
             # id = uni
@@ -55,7 +178,25 @@ class MultibodyManager(Node):
                         self.use_depth,
                         self.stickman_debug,
                         id,
-                        self.min_detection
+                        single_body=True,
+                        min_detection=self.min_detection,
+                        holistic_pool=self.holistic_pool,
+                        tracking=self.tracking_mode,
+                        tracking_roi_jump=self.tracking_roi_jump,
+                        ik_solver=self.ik_solver,
+                        ik_tolerance=self.ik_tolerance,
+                        ik_max_iterations=self.ik_max_iterations,
+                        depth_window=self.depth_window,
+                        depth_statistic=self.depth_statistic,
+                        smoothing=self.smoothing,
+                        profiling=self.profiling,
+                        latest_only=self.latest_only,
+                        input_max_size=self.input_max_size,
+                        roi_cropping=self.roi_cropping,
+                        roi_margin=self.roi_margin,
+                        roi_min_confidence=self.roi_min_confidence,
+                        static_tf=self.static_tf,
+                        demand_driven=self.demand_driven
                     )
 
             self.get_logger().info("Generated single person detector for body_%s"% id)
@@ -77,26 +218,89 @@ class MultibodyManager(Node):
                         self.use_depth,
                         self.stickman_debug,
                         id,
-                        self.min_detection
+                        single_body=False,
+                        min_detection=self.min_detection,
+                        holistic_pool=self.holistic_pool,
+                        ik_solver=self.ik_solver,
+                        ik_tolerance=self.ik_tolerance,
+                        ik_max_iterations=self.ik_max_iterations,
+                        depth_window=self.depth_window,
+                        depth_statistic=self.depth_statistic,
+                        smoothing=self.smoothing,
+                        profiling=self.profiling,
+                        latest_only=self.latest_only,
+                        input_max_size=self.input_max_size,
+                        tf_batch=self.frame_batcher.tf_batch
+                        if self.frame_batcher else None,
+                        ik_batch=self.frame_batcher.ik_batch
+                        if self.frame_batcher else None,
+                        static_tf=self.static_tf,
+                        demand_driven=self.demand_driven,
+                        subscribe=self.frame_batcher is None
                     ),
                     0,
                 )
                 self.get_logger().info("Generated single person detector for body_%s" % id)
-                self.get_logger().info(
-                    "Waiting for frames on topic %s" %
-                    current_bodies[id][0].get_image_topic(),
-                )
+                if self.frame_batcher:
+                    self.frame_batcher.add_body(id, current_bodies[id][0])
+                else:
+                    self.get_logger().info(
+                        "Waiting for frames on topic %s" %
+                        current_bodies[id][0].get_image_topic(),
+                    )
 
         for id in self.detected_bodies:
             if not id in current_bodies:
+                if self.frame_batcher:
+                    self.frame_batcher.remove_body(id)
                 self.detected_bodies[id][0].unregister()
 
         self.detected_bodies = current_bodies
 
+    def detectors(self):
+
+        if self.single_body:
+            return [self.single_detector]
+        return [body[0] for body in self.detected_bodies.values()]
+
+    def refresh_demand(self):
+
+        for detector in self.detectors():
+            detector.demand.refresh()
+
+    def publish_diagnostics(self):
+
+        detectors = self.detectors()
+
+        msg = DiagnosticArray()
+        msg.header.stamp = self.get_clock().now().to_msg()
+        for detector in detectors:
+            counters = {}
+            if detector.use_batched_ik:
+                counters["ik_solves"] = detector.ik_solves
+                counters["ik_average_iterations"] = \
+                    "%.2f" % detector.ik_average_iterations()
+            if detector.owns_tf_batch:
+                counters.update(detector.tf_batch.stats())
+            if detector.scheduler:
+                counters.update(detector.scheduler.stats())
+            msg.status.append(detector.timer.diagnostic_status(
+                "%s: body_%s" % (self.get_name(), detector.body_id),
+                counters=counters))
+        if not self.single_body and self.frame_batcher:
+            msg.status.append(self.frame_batcher.timer.diagnostic_status(
+                "%s: frame batcher" % self.get_name(),
+                counters=self.frame_batcher.tf_batch.stats()))
+        self.diagnostics_pub.publish(msg)
+
 def main(args=None):
     rclpy.init(args=args)
-    node = MultibodyManager()    
-    rclpy.spin(node)
+    node = MultibodyManager()
+    # Each body's callbacks belong to its own callback group, so that
+    # the bodies are processed in parallel (0: one thread per CPU core)
+    executor = MultiThreadedExecutor(num_threads=node.num_threads or None)
+    executor.add_node(node)
+    executor.spin()
 
 if __name__ == "__main__":
     main()
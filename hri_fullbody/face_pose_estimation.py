@@ -1,6 +1,8 @@
 import cv2
 import numpy as np
 
+from hri_fullbody.smoothing import SmoothingStage
+
 # face key points
 P3D_RIGHT_EYE = (-20., -65.5, -5.)
 P3D_LEFT_EYE = (-20., 65.5, -5.)
@@ -9,6 +11,14 @@ P3D_LEFT_EAR = (-100., 77.5, -6.)
 P3D_NOSE = (21.0, 0., -48.0)
 P3D_STOMION = (10.0, 0., -75.0)
 
+# Mediapipe face mesh indexing (partial)
+FM_NOSE = 1
+FM_MOUTH_CENTER = 13
+FM_RIGHT_EYE = 159
+FM_RIGHT_EAR_TRAGION = 234
+FM_LEFT_EYE = 386
+FM_LEFT_EAR_TRAGION = 454
+
 
 points_3D = np.array([
     P3D_NOSE,
@@ -19,15 +29,116 @@ points_3D = np.array([
     P3D_LEFT_EAR]
 )
 
-def face_pose_estimation(points_2D, K):
-    success, rot_vec, trans_vec = cv2.solvePnP(
-                                        points_3D,
-                                        points_2D,
-                                        K,
-                                        None,
-                                        tvec=np.array([0., 0., 1000.]),
-                                        useExtrinsicGuess=True,
-                                        flags=4)
-    rmat, jac = cv2.Rodrigues(rot_vec)
-    angles, mtxR, mtxQ, Qx, Qy, Qz = cv2.RQDecomp3x3(rmat)
-    return trans_vec, angles
\ No newline at end of file
+# Face mesh landmarks matching points_3D
+FACE_MESH_POINTS = np.array([
+    FM_NOSE,
+    FM_RIGHT_EYE,
+    FM_LEFT_EYE,
+    FM_MOUTH_CENTER,
+    FM_RIGHT_EAR_TRAGION,
+    FM_LEFT_EAR_TRAGION])
+
+
+def _rot_vec_to_quaternion(rot_vec):
+    """ (x, y, z, w) unit quaternion of a rotation vector """
+    rot_vec = np.ravel(rot_vec)
+    angle = np.linalg.norm(rot_vec)
+    if angle < 1e-12:
+        return np.array([0.0, 0.0, 0.0, 1.0])
+    return np.append(rot_vec / angle * np.sin(angle / 2), np.cos(angle / 2))
+
+
+def _quaternion_to_rot_vec(q):
+    """ (3, 1) rotation vector of a (not necessarily unit) quaternion """
+    sin = np.linalg.norm(q[:3])
+    if sin < 1e-12:
+        return np.zeros((3, 1))
+    angle = 2 * np.arctan2(sin, q[3])
+    return (q[:3] / sin * angle).reshape(3, 1)
+
+
+class FacePoseTracker():
+    """ Face pose of a body over consecutive frames.
+
+        The first pose is solved from scratch (EPnP). The next ones are
+        only refined with at most max_iterations Levenberg-Marquardt
+        iterations, starting from the previous pose, which is cheaper.
+        Poses with a RMS reprojection error above max_reprojection_error
+        pixels, or behind the camera, are rejected, and the next pose is
+        solved from scratch again.
+
+        The returned poses are filtered over time with the smoothing
+        method of SmoothingStage ("one_euro", "kalman" or "none"): the
+        translation, and the rotation as a quaternion. The refinement
+        starts from the unfiltered pose. """
+
+    def __init__(self, max_iterations=3, max_reprojection_error=8.0,
+                 smoothing="none"):
+        self.criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT,
+                         max_iterations,
+                         1e-6)
+        self.max_reprojection_error = max_reprojection_error
+        self.smoothing = SmoothingStage(smoothing)
+        self.reset()
+
+    def reset(self):
+        self.rot_vec = None
+        self.trans_vec = None
+        # rotation matrix of the latest returned (filtered) pose
+        self.rotation = None
+        self.quaternion = None
+        self.smoothing.reset()
+
+    def __call__(self, face_landmarks, image_width, image_height, K, t):
+        """ Pose of the face of the (N, 4) face mesh landmarks array, in
+            normalized coordinates of an image of the given size taken
+            by a camera of intrinsic matrix K, at time t (in seconds).
+            Returns the translation vector (in mm) and the Euler angles
+            (in degrees), or None if the pose is rejected. """
+        points_2D = face_landmarks[FACE_MESH_POINTS, :2] \
+            * [image_width, image_height]
+
+        if self.rot_vec is None:
+            _, rot_vec, trans_vec = cv2.solvePnP(
+                points_3D,
+                points_2D,
+                K,
+                None,
+                flags=cv2.SOLVEPNP_EPNP)
+        else:
+            rot_vec, trans_vec = self.rot_vec, self.trans_vec
+        rot_vec, trans_vec = cv2.solvePnPRefineLM(
+            points_3D,
+            points_2D,
+            K,
+            None,
+            rot_vec.copy(),
+            trans_vec.copy(),
+            criteria=self.criteria)
+
+        projected, _ = cv2.projectPoints(points_3D, rot_vec, trans_vec, K,
+                                         None)
+        error = np.sqrt(np.mean(
+            np.sum((projected[:, 0] - points_2D) ** 2, axis=1)))
+        if not error <= self.max_reprojection_error \
+                or not trans_vec[2, 0] > 0:
+            self.reset()
+            return None
+        self.rot_vec = rot_vec
+        self.trans_vec = trans_vec
+
+        if self.smoothing.method != "none":
+            q = _rot_vec_to_quaternion(rot_vec)
+            # q and -q are the same rotation: keeping the quaternions on
+            # the same side for the filters
+            if self.quaternion is not None \
+                    and np.dot(q, self.quaternion) < 0:
+                q = -q
+            self.quaternion = self.smoothing("face_rotation", t, q)
+            rot_vec = _quaternion_to_rot_vec(self.quaternion)
+            trans_vec = self.smoothing(
+                "face_translation", t, np.ravel(trans_vec)).reshape(3, 1)
+
+        self.rotation, _ = cv2.Rodrigues(rot_vec)
+        angles = cv2.RQDecomp3x3(self.rotation)[0]
+        return trans_vec, angles
@@ -0,0 +1,160 @@
+import copy
+import xml.etree.ElementTree as ET
+
+import numpy as np
+from geometry_msgs.msg import TransformStamped
+
+from hri_fullbody.utils import quaternion_from_euler, \
+    quaternion_multiply, quaternion_about_axis
+
+MOVABLE_JOINT_TYPES = ("revolute", "continuous", "prismatic")
+
+
+class URDFJoint():
+
+    def __init__(self, name, joint_type, parent, child, xyz, rpy, axis,
+                 lower=-np.inf, upper=np.inf):
+        self.name = name
+        self.type = joint_type
+        self.parent = parent
+        self.child = child
+        self.translation = np.array(xyz, dtype=float)
+        self.rotation = quaternion_from_euler(*rpy)
+        axis = np.array(axis, dtype=float)
+        self.axis = axis / np.linalg.norm(axis)
+        self.lower = lower
+        self.upper = upper
+
+    @classmethod
+    def from_xml(cls, element):
+        origin = element.find("origin")
+        axis = element.find("axis")
+        limit = element.find("limit")
+        xyz = rpy = "0 0 0"
+        if origin is not None:
+            xyz = origin.get("xyz", xyz)
+            rpy = origin.get("rpy", rpy)
+        lower, upper = -np.inf, np.inf
+        if limit is not None and element.get("type") != "continuous":
+            lower = float(limit.get("lower", lower))
+            upper = float(limit.get("upper", upper))
+        return cls(
+            element.get("name"),
+            element.get("type"),
+            element.find("parent").get("link"),
+            element.find("child").get("link"),
+            [float(v) for v in xyz.split()],
+            [float(v) for v in rpy.split()],
+            [float(v) for v in axis.get("xyz").split()]
+            if axis is not None else [1.0, 0.0, 0.0],
+            lower,
+            upper)
+
+    def renamed(self, old, new):
+        """ Copy of the joint with old replaced by new in the joint and
+            links names. The origin and axis arrays are shared """
+        joint = copy.copy(self)
+        joint.name = self.name.replace(old, new)
+        joint.parent = self.parent.replace(old, new)
+        joint.child = self.child.replace(old, new)
+        return joint
+
+    def transform(self, position=0.0):
+        """ Transform between the joint parent and child links,
+            as a (translation, quaternion) pair """
+        if self.type in ("revolute", "continuous"):
+            return self.translation, quaternion_multiply(
+                self.rotation,
+                quaternion_about_axis(position, self.axis))
+        if self.type == "prismatic":
+            # rotate the joint axis in the parent link frame
+            u, w = self.rotation[0:3], self.rotation[3]
+            v = self.axis * position
+            uv = np.cross(u, v)
+            return self.translation + v + 2 * (w * uv + np.cross(u, uv)), \
+                self.rotation
+        return self.translation, self.rotation
+
+
+def _make_transform(joint, translation, rotation, stamp):
+    t = TransformStamped()
+    t.header.frame_id = joint.parent
+    t.child_frame_id = joint.child
+    return _set_transform(t, translation, rotation, stamp)
+
+
+def _set_transform(t, translation, rotation, stamp):
+    t.header.stamp = stamp
+    t.transform.translation.x = float(translation[0])
+    t.transform.translation.y = float(translation[1])
+    t.transform.translation.z = float(translation[2])
+    t.transform.rotation.x = float(rotation[0])
+    t.transform.rotation.y = float(rotation[1])
+    t.transform.rotation.z = float(rotation[2])
+    t.transform.rotation.w = float(rotation[3])
+    return t
+
+
+class URDFKinematics():
+    """ In-process replacement of robot_state_publisher for a URDF
+        model: computes the transforms between the model links from
+        the joint positions, ready to be sent on TF """
+
+    def __init__(self, urdf):
+        robot = ET.fromstring(urdf)
+        joints = [URDFJoint.from_xml(j) for j in robot.findall("joint")]
+        self.joints = joints
+        self.movable_joints = [
+            j for j in joints if j.type in MOVABLE_JOINT_TYPES]
+        self.fixed_joints = [
+            j for j in joints if j.type not in MOVABLE_JOINT_TYPES]
+
+    def renamed(self, old, new):
+        """ Kinematics of the same model with old replaced by new
+            in all the joints and links names """
+        kinematics = copy.copy(self)
+        kinematics.joints = [j.renamed(old, new) for j in self.joints]
+        kinematics.movable_joints = [
+            j for j in kinematics.joints if j.type in MOVABLE_JOINT_TYPES]
+        kinematics.fixed_joints = [
+            j for j in kinematics.joints
+            if j.type not in MOVABLE_JOINT_TYPES]
+        return kinematics
+
+    def chain(self, base_joint):
+        """ Serial chain of joints starting at base_joint and following
+            the first child joint of each link, as ikpy does when
+            building a chain from a URDF file """
+        joints = [next(j for j in self.joints if j.name == base_joint)]
+        while True:
+            children = [j for j in self.joints
+                        if j.parent == joints[-1].child]
+            if not children:
+                return joints
+            joints.append(children[0])
+
+    def static_transforms(self, stamp):
+        """ Transforms of the fixed joints, to be published once
+            on the static TF topic """
+        return [_make_transform(j, j.translation, j.rotation, stamp)
+                for j in self.fixed_joints]
+
+    def transforms(self, joint_positions, stamp, transforms=None):
+        """ Transforms of the movable joints. joint_positions maps
+            joint names to positions; missing joints are set to 0.
+
+            When transforms, a list previously returned by this method,
+            is given, its messages are updated in place and returned
+            instead of new ones """
+        if transforms is None:
+            return [_make_transform(
+                        joint,
+                        *joint.transform(joint_positions.get(joint.name, 0.0)),
+                        stamp)
+                    for joint in self.movable_joints]
+        for joint, t in zip(self.movable_joints, transforms):
+            _set_transform(
+                t,
+                *joint.transform(joint_positions.get(joint.name, 0.0)),
+                stamp)
+        return transforms
@@ -0,0 +1,165 @@
+import collections
+import threading
+
+import numpy as np
+from cv_bridge import CvBridge
+from message_filters import ApproximateTimeSynchronizer, Subscriber
+from rclpy.callback_groups import MutuallyExclusiveCallbackGroup
+from sensor_msgs.msg import Image, CameraInfo, RegionOfInterest
+from tf2_ros import TransformBroadcaster
+
+from hri_fullbody.batched_ik import IKBatch
+from hri_fullbody.image_conversion import decode_imgmsg, to_rgb
+from hri_fullbody.profiling import StageTimer
+from hri_fullbody.tf_batch import TransformBatch
+
+# Synchronization of the frames with the bodies ROIs: latest ROIs kept
+# per body, and largest time difference (in seconds) between a frame and
+# the ROI it is cropped with, as in the per-body synchronizers
+ROI_QUEUE_SIZE = 10
+ROI_SLOP = 0.1
+
+
+def _stamp_to_seconds(stamp):
+    return stamp.sec + stamp.nanosec / 1e9
+
+
+def _closest_roi(rois, stamp, slop):
+    """ ROI of the (stamp, ROI) pairs closest in time to stamp, None if
+        none is within slop seconds, or if it is empty """
+    best = None
+    best_delay = slop
+    for roi_stamp, roi in rois:
+        delay = abs(roi_stamp - stamp)
+        if delay <= best_delay and roi.width and roi.height:
+            best, best_delay = roi, delay
+    return best
+
+
+class MultibodyFrameBatcher():
+    """ Batched multi-body mode: processes all the bodies of a camera
+        frame in a single pass, instead of one FullbodyDetector
+        subscribing to each body's cropped image stream.
+
+        The full frame is decoded once, the body crops are cut out of
+        it from the ROI of each body (as published by the body tracker)
+        closest in time to the frame, and converted to RGB (after their
+        downscaling to input_max_size, if any), and all the crops are
+        submitted together to the Holistic pool, which runs them in
+        parallel on its models. The landmarks of each crop are then
+        handed over to the body's FullbodyDetector (see
+        FullbodyDetector.process_crop), which publishes the results on
+        the body topics. The batched IK of all the bodies is solved in a
+        single pass, and their TF frames are sent together, in one
+        message per frame (the detectors are created with the batcher
+        ik_batch and tf_batch). """
+
+    def __init__(self, node, holistic_pool, use_depth, profiling=False,
+                 input_max_size=0, ik_tolerance=1e-3, ik_max_iterations=20):
+        self.node = node
+        self.holistic_pool = holistic_pool
+        self.use_depth = use_depth
+        self.input_max_size = input_max_size
+        self.timer = StageTimer(profiling)
+        self.br = CvBridge()
+        self.callback_group = MutuallyExclusiveCallbackGroup()
+        self.tf_batch = TransformBatch(TransformBroadcaster(node))
+        self.ik_batch = IKBatch(ik_tolerance, ik_max_iterations)
+        # body id -> [detector, ROI subscription, latest (stamp, ROI)],
+        # bodies being added and removed by the node from other threads
+        self.bodies = {}
+        self.bodies_lock = threading.Lock()
+
+        subscribers = [
+            Subscriber(node, Image, "/image",
+                       callback_group=self.callback_group),
+            Subscriber(node, CameraInfo, "/camera_info",
+                       callback_group=self.callback_group)]
+        if use_depth:
+            subscribers += [
+                Subscriber(node, Image, "/depth_image",
+                           callback_group=self.callback_group),
+                Subscriber(node, CameraInfo, "/depth_info",
+                           callback_group=self.callback_group)]
+        self.tss = ApproximateTimeSynchronizer(subscribers, 10, 0.1)
+        self.tss.registerCallback(self.frame_callback)
+
+    def add_body(self, body_id, detector):
+        body = [detector, None, collections.deque(maxlen=ROI_QUEUE_SIZE)]
+
+        # ROIs have no header: they are stamped with their reception
+        # time, as done by the synchronizers for headerless messages
+        def roi_callback(roi):
+            body[2].append(
+                (self.node.get_clock().now().nanoseconds / 1e9, roi))
+
+        body[1] = self.node.create_subscription(
+            RegionOfInterest,
+            "/humans/bodies/%s/roi" % body_id,
+            roi_callback,
+            1,
+            callback_group=self.callback_group)
+        with self.bodies_lock:
+            self.bodies[body_id] = body
+
+    def remove_body(self, body_id):
+        with self.bodies_lock:
+            _, roi_sub, _ = self.bodies.pop(body_id)
+        self.node.destroy_subscription(roi_sub)
+
+    def frame_callback(self, rgb_img, rgb_info, depth_img=None,
+                       depth_info=None):
+
+        # bodies without a ROI close enough to the frame are skipped
+        stamp = _stamp_to_seconds(rgb_img.header.stamp)
+        with self.bodies_lock:
+            bodies = list(self.bodies.values())
+        bodies = [(detector, _closest_roi(list(rois), stamp, ROI_SLOP))
+                  for detector, _, rois in bodies]
+        bodies = [(detector, roi) for detector, roi in bodies
+                  if roi is not None]
+        if not bodies:
+            return
+
+        # decoding once per camera frame, then downscaling and color
+        # conversion of the body crops only
+        with self.timer.stage("image_conversion"):
+            image, conversion = decode_imgmsg(self.br, rgb_img)
+            image_depth = self.br.imgmsg_to_cv2(depth_img, "16UC1") \
+                if self.use_depth else None
+        with self.timer.stage("color_conversion"):
+            crops = [image[roi.y_offset:roi.y_offset + roi.height,
+                           roi.x_offset:roi.x_offset + roi.width]
+                     for _, roi in bodies]
+            # ROIs outside of the frame leave nothing to process
+            kept = [idx for idx, crop in enumerate(crops) if crop.size]
+            if not kept:
+                return
+            bodies = [bodies[idx] for idx in kept]
+            crops = [crops[idx] for idx in kept]
+            sizes = [(crop.shape[1], crop.shape[0]) for crop in crops]
+            crops = [np.ascontiguousarray(
+                to_rgb(crop, conversion, self.input_max_size))
+                for crop in crops]
+
+        # all the crops are submitted before waiting for any result
+        with self.timer.stage("holistic"):
+            futures = [self.holistic_pool.submit(crop) for crop in crops]
+            landmarks = [future.result() for future in futures]
+
+        header = rgb_info.header
+        for (detector, roi), crop, size, body_landmarks in zip(
+                bodies, crops, sizes, landmarks):
+            detector.process_crop(
+                body_landmarks,
+                crop,
+                header,
+                rgb_info,
+                roi,
+                image_depth,
+                depth_info,
+                size)
+        with self.timer.stage("ik"):
+            self.ik_batch.solve()
+        with self.timer.stage("tf_publish"):
+            self.tf_batch.flush()
@@ -1,43 +1,38 @@
-import io
-import os
-from ikpy import chain
 from hri_fullbody.utils import quaternion_from_euler
 from hri_fullbody.jointstate import compute_jointstate, \
-    HUMAN_JOINT_NAMES, compute_jointstate
-from hri_fullbody.rs_to_depth import rgb_to_xyz  # SITW
-from hri_fullbody.urdf_generator import make_urdf_human
-from hri_fullbody.protobuf_to_dict import protobuf_to_dict
-from hri_fullbody.one_euro_filter import OneEuroFilter
-from hri_fullbody.face_pose_estimation import face_pose_estimation
+    HUMAN_JOINT_NAMES, IK_SOLVERS, compute_jointstate_batched, \
+    limbs_targets, limbs_initial_guess, limbs_jointstate
+from hri_fullbody.rs_to_depth import DepthRegistration  # SITW
+from hri_fullbody.depth_sampling import DEPTH_STATISTICS
+from hri_fullbody.landmarks import X, Y, Z
+from hri_fullbody.one_euro_filter import OneEuroFilterArray
+from hri_fullbody.smoothing import SmoothingStage
+from hri_fullbody.profiling import StageTimer
+from hri_fullbody.scheduler import LatestOnlyScheduler
+from hri_fullbody.face_pose_estimation import FacePoseTracker
+from hri_fullbody.holistic_pool import HolisticPool
+from hri_fullbody.image_conversion import decode_imgmsg, to_rgb
+from hri_fullbody.roi_cropping import RoiCropper
+from hri_fullbody.tf_batch import TransformBatch, StaticTransforms, \
+    make_transform, set_transform
+from hri_fullbody.body_messages import BodyMessages
+from hri_fullbody.demand import OutputDemand
+from hri_fullbody.human_model import get_human_model_template
 import math
 import numpy as np
-import sys
-import tempfile
 import copy
-import subprocess
-import launch
-import xacro
-from ros2launch.api import get_share_file_path_from_package
-from launch_ros.actions import Node
-from ament_index_python.packages import PackageNotFoundError, get_package_share_directory
-
+import threading
 
 import rclpy
-from tf2_ros import TransformBroadcaster
+from rclpy.callback_groups import MutuallyExclusiveCallbackGroup
+from tf2_ros import TransformBroadcaster, StaticTransformBroadcaster
 
 from sensor_msgs.msg import Image, CameraInfo, RegionOfInterest
 from sensor_msgs.msg import JointState
-from hri_msgs.msg import Skeleton2D, NormalizedPointOfInterest2D, IdsList
+from hri_msgs.msg import Skeleton2D, IdsList
 from message_filters import ApproximateTimeSynchronizer, Subscriber
-from geometry_msgs.msg import TwistStamped, PointStamped, TransformStamped
+from geometry_msgs.msg import TwistStamped, PointStamped
 from cv_bridge import CvBridge
-import cv2
-
-import mediapipe as mp
-
-mp_face_detection = mp.solutions.face_detection
-mp_holistic = mp.solutions.holistic
-mp_pose = mp.solutions.pose
 
 # One Euro Filter parameters
 BETA_POSITION=0.05 
@@ -102,14 +97,6 @@ ros4hri_to_mediapipe[Skeleton2D.RIGHT_HIP] = MP_RIGHT_HIP
 ros4hri_to_mediapipe[Skeleton2D.RIGHT_KNEE] = MP_RIGHT_KNEE
 ros4hri_to_mediapipe[Skeleton2D.RIGHT_ANKLE] = MP_RIGHT_ANKLE
 
-# Mediapipe face mesh indexing (partial)
-FM_NOSE = 1 
-FM_MOUTH_CENTER = 13 
-FM_RIGHT_EYE = 159 
-FM_RIGHT_EAR_TRAGION = 234 
-FM_LEFT_EYE = 386 
-FM_LEFT_EAR_TRAGION = 454
-
 
 def _normalized_to_pixel_coordinates(
         normalized_x: float, normalized_y: float, image_width: int,
@@ -120,47 +107,25 @@ def _normalized_to_pixel_coordinates(
     return x_px, y_px
 
 
-def _make_2d_skeleton_msg(header, pose_2d):
-    skel = Skeleton2D()
-    skel.header = header
-    _ = NormalizedPointOfInterest2D()
-    skel.skeleton = [_] * 18
+# Offsets of the single body mode images, never modified
+_FULL_FRAME_ROI = RegionOfInterest()
+
 
-    for idx, human_joint in enumerate(ros4hri_to_mediapipe):
-        if human_joint is not None:
-            skel.skeleton[idx] = NormalizedPointOfInterest2D(
-                x=pose_2d[human_joint].get('x'),
-                y=pose_2d[human_joint].get('y'),
-                c=pose_2d[human_joint].get('visibility'))
+def _normalized_to_pixel_array(points, image_width, image_height):
+    """ Vectorized _normalized_to_pixel_coordinates, for a (N, 2)
+        array of normalized x, y coordinates """
 
-    # There is no Neck landmark in Mediapipe pose estimation
-    # However, we can think of the neck point as the average
-    # point between left and right shoulder.
-    msg = NormalizedPointOfInterest2D()
-    msg.x = (skel.skeleton[Skeleton2D.LEFT_SHOULDER].x + skel.skeleton[Skeleton2D.RIGHT_SHOULDER].x)/2
-    msg.y = (skel.skeleton[Skeleton2D.LEFT_SHOULDER].y + skel.skeleton[Skeleton2D.RIGHT_SHOULDER].y)/2
-    msg.x = min(skel.skeleton[Skeleton2D.LEFT_SHOULDER].c, skel.skeleton[Skeleton2D.RIGHT_SHOULDER].c)
+    pixels = np.floor(points * [image_width, image_height]).astype(int)
+    return np.minimum(pixels, [image_width - 1, image_height - 1])
 
-    skel.skeleton[Skeleton2D.NECK] = msg
 
-    return skel
+def _stamp_to_seconds(stamp):
+    return stamp.sec + stamp.nanosec / 1e9
 
 
 def _get_bounding_box_limits(landmarks, image_width, image_height):
-    x_max = 0.0
-    y_max = 0.0
-    x_min = 1.0
-    y_min = 1.0
-    # for result in results:
-    for data_point in landmarks:
-        if x_max < data_point.x:
-            x_max = data_point.x
-        if y_max < data_point.y:
-            y_max = data_point.y
-        if x_min > data_point.x:
-            x_min = data_point.x
-        if y_min > data_point.y:
-            y_min = data_point.y
+    x_min, y_min = np.minimum(landmarks[:, [X, Y]].min(axis=0), 1.0)
+    x_max, y_max = np.maximum(landmarks[:, [X, Y]].max(axis=0), 0.0)
 
     x_min, y_min = _normalized_to_pixel_coordinates(
         x_min, y_min, image_width, image_height)
@@ -169,6 +134,16 @@ def _get_bounding_box_limits(landmarks, image_width, image_height):
     return x_min, y_min, x_max, y_max
 
 
+def _get_person_bounding_box(landmarks_list, image_width, image_height):
+    """ Bounding box of all the available (not None) landmark arrays in
+        landmarks_list, computed in a single min/max reduction """
+    landmarks_list = [lm for lm in landmarks_list if lm is not None]
+    if not landmarks_list:
+        return image_width, image_height, 0, 0
+    return _get_bounding_box_limits(
+        np.concatenate(landmarks_list), image_width, image_height)
+
+
 class FullbodyDetector():
 
     def __init__(self,
@@ -177,37 +152,109 @@ class FullbodyDetector():
                  stickman_debug,
                  body_id,
                  single_body=False,
-                 min_detection=0.7):
+                 min_detection=0.7,
+                 holistic_pool=None,
+                 tracking=False,
+                 tracking_roi_jump=0.5,
+                 ik_solver="batched",
+                 ik_tolerance=1e-3,
+                 ik_max_iterations=20,
+                 depth_window=5,
+                 depth_statistic="median",
+                 smoothing="none",
+                 profiling=False,
+                 latest_only=False,
+                 input_max_size=0,
+                 roi_cropping=False,
+                 roi_margin=0.25,
+                 roi_min_confidence=0.5,
+                 tf_batch=None,
+                 static_tf=None,
+                 ik_batch=None,
+                 demand_driven=False,
+                 subscribe=True):
 
         self.node = node
+        # Per-stage latency statistics, published on /diagnostics by
+        # the node when profiling is enabled
+        self.timer = StageTimer(profiling)
+        # With latest_only, the synchronized frames are processed in a
+        # dedicated thread, the newest one first, dropping the frames
+        # received while the previous one was being processed
+        self.latest_only = latest_only
+        self.scheduler = None
         self.use_depth = use_depth
         self.stickman_debug = stickman_debug
         self.single_body = single_body
         self.multi_body = not single_body
         self.skeleton_to_set = single_body
-
-        self.detector = mp_holistic.Holistic(
-            min_detection_confidence=min_detection, static_image_mode=True)
+        # "batched": vectorized IK solving the four limbs in one pass,
+        # "ikpy": one ikpy optimization per limb
+        if ik_solver not in IK_SOLVERS:
+            raise ValueError("Unknown IK solver: %s" % ik_solver)
+        self.use_batched_ik = ik_solver == "batched"
+        # The IK of each frame is warm-started from the previous frame
+        # joint state. Tolerance (m) and iterations cap only apply to
+        # the batched solver.
+        self.ik_tolerance = ik_tolerance
+        self.ik_max_iterations = ik_max_iterations
+        self.previous_jointstate = None
+        self.ik_solves = 0
+        self.ik_iterations = 0
+        # In batched multi-body mode, the batched IK of the bodies of a
+        # frame is queued in the node ik_batch, and solved for all of
+        # them at once (see finish_jointstate)
+        self.ik_batch = ik_batch if self.use_batched_ik else None
+
+        # Holistic inference runs on a pool shared between all the bodies
+        # handled by the node. A detector created without one gets its
+        # own single-model pool.
+        self.owns_holistic_pool = holistic_pool is None
+        if self.owns_holistic_pool:
+            holistic_pool = HolisticPool(1, min_detection)
+        self.detector = holistic_pool
+
+        # In tracking mode, Holistic keeps state between frames and only
+        # runs its full pose detector when the track is lost. We also force
+        # a re-detection when the person bounding box jumps by more than
+        # tracking_roi_jump times its previous diagonal.
+        self.tracking = tracking and not holistic_pool.static_image_mode
+        self.tracking_roi_jump = tracking_roi_jump
+        self.prev_person_box = None
+
+        # In single body mode without tracking, Holistic can run on the
+        # region of the person found in the previous frames only (see
+        # RoiCropper). Tracking mode already does its own cropping.
+        self.roi_cropper = None
+        if roi_cropping and single_body and not self.tracking:
+            self.roi_cropper = RoiCropper(roi_margin, roi_min_confidence)
+        self.prev_crop = None
 
         self.from_depth_image = False
 
-        self.x_min_face = 1.00
-        self.y_min_face = 1.00
-        self.x_max_face = 0.00
-        self.y_max_face = 0.00
-
-        self.x_min_body = 1.00
-        self.y_min_body = 1.00
-        self.x_max_body = 0.00
-        self.y_max_body = 0.00
-
         self.human_description = ''
+        self.depth_registration = None
+        # The depth of each keypoint is the median (or trimmed mean) of
+        # the valid depth pixels in a depth_window x depth_window window
+        # around it, robust to holes and to keypoints falling on edges
+        self.depth_window = depth_window
+        if depth_statistic not in DEPTH_STATISTICS:
+            raise ValueError("Unknown depth statistic: %s" % depth_statistic)
+        self.depth_statistic = depth_statistic
+        # Images are downscaled to input_max_size pixels (largest side)
+        # before their color conversion and Holistic inference, 0 to
+        # keep their full resolution. The landmarks are normalized, and
+        # mapped to the pixels of the original image.
+        self.input_max_size = input_max_size
         self.body_position_estimation = [None] * 3
         # trans_vec ==> vector representing the translational component
         # of the homoegenous transform obtained solving the PnP problem
         # between the camera optical frame and the face frame. 
         self.trans_vec = [None] * 3
         self.valid_trans_vec = False
+        # The face PnP of each frame is warm-started from the previous
+        # frame pose, and the face pose smoothed like the keypoints
+        self.face_pose_tracker = FacePoseTracker(smoothing=smoothing)
 
         self.js_topic = "/humans/bodies/" + body_id + "/joint_states"
         skel_topic = "/humans/bodies/" + body_id + "/skeleton2d"
@@ -217,27 +264,119 @@ class FullbodyDetector():
         self.br = CvBridge()
 
         self.body_id = body_id
+        # Messages published for this body, updated in place every frame
+        self.messages = BodyMessages(
+            body_id, HUMAN_JOINT_NAMES, ros4hri_to_mediapipe)
+
+        # The transforms of each frame are sent in a single TFMessage,
+        # gathering all the bodies of the frame in batched multi-body
+        # mode (the batch is then shared and flushed by the node)
+        self.owns_tf_batch = tf_batch is None
+        if self.owns_tf_batch:
+            tf_batch = TransformBatch(TransformBroadcaster(self.node))
+        self.tf_batch = tf_batch
+        # Likewise, the static transforms of the bodies are sent by a
+        # single /tf_static publisher shared by the node
+        self.owns_static_tf = static_tf is None
+        if self.owns_static_tf:
+            static_tf = StaticTransforms(StaticTransformBroadcaster(self.node))
+        self.static_tf = static_tf
+        self.kinematics = None
+        self.link_transforms = None
 
         if self.multi_body:
             # URDF model settings, kinematic chains generation and
-            # robot_state_publisher initialization
+            # forward kinematics initialization
             self.skeleton_generation()
 
-        self.tb = TransformBroadcaster(self.node)
-        self.one_euro_filter = [None] * 3
-        self.one_euro_filter_dot = [None] * 3
+        # Smoothing of the published 2D skeleton and of the 3D
+        # keypoints, hence of the joint angles and body orientation
+        # computed from them ("one_euro", "kalman" or "none")
+        self.smoothing = SmoothingStage(smoothing)
+
+        # Body position and velocity filters, x, y, z channels (too few
+        # for a OneEuroFilterBank to pay off)
+        self.position_filter = OneEuroFilterArray(
+            3,
+            min_cutoff=MIN_CUTOFF_POSITION,
+            beta=BETA_POSITION,
+            d_cutoff=D_CUTOFF_POSITION)
+        self.velocity_filter = OneEuroFilterArray(
+            3,
+            min_cutoff=MIN_CUTOFF_VELOCITY,
+            beta=BETA_VELOCITY,
+            d_cutoff=D_CUTOFF_VELOCITY)
+
+        # All the callbacks of a body run in its own mutually exclusive
+        # group: with a multi-threaded executor, bodies are processed in
+        # parallel, but the frames of a body are processed one at a time
+        self.callback_group = MutuallyExclusiveCallbackGroup()
+        self.registered = True
+        self.lock = threading.Lock()
+
+        # In batched multi-body mode, the node dispatches the frames to
+        # the bodies itself (see process_crop)
+        self.image_subscriber = None
+        if subscribe:
+            self.create_subscriptions()
+
+        if single_body:
+            self.ids_pub = self.node.create_publisher(
+                IdsList,
+                "/humans/bodies/tracked",
+                1
+                )
+            self.roi_pub = self.node.create_publisher(
+                RegionOfInterest,
+                "/humans/bodies/"+body_id+"/roi",
+                1)
+
+        self.body_filtered_position = np.full(3, np.nan)  # x, y ,z
+
+        self.position_msg = PointStamped()
+        filtered_position_topic = "/humans/bodies/"+body_id+"/position"
+        self.body_filtered_position_pub = self.node.create_publisher( 
+            PointStamped,
+            filtered_position_topic,
+            1,)
+        self.velocity_msg = TwistStamped()
+        self.velocity_msg.header.frame_id = "body_"+body_id
+        twist_topic = "/humans/bodies/"+body_id+"/velocity"
+        self.velocity_pub = self.node.create_publisher(
+            TwistStamped,
+            twist_topic,
+            1)
 
+        # In demand-driven mode, the processing stages only run when
+        # their outputs (or the outputs of the stages depending on them)
+        # have subscribers. The counts are refreshed by the node.
+        self.demand = OutputDemand(
+            self.node,
+            {"skeleton2d": skel_topic,
+             "joint_states": self.js_topic,
+             "position": filtered_position_topic,
+             "velocity": twist_topic,
+             "tf": "/tf"},
+            demand_driven)
+        self.need_tf = True
+        self.need_ik = True
+
+    def create_subscriptions(self):
+        """ Subscribe to the image streams of the body, synchronized and
+            processed by the image_callback_* methods """
         if self.multi_body:
             self.image_subscriber = Subscriber(
                                         self.node,
                                         Image,
-                                        "/humans/bodies/"+self.body_id+"/cropped"                                        
+                                        "/humans/bodies/"+self.body_id+"/cropped",
+                                        callback_group=self.callback_group
                                         )
                                         # buff_size=2**24)
         else:
             self.image_subscriber = Subscriber(self.node,
                                         Image,
-                                        "/image",                                        
+                                        "/image",
+                                        callback_group=self.callback_group
                                         )
                                         # buff_size=2**24)
 
@@ -247,120 +386,101 @@ class FullbodyDetector():
                     self.image_subscriber,
                     Subscriber(self.node,
                         CameraInfo,
-                        "/camera_info"                        
+                        "/camera_info",
+                        callback_group=self.callback_group
                         ),
                     Subscriber(self.node,
                         RegionOfInterest,
-                        "/humans/bodies/"+self.body_id+"/roi"
+                        "/humans/bodies/"+self.body_id+"/roi",
+                        callback_group=self.callback_group
                         ),
                     Subscriber(self.node,
                         Image,
-                        "/depth_image"                       
+                        "/depth_image",
+                        callback_group=self.callback_group
                         ),
                         # buff_size=2**24),
                     Subscriber(self.node,
                         CameraInfo,
-                        "/depth_info"
+                        "/depth_info",
+                        callback_group=self.callback_group
                         )
                 ],
                 10,
                 0.1,
                 allow_headerless=True
             )
-            self.tss.registerCallback(self.image_callback_depth)
+            self.tss.registerCallback(self.scheduled(self.image_callback_depth))
         elif not self.use_depth and self.multi_body:
             self.tss = ApproximateTimeSynchronizer(
                 [
                     self.image_subscriber,
                     Subscriber(self.node,
                         CameraInfo,
-                        "/camera_info"
+                        "/camera_info",
+                        callback_group=self.callback_group
                         )
                 ],
                 10,
                 0.2
             )
-            self.tss.registerCallback(self.image_callback_rgb)
-        elif self.use_depth and single_body:
+            self.tss.registerCallback(self.scheduled(self.image_callback_rgb))
+        elif self.use_depth and self.single_body:
             # Here the code to detect one person only with depth information
             self.tss = ApproximateTimeSynchronizer(
                 [
                     self.image_subscriber,
                     Subscriber(self.node,
                         CameraInfo,
-                        "/camera_info"
+                        "/camera_info",
+                        callback_group=self.callback_group
                         ),
                     Subscriber(self.node,
                         Image,
-                        "/depth_image"                     
+                        "/depth_image",
+                        callback_group=self.callback_group
                         ),
                         # buff_size=2**24),
                     Subscriber(self.node,
                         CameraInfo,
-                        "/depth_info"
+                        "/depth_info",
+                        callback_group=self.callback_group
                         )
                 ],
                 10,
                 0.1,
                 allow_headerless=True
             )
-            self.tss.registerCallback(self.image_callback_depth_single_person)
+            self.tss.registerCallback(self.scheduled(self.image_callback_depth_single_person))
         else:
             self.tss = ApproximateTimeSynchronizer(
                 [
                     self.image_subscriber,
                     Subscriber(self.node,
                         CameraInfo,
-                        "/camera_info"
+                        "/camera_info",
+                        callback_group=self.callback_group
                         )
                 ],
                 10,
                 0.2
             )
-            self.tss.registerCallback(self.image_callback_rgb)
-
-        if single_body:
-            self.ids_pub = self.node.create_publisher(
-                IdsList,
-                "/humans/bodies/tracked",
-                1
-                )
-            self.roi_pub = self.node.create_publisher(
-                RegionOfInterest,
-                "/humans/bodies/"+body_id+"/roi",
-                1)
-
-        self.body_filtered_position = [None] * 3  # x, y ,z
-        self.body_filtered_position_prev = [None] * 3 # x, y, z
-        self.body_vel_estimation = [None] * 3
-        self.body_vel_estimation_filtered = [None] * 3
-
-        self.position_msg = PointStamped()
-        filtered_position_topic = "/humans/bodies/"+body_id+"/position"
-        self.body_filtered_position_pub = self.node.create_publisher( 
-            PointStamped,
-            filtered_position_topic,
-            1,)
-        self.velocity_msg = TwistStamped()
-        self.velocity_msg.header.frame_id = "body_"+body_id
-        twist_topic = "/humans/bodies/"+body_id+"/velocity"
-        self.velocity_pub = self.node.create_publisher(
-            TwistStamped,
-            twist_topic,
-            1)
-           
+            self.tss.registerCallback(self.scheduled(self.image_callback_rgb))
 
         self.image_info_sub = self.node.create_subscription(
             CameraInfo,
             "camera_info",
-            self.camera_info_callback,1)
-        
+            self.camera_info_callback,
+            1,
+            callback_group=self.callback_group)
 
     def skeleton_generation(self):
         """ Generate a URDF model for this body, set it on the 
-            ROS parameter server and spawn a new robot_state_publisher,
-            which will publish the TF frames for this body"""
-        self.urdf = make_urdf_human(self.body_id)
+            ROS parameter server and set up the forward kinematics
+            used to publish the TF frames of this body. The model is
+            stamped out from a template shared by all the bodies """
+        template = get_human_model_template()
+        self.urdf = template.make_urdf(self.body_id)
         self.node.get_logger().info("Setting URDF description for body"
                       "<%s> (param name: human_description_%s)" % (
                           self.body_id, self.body_id))
@@ -373,40 +493,11 @@ class FullbodyDetector():
         )
         self.node.declare_parameter(self.human_description, self.urdf)
         self.node.set_parameters([human_param])
- 
 
-        self.urdf_file = io.StringIO(self.urdf)
-        self.r_arm_chain = chain.Chain.from_urdf_file(
-            self.urdf_file,
-            base_elements=[
-                "r_y_shoulder_%s" % self.body_id],
-            base_element_type="joint",
-            active_links_mask=[False, True, True, True, True, False])
-        self.urdf_file.seek(0)
-        self.l_arm_chain = chain.Chain.from_urdf_file(
-            self.urdf_file,
-            base_elements=[
-                "l_y_shoulder_%s" % self.body_id],
-            base_element_type="joint",
-            active_links_mask=[False, True, True, True, True, False])
-        self.urdf_file.seek(0)
-        self.r_leg_chain = chain.Chain.from_urdf_file(
-            self.urdf_file,
-            base_elements=[
-                "r_y_hip_%s" % self.body_id],
-            base_element_type="joint",
-            active_links_mask=[False, True, True, True, True, False])
-        self.urdf_file.seek(0)
-        self.l_leg_chain = chain.Chain.from_urdf_file(
-            self.urdf_file,
-            base_elements=[
-                "l_y_hip_%s" % self.body_id],
-            base_element_type="joint",
-            active_links_mask=[False, True, True, True, True, False])
-        
-        with tempfile.NamedTemporaryFile(mode='w',suffix='.xacro', delete=False) as f:
-            f.write(self.urdf_file.getvalue())
-            urdf_file_path = f.name
+        (self.r_arm_chain,
+         self.l_arm_chain,
+         self.r_leg_chain,
+         self.l_leg_chain) = template.ik_chains
 
         self.ik_chains = {}  # maps a body id to the IKpy chains
         self.ik_chains[self.body_id] = [
@@ -415,31 +506,55 @@ class FullbodyDetector():
             self.r_leg_chain,
             self.l_leg_chain
         ]
-
-        self.node.get_logger().info(
-            "Spawning a instance of robot_state_publisher for this body...")
-
-        # robot state publisher has a frame prefix now
-        # todo (juandpenan) change tfs to just add a tf and thats it
-        cmd = ["ros2", "run", "robot_state_publisher", "robot_state_publisher",
-                urdf_file_path,
-                "--ros-args",
-                "-r",
-                "__ns:=/humans/bodies/%s" % self.body_id,
-                "-r",
-                "joint_states:=%s" % self.js_topic              
-               ]
-
-        self.node.get_logger().info("Executing: %s" % " ".join(cmd))
-        self.proc = subprocess.Popen(cmd, text=True)
-       
+        self.ik_solver = template.ik_solver
+
+        # The body links transforms are computed in-process from the
+        # joint states, in place of a robot_state_publisher per body.
+        # Fixed joints are only published once, as static transforms.
+        self.kinematics = template.make_kinematics(self.body_id)
+        stamp = self.node.get_clock().now().to_msg()
+        self.link_transforms = self.kinematics.transforms({}, stamp)
+        self.static_tf.set(
+            self.body_id,
+            self.kinematics.static_transforms(stamp)
+            + self.static_transforms(stamp))
+
+    def scheduled(self, callback):
+        """ The synchronized frames callback, guarded against concurrent
+            unregistration, and run through a LatestOnlyScheduler in
+            latest_only mode """
+
+        def locked_callback(*args):
+            with self.lock:
+                if self.registered:
+                    callback(*args)
+
+        if not self.latest_only:
+            return locked_callback
+        self.scheduler = LatestOnlyScheduler(
+            locked_callback,
+            self.timer,
+            self.node.get_logger(),
+            "body_%s_scheduler" % self.body_id)
+        return self.scheduler.submit
 
     def unregister(self):
+        if self.scheduler:
+            self.scheduler.close()
+        # the manager may unregister a body from another thread while
+        # one of its frames is being processed
+        with self.lock:
+            self.registered = False
         if self.node.has_parameter(self.human_description):
             self.node.undeclare_parameter(self.human_description)
-            self.node.get_logger().info('Deleted parameter %s', self.human_description)
-        self.proc.kill()
-        self.node.get_logger().warning('unregistered %s', self.body_id)
+            self.node.get_logger().info(
+                'Deleted parameter %s' % self.human_description)
+        self.static_tf.remove(self.body_id)
+        if self.owns_static_tf:
+            self.node.destroy_publisher(self.static_tf.broadcaster.pub_tf)
+        if self.owns_holistic_pool:
+            self.detector.close()
+        self.node.get_logger().warning('unregistered %s' % self.body_id)
 
     def camera_info_callback(self, cameraInfo):
         """ This callback gets called only once, the first time
@@ -460,6 +575,15 @@ class FullbodyDetector():
             self.c_y = self.K[1][2]
 
 
+    def update_depth_registration(self):
+        """ Rebuild the RGB to depth registration only when the
+            cameras intrinsics change """
+        if self.depth_registration is None \
+                or not self.depth_registration.matches(
+                    self.rgb_info, self.depth_info):
+            self.depth_registration = DepthRegistration(
+                self.rgb_info, self.depth_info)
+
     def face_to_body_position_estimation(self, skel_msg):
 
         body_px = [(skel_msg.skeleton[Skeleton2D.LEFT_HIP].x \
@@ -502,102 +626,53 @@ class FullbodyDetector():
                            header):
         """ Stickman debugging: publishing body parts tf frames directly
             using the estimation obtained from Mediapipe, or the one
-            used as an input for the IK/FK process """
-
-        t = TransformStamped()
-        t.header = header
-        t.child_frame_id = "mediapipe_torso_" + self.body_id
-        t.transform.translation.x = -torso[1] + torso_res[0]
-        t.transform.translation.y = torso[2]
-        t.transform.translation.z = torso[0] + torso_res[2]
-
-        q = quaternion_from_euler(np.pi/2, -theta, 0.0)
-
-        t.transform.rotation.x = q[0]
-        t.transform.rotation.y = q[1]
-        t.transform.rotation.z = q[2]
-        t.transform.rotation.w = q[3]
-
-        self.tb.sendTransform(t)
-
-        t.header.frame_id = "our_torso_" + self.body_id
-        t.child_frame_id = "mediapipe_torso_" + self.body_id
-        t.transform.translation.x = 0.0
-        t.transform.translation.y = 0.0
-        t.transform.translation.z = 0.605
-
-        q = quaternion_from_euler(0.0, 0.0, 0.0)
-
-        t.transform.rotation.x = q[0]
-        t.transform.rotation.y = q[1]
-        t.transform.rotation.z = q[2]
-        t.transform.rotation.w = q[3]
-
-        self.tb.sendTransform(t)
-
-        t.header.frame_id = "left_shoulder_"+self.body_id
-        t.child_frame_id = "our_torso_"+self.body_id
-        t.transform.translation.x = l_shoulder[0]
-        t.transform.translation.y = l_shoulder[1]
-        t.transform.translation.z = l_shoulder[2]
-
-        self.tb.sendTransform(t)
-        
-        t.header.frame_id = "right_shoulder_"+self.body_id
-        t.child_frame_id = "our_torso_"+self.body_id
-        t.transform.translation.x = r_shoulder[0]
-        t.transform.translation.y = r_shoulder[1]
-        t.transform.translation.z = r_shoulder[2]
-
-        self.tb.sendTransform(t)
-
-        t.header.frame_id = "left_elbow_"+self.body_id
-        t.child_frame_id = "left_shoulder_"+self.body_id
-        t.transform.translation.x = l_elbow[0]-l_shoulder[0]
-        t.transform.translation.y = l_elbow[1]-l_shoulder[1]
-        t.transform.translation.z = l_elbow[2]-l_shoulder[2]
-
-        self.tb.sendTransform(t)
-        
-        t.header.frame_id = "right_elbow_"+self.body_id
-        t.child_frame_id = "right_shoulder_"+self.body_id
-        t.transform.translation.x = r_elbow[0]-r_shoulder[0]
-        t.transform.translation.y = r_elbow[1]-r_shoulder[1]
-        t.transform.translation.z = r_elbow[2]-r_shoulder[2]
-
-        self.tb.sendTransform(t)
-        
-        t.header.frame_id = "left_wrist_"+self.body_id
-        t.child_frame_id = "left_elbow_"+self.body_id
-        t.transform.translation.x = l_wrist[0]-l_elbow[0]
-        t.transform.translation.y = l_wrist[1]-l_elbow[1]
-        t.transform.translation.z = l_wrist[2]-l_elbow[2]
-
-        self.tb.sendTransform(t)
-
-        t.header.frame_id = "right_wrist_"+self.body_id
-        t.child_frame_id = "right_elbow_"+self.body_id
-        t.transform.translation.x = r_wrist[0]-r_elbow[0]
-        t.transform.translation.y = r_wrist[1]-r_elbow[1]
-        t.transform.translation.z = r_wrist[2]-r_elbow[2]
-
-        self.tb.sendTransform(t)
-
-        t.header.frame_id = "left_ankle_"+self.body_id
-        t.child_frame_id = "mediapipe_torso_"+self.body_id
-        t.transform.translation.x = l_ankle[0]
-        t.transform.translation.y = l_ankle[1]
-        t.transform.translation.z = l_ankle[2]
-        
-        self.tb.sendTransform(t)
-
-        t.header.frame_id = "right_ankle_"+self.body_id
-        t.child_frame_id = "mediapipe_torso_"+self.body_id
-        t.transform.translation.x = r_ankle[0]
-        t.transform.translation.y = r_ankle[1]
-        t.transform.translation.z = r_ankle[2]
-
-        self.tb.sendTransform(t)
+            used as an input for the IK/FK process. The constant
+            our_torso -> mediapipe_torso transform is a static one
+            (see static_transforms) """
+
+        torso_tf, *parts_tfs = self.messages.stickman_tfs
+        torso_tf.header.stamp = header.stamp
+        torso_tf.header.frame_id = header.frame_id
+        set_transform(
+            torso_tf,
+            (-torso[1] + torso_res[0], torso[2], torso[0] + torso_res[2]),
+            quaternion_from_euler(np.pi/2, -theta, 0.0))
+        self.tf_batch.add(torso_tf)
+
+        # translations of the body parts frames, in the order of
+        # STICKMAN_FRAMES
+        translations = [
+            l_shoulder,
+            r_shoulder,
+            np.subtract(l_elbow, l_shoulder),
+            np.subtract(r_elbow, r_shoulder),
+            np.subtract(l_wrist, l_elbow),
+            np.subtract(r_wrist, r_elbow),
+            l_ankle,
+            r_ankle,
+        ]
+        for t, translation in zip(parts_tfs, translations):
+            t.header.stamp = header.stamp
+            set_transform(t, translation)
+            self.tf_batch.add(t)
+
+    def static_transforms(self, stamp):
+        """ Constant transforms of the body frames, published once on
+            the static TF topic along with the fixed joints of the
+            body model """
+        transforms = [make_transform(
+            "face_" + self.body_id,
+            "gaze_" + self.body_id,
+            stamp,
+            (0.0, 0.0, 0.0),
+            quaternion_from_euler(-np.pi/2, 0.0, -np.pi/2))]
+        if self.stickman_debug:
+            transforms.append(make_transform(
+                "our_torso_" + self.body_id,
+                "mediapipe_torso_" + self.body_id,
+                stamp,
+                (0.0, 0.0, 0.605)))
+        return transforms
 
     def make_jointstate(
             self,
@@ -606,119 +681,51 @@ class FullbodyDetector():
             pose_2d,
             header):
 
-        js = JointState()
-        js.header = copy.copy(header)
-        js.name = [jn + "_%s" % body_id for jn in HUMAN_JOINT_NAMES]
-
-        torso = np.array([
-            -(
-                pose_3d[MP_LEFT_HIP].get('z')
-                + pose_3d[MP_RIGHT_HIP].get('z')
-            )
-            / 2,
-            (
-                pose_3d[MP_LEFT_HIP].get('x')
-                + pose_3d[MP_RIGHT_HIP].get('x')
-            )
-            / 2,
-            -(
-                pose_3d[MP_LEFT_HIP].get('y')
-                + pose_3d[MP_RIGHT_HIP].get('y')
-            )
-            / 2
-        ])
-        l_shoulder = np.array([
-            -pose_3d[MP_LEFT_SHOULDER].get('z'),
-            pose_3d[MP_LEFT_SHOULDER].get('x'),
-            -pose_3d[MP_LEFT_SHOULDER].get('y')-0.605
-        ])
-        l_elbow = np.array([
-            -pose_3d[MP_LEFT_ELBOW].get('z'),
-            pose_3d[MP_LEFT_ELBOW].get('x'),
-            -pose_3d[MP_LEFT_ELBOW].get('y')-0.605
-        ])
-        l_wrist = np.array([
-            -pose_3d[MP_LEFT_WRIST].get('z'),
-            pose_3d[MP_LEFT_WRIST].get('x'),
-            -pose_3d[MP_LEFT_WRIST].get('y')-0.605
-        ])
-        l_ankle = np.array([
-            -pose_3d[MP_LEFT_ANKLE].get('z'),
-            pose_3d[MP_LEFT_ANKLE].get('x'),
-            -pose_3d[MP_LEFT_ANKLE].get('y')
-        ])
-        r_shoulder = np.array([
-            -pose_3d[MP_RIGHT_SHOULDER].get('z'),
-            pose_3d[MP_RIGHT_SHOULDER].get('x'),
-            -pose_3d[MP_RIGHT_SHOULDER].get('y')-0.605
-        ])
-        r_elbow = np.array([
-            -pose_3d[MP_RIGHT_ELBOW].get('z'),
-            pose_3d[MP_RIGHT_ELBOW].get('x'),
-            -pose_3d[MP_RIGHT_ELBOW].get('y')-0.605
-        ])
-        r_wrist = np.array([
-            -pose_3d[MP_RIGHT_WRIST].get('z'),
-            pose_3d[MP_RIGHT_WRIST].get('x'),
-            -pose_3d[MP_RIGHT_WRIST].get('y')-0.605
-        ])
-        r_ankle = np.array([
-            -pose_3d[MP_RIGHT_ANKLE].get('z'),
-            pose_3d[MP_RIGHT_ANKLE].get('x'),
-            -pose_3d[MP_RIGHT_ANKLE].get('y')
-        ])
-        nose = np.array([
-            -pose_3d[MP_NOSE].get('z'),
-            pose_3d[MP_NOSE].get('x'),
-            -pose_3d[MP_NOSE].get('y')
-        ])
-        feet = np.array([
-            -(
-                pose_3d[MP_RIGHT_FOOT].get('z')
-                + pose_3d[MP_LEFT_FOOT].get('z')
-            )
-            / 2,
-            (
-                pose_3d[MP_RIGHT_FOOT].get('x')
-                + pose_3d[MP_LEFT_FOOT].get('x')
-            )
-            / 2,
-            -(
-                pose_3d[MP_RIGHT_FOOT].get('y')
-                + pose_3d[MP_LEFT_FOOT].get('y')
-            )
-            / 2
-        ])
+        # Mediapipe world landmarks, expressed in the body frame
+        # (x forward, y left, z up)
+        kpt = np.stack([
+            -pose_3d[:, Z],
+            pose_3d[:, X],
+            -pose_3d[:, Y]], axis=1)
+        shoulder_offset = np.array([0.0, 0.0, 0.605])
+
+        torso = (kpt[MP_LEFT_HIP] + kpt[MP_RIGHT_HIP]) / 2
+        l_shoulder = kpt[MP_LEFT_SHOULDER] - shoulder_offset
+        l_elbow = kpt[MP_LEFT_ELBOW] - shoulder_offset
+        l_wrist = kpt[MP_LEFT_WRIST] - shoulder_offset
+        l_ankle = kpt[MP_LEFT_ANKLE]
+        r_shoulder = kpt[MP_RIGHT_SHOULDER] - shoulder_offset
+        r_elbow = kpt[MP_RIGHT_ELBOW] - shoulder_offset
+        r_wrist = kpt[MP_RIGHT_WRIST] - shoulder_offset
+        r_ankle = kpt[MP_RIGHT_ANKLE]
 
         ### depth and rotation ###
 
-        theta = np.arctan2(pose_3d[MP_RIGHT_HIP].get('x'), -pose_3d[MP_RIGHT_HIP].get('z'))
-        torso_res_prev = np.array([None, None, None])
+        theta = np.arctan2(pose_3d[MP_RIGHT_HIP, X], -pose_3d[MP_RIGHT_HIP, Z])
         if self.use_depth:
-            torso_px = _normalized_to_pixel_coordinates(
-                (pose_2d[MP_LEFT_HIP].get('x')+pose_2d[MP_RIGHT_HIP].get('x'))/2,
-                (pose_2d[MP_LEFT_HIP].get('y')+pose_2d[MP_RIGHT_HIP].get('y'))/2,
+            # Only the point between the hips is back-projected: the
+            # limbs come from the Mediapipe world landmarks
+            torso_px = _normalized_to_pixel_array(
+                pose_2d[[MP_LEFT_HIP, MP_RIGHT_HIP]][:, [X, Y]].mean(
+                    axis=0, keepdims=True),
                 self.img_width,
                 self.img_height)
-            torso_res = rgb_to_xyz(
-                torso_px[0],
-                torso_px[1],
-                self.rgb_info,
-                self.depth_info,
-                self.image_depth,
-                self.roi.x_offset,
-                self.roi.y_offset
-            )            
+            with self.timer.stage("depth"):
+                torso_res = self.depth_registration.rgb_to_xyz(
+                    torso_px[:, 0],
+                    torso_px[:, 1],
+                    self.image_depth,
+                    self.roi.x_offset,
+                    self.roi.y_offset,
+                    self.depth_window,
+                    self.depth_statistic
+                )[0]
             self.node.get_logger().debug(f'torso_res {torso_res}')
-            if torso_res.any() == None:
-                if torso_res_prev.all() != None:
-                    torso_res = torso_res_prev
-                elif self.body_position_estimation[0]:
+            if np.isnan(torso_res).any():
+                if self.body_position_estimation[0]:
                     torso_res = self.body_position_estimation
                 else:                
                     torso_res = np.array([0, 0, 0])
-            else:
-                torso_res_prev = torso_res
 
         elif self.body_position_estimation[0]:
             torso_res = self.body_position_estimation
@@ -727,106 +734,48 @@ class FullbodyDetector():
 
         ### Publishing tf transformations ###
 
-        t = header.stamp.nanosec / 1e9
+        t = _stamp_to_seconds(header.stamp)
 
         self.node.get_logger().debug(f'time:  {header.stamp.nanosec}')
 
-        if not self.one_euro_filter[0] and self.use_depth:
-            self.node.get_logger().debug(f'torso res 2 {torso_res[2]}')
-            self.one_euro_filter[0] = OneEuroFilter(
-                t, 
-                torso_res[0], 
-                beta=BETA_POSITION, 
-                d_cutoff=D_CUTOFF_POSITION, 
-                min_cutoff=MIN_CUTOFF_POSITION)
-            self.node.get_logger().debug(f'torso res 0 {torso_res[0]}')
-
-            self.one_euro_filter[1] = OneEuroFilter(
-                t, 
-                torso_res[1], 
-                beta=BETA_POSITION, 
-                d_cutoff=D_CUTOFF_POSITION, 
-                min_cutoff=MIN_CUTOFF_POSITION)
-            
-            self.one_euro_filter[2] = OneEuroFilter(
-                t, 
-                torso_res[2], 
-                beta=BETA_POSITION, 
-                d_cutoff=D_CUTOFF_POSITION, 
-                min_cutoff=MIN_CUTOFF_POSITION)
-            
-            self.node.get_logger().debug('got here')
-            self.node.get_logger().debug(f'time res {t}')
-            self.node.get_logger().debug(f'torso res {torso_res[0]}')
-            self.node.get_logger().debug(f'torso res {torso_res[2]}')
-            self.body_filtered_position[0] = torso_res[1]
-            self.body_filtered_position[1] = torso_res[1]
-            self.body_filtered_position[2] = torso_res[2]
-
-        elif self.use_depth:
-            self.body_filtered_position_prev[0] = self.body_filtered_position[0]
-            self.body_filtered_position_prev[1] = self.body_filtered_position[1]
-            self.body_filtered_position_prev[2] = self.body_filtered_position[2]
-
-            self.body_filtered_position[0], t_e = self.one_euro_filter[0](t, torso_res[0])
-            self.body_filtered_position[1], _ = self.one_euro_filter[1](t, torso_res[1])
-            self.body_filtered_position[2], _ = self.one_euro_filter[2](t, torso_res[2])
-
-            self.node.get_logger().debug(f'one euro {(t, torso_res[2])}')
-            self.node.get_logger().debug(f'body filtered {self.body_filtered_position}')
-
-            self.position_msg.point.x = self.body_filtered_position[0]
-            self.position_msg.point.y = 0.0
-            self.position_msg.point.z = self.body_filtered_position[2]
-
-            self.position_msg.header.stamp = self.node.get_clock().now().to_msg()
-            self.position_msg.header.frame_id = header.frame_id
-            self.body_filtered_position_pub.publish(self.position_msg)
-            
-            self.node.get_logger().debug(f't_e {t_e}')
-
-            self.body_vel_estimation[0] = (self.body_filtered_position[0] - self.body_filtered_position_prev[0]) / t_e
-            self.body_vel_estimation[1] = (self.body_filtered_position[1] - self.body_filtered_position_prev[1]) / t_e
-            self.body_vel_estimation[2] = (self.body_filtered_position[2] - self.body_filtered_position_prev[2]) / t_e
-
-            if not self.one_euro_filter_dot[0]:
-                self.node.get_logger().debug(f'body vel {self.body_vel_estimation}')
-
-                self.one_euro_filter_dot[0] = OneEuroFilter(
-                    t, 
-                    self.body_vel_estimation[0], 
-                    beta=BETA_VELOCITY, 
-                    d_cutoff=D_CUTOFF_VELOCITY, 
-                    min_cutoff=MIN_CUTOFF_VELOCITY)
-                
-                self.one_euro_filter_dot[1] = OneEuroFilter(
-                    t, 
-                    self.body_vel_estimation[1], 
-                    beta=BETA_VELOCITY, 
-                    d_cutoff=D_CUTOFF_VELOCITY, 
-                    min_cutoff=MIN_CUTOFF_VELOCITY)
-                self.one_euro_filter_dot[2] = OneEuroFilter(
-                    t, 
-                    self.body_vel_estimation[2], 
-                    beta=BETA_VELOCITY, 
-                    d_cutoff=D_CUTOFF_VELOCITY, 
-                    min_cutoff=MIN_CUTOFF_VELOCITY)
-            else:
-                self.body_vel_estimation_filtered[0], _ = \
-                    self.one_euro_filter_dot[0](t, self.body_vel_estimation[0])
-                self.body_vel_estimation_filtered[1], _ = \
-                    self.one_euro_filter_dot[1](t, self.body_vel_estimation[1])
-                self.body_vel_estimation_filtered[2], _ = \
-                    self.one_euro_filter_dot[2](t, self.body_vel_estimation[2])
-                
-                self.velocity_msg.twist.linear.x = \
-                    -self.body_vel_estimation_filtered[0]
-                self.velocity_msg.twist.linear.y = \
-                    self.body_vel_estimation_filtered[1]
-                self.velocity_msg.twist.linear.y = \
-                    self.body_vel_estimation_filtered[2]
-                
-                self.velocity_pub.publish(self.velocity_msg)
+        if self.use_depth:
+            body_filtered_position_prev = self.body_filtered_position
+            self.body_filtered_position, t_e = \
+                self.position_filter(t, torso_res)
+            self.node.get_logger().debug(
+                f'body filtered {self.body_filtered_position}')
+
+            # the first sample only initializes the filter
+            if not np.isnan(body_filtered_position_prev).any() \
+                    and t_e[0] > 0:
+                self.position_msg.point.x = self.body_filtered_position[0]
+                self.position_msg.point.y = 0.0
+                self.position_msg.point.z = self.body_filtered_position[2]
+
+                self.position_msg.header.stamp = \
+                    self.node.get_clock().now().to_msg()
+                self.position_msg.header.frame_id = header.frame_id
+                if self.demand["position"]:
+                    self.body_filtered_position_pub.publish(
+                        self.position_msg)
+
+                self.node.get_logger().debug(f't_e {t_e[0]}')
+
+                body_vel_estimation = (self.body_filtered_position
+                                       - body_filtered_position_prev) / t_e[0]
+                velocity_initialized = self.velocity_filter.initialized.all()
+                body_vel_estimation_filtered, _ = \
+                    self.velocity_filter(t, body_vel_estimation)
+
+                if velocity_initialized and self.demand["velocity"]:
+                    self.velocity_msg.twist.linear.x = \
+                        -body_vel_estimation_filtered[0]
+                    self.velocity_msg.twist.linear.y = \
+                        body_vel_estimation_filtered[1]
+                    self.velocity_msg.twist.linear.y = \
+                        body_vel_estimation_filtered[2]
+
+                    self.velocity_pub.publish(self.velocity_msg)
 
         if not self.use_depth:
             # todo(juandpenan) uncomment:
@@ -836,27 +785,19 @@ class FullbodyDetector():
             translation = (self.body_filtered_position[0], 
                            self.body_filtered_position[1], 
                            self.body_filtered_position[2])
-        t = TransformStamped()
-        
+        t = self.messages.body_tf
         t.header.stamp = header.stamp
-        t.header.frame_id = header.frame_id                    
-        t.child_frame_id = "body_%s" % body_id
-
-        t.transform.translation.x = translation[0]
-        t.transform.translation.y = translation[1]
-        t.transform.translation.z = translation[2]
-        
-        q = quaternion_from_euler(np.pi/2, -theta, 0.0)
-
-        t.transform.rotation.x = q[0]
-        t.transform.rotation.y = q[1]
-        t.transform.rotation.z = q[2]
-        t.transform.rotation.w = q[3]
+        t.header.frame_id = header.frame_id
+        set_transform(
+            t,
+            translation,
+            quaternion_from_euler(np.pi/2, -theta, 0.0))
 
         self.node.get_logger().debug(f'publishing tf msg: {t}')
-        self.tb.sendTransform(t)
+        if self.need_tf:
+            self.tf_batch.add(t)
 
-        if self.stickman_debug:
+        if self.stickman_debug and self.need_tf:
             self.stickman_debugging(theta, 
                                     torso, 
                                     torso_res,
@@ -869,18 +810,88 @@ class FullbodyDetector():
                                     l_ankle,
                                     r_ankle, 
                                     header)
-            
-        js.position = compute_jointstate(
-            self.ik_chains[body_id], 
-            torso,
-            l_wrist,
-            l_ankle,
-            r_wrist,
-            r_ankle
-        )
+
+        # the joint state is only needed by the joint states topic and
+        # the body links TF
+        if not self.need_ik:
+            return None
+
+        if self.ik_batch is not None:
+            self.ik_batch.add(
+                self.ik_solver,
+                limbs_targets(torso, l_wrist, l_ankle, r_wrist, r_ankle),
+                limbs_initial_guess(self.previous_jointstate),
+                lambda joints, iterations: self.finish_jointstate(
+                    joints, iterations, header))
+            return None
+
+        with self.timer.stage("ik"):
+            if self.use_batched_ik:
+                position, iterations = compute_jointstate_batched(
+                    self.ik_solver,
+                    torso,
+                    l_wrist,
+                    l_ankle,
+                    r_wrist,
+                    r_ankle,
+                    self.previous_jointstate,
+                    self.ik_tolerance,
+                    self.ik_max_iterations
+                )
+                self.count_ik_iterations(iterations)
+            else:
+                position = compute_jointstate(
+                    self.ik_chains[body_id], 
+                    torso,
+                    l_wrist,
+                    l_ankle,
+                    r_wrist,
+                    r_ankle,
+                    self.previous_jointstate
+                )
+        return self.jointstate_message(position, header)
+
+    def finish_jointstate(self, limbs_joints, iterations, header):
+        """ Batched multi-body mode: publish the joint state of the
+            frame, once the IK queued by make_jointstate is solved along
+            with the other bodies of the frame """
+        with self.lock:
+            if not self.registered:
+                return
+            self.count_ik_iterations(iterations)
+            js = self.jointstate_message(
+                limbs_jointstate(limbs_joints), header)
+            if self.demand["joint_states"]:
+                self.js_pub.publish(js)
+
+    def count_ik_iterations(self, iterations):
+        self.ik_solves += len(iterations)
+        self.ik_iterations += int(iterations.sum())
+        self.node.get_logger().debug(
+            'IK average iterations per solve: %.2f'
+            % self.ik_average_iterations())
+
+    def jointstate_message(self, position, header):
+        """ The smoothed joint state message of the IK solution
+            position, also adding the body links transforms to the TF
+            batch """
+        self.previous_jointstate = position
+        js = self.messages.fill_jointstate(header, position)
+
+        if self.need_tf:
+            with self.timer.stage("tf"):
+                self.tf_batch.extend(self.kinematics.transforms(
+                    dict(zip(js.name, js.position)),
+                    header.stamp,
+                    self.link_transforms))
 
         return js
 
+    def ik_average_iterations(self):
+        if not self.ik_solves:
+            return 0.0
+        return self.ik_iterations / self.ik_solves
+
     def check_bounding_box_consistency(self, bb):
         return bb.x_offset >= 0 \
             and bb.y_offset >= 0 \
@@ -889,281 +900,259 @@ class FullbodyDetector():
             and (bb.x_offset + bb.width < self.img_width) \
             and (bb.y_offset + bb.height < self.img_height)
 
-    def detect(self, image_rgb, header):
+    def tracking_redetection_policy(self, track_found):
+        """ Reset the Holistic tracking state when the body track
+            is lost or when the person bounding box jumps too far
+            from the previous frame one """
 
-        img_height, img_width, _ = image_rgb.shape
-        self.img_height, self.img_width = img_height, img_width
+        if not track_found:
+            if self.prev_person_box is not None:
+                self.detector.reset()
+            self.prev_person_box = None
+            return
 
+        box = np.array([self.x_min_person,
+                        self.y_min_person,
+                        self.x_max_person,
+                        self.y_max_person], dtype=float)
+        if self.prev_person_box is not None:
+            prev_center = (self.prev_person_box[:2]
+                           + self.prev_person_box[2:]) / 2
+            center = (box[:2] + box[2:]) / 2
+            prev_diagonal = np.linalg.norm(
+                self.prev_person_box[2:] - self.prev_person_box[:2])
+            if np.linalg.norm(center - prev_center) \
+                    > self.tracking_roi_jump * prev_diagonal:
+                self.node.get_logger().debug(
+                    "Body %s ROI jumped, re-detecting" % self.body_id)
+                self.detector.reset()
+                box = None
+        self.prev_person_box = box
+
+    def run_holistic(self, image, conversion):
+        """ Holistic landmarks of image (or of a crop of it), as
+            decoded by decode_imgmsg """
+        with self.timer.stage("color_conversion"):
+            image_rgb = np.ascontiguousarray(
+                to_rgb(image, conversion, self.input_max_size))
+
+        # image_rgb may be a view on the image message data
+        writeable = image_rgb.flags.writeable
         image_rgb.flags.writeable = False
-        image_rgb = cv2.cvtColor(image_rgb, cv2.COLOR_BGR2RGB) # ok
-        results = self.detector.process(image_rgb)
-        image_rgb.flags.writeable = True
+        with self.timer.stage("holistic"):
+            landmarks = self.detector.process(image_rgb)
+        image_rgb.flags.writeable = writeable
+        return landmarks
+
+    def detect(self, image, conversion, header):
+        """ Run Holistic on image, as decoded by decode_imgmsg, and
+            publish the results. With ROI cropping, only the region of
+            the person found in the previous frames is processed, as
+            long as the person was found there with enough confidence:
+            the next frame is processed whole otherwise. Holistic runs
+            once per frame either way. """
+
+        height, width = image.shape[:2]
+        crop = None
+        if self.roi_cropper is not None:
+            crop = self.roi_cropper.crop(width, height)
+            # the Holistic tracking state (if any) does not carry over
+            # between crops and whole frames
+            if (crop is None) != (self.prev_crop is None):
+                self.detector.reset()
+            self.prev_crop = crop
+        if crop is None:
+            landmarks = self.run_holistic(image, conversion)
+        else:
+            x_min, y_min, x_max, y_max = crop
+            landmarks = self.run_holistic(
+                image[y_min:y_max, x_min:x_max], conversion).to_frame(
+                    x_min / width,
+                    y_min / height,
+                    (x_max - x_min) / width,
+                    (y_max - y_min) / height)
+        if self.roi_cropper is not None:
+            self.roi_cropper.update(landmarks)
+
+        self.process_landmarks(landmarks, image, header, (width, height))
+        self.flush_transforms()
+
+    def flush_transforms(self):
+        """ Send the transforms of the frame, unless the batch is shared
+            with other bodies """
+        if self.owns_tf_batch:
+            with self.timer.stage("tf_publish"):
+                self.tf_batch.flush()
+
+    def process_crop(self,
+                     landmarks,
+                     image_rgb,
+                     header,
+                     rgb_info,
+                     roi,
+                     image_depth=None,
+                     depth_info=None,
+                     image_size=None):
+        """ Batched multi-body mode: process the Holistic landmarks
+            found in image_rgb, the crop of the body roi in a camera
+            frame that the node has already converted and run through
+            Holistic, along with the other bodies of the frame.
+            image_size is the (width, height) of the crop before its
+            downscaling, if any """
+        with self.lock:
+            if not self.registered:
+                return
+            self.camera_info_callback(rgb_info)
+            self.rgb_info = rgb_info
+            self.x_offset = roi.x_offset
+            self.y_offset = roi.y_offset
+            self.roi = roi
+            if self.use_depth:
+                self.image_depth = image_depth
+                self.depth_info = depth_info
+                self.update_depth_registration()
+            with self.timer.stage("detect"):
+                self.process_landmarks(
+                    landmarks, image_rgb, header, image_size)
+            self.flush_transforms()
+
+    def process_landmarks(self, landmarks, image_rgb, header,
+                          image_size=None):
+        """ Publish the results of the Holistic landmarks found in
+            image_rgb. The landmarks pixel coordinates are computed in
+            the original (width, height) image_size, if image_rgb was
+            downscaled """
+
+        if image_size is None:
+            img_height, img_width, _ = image_rgb.shape
+        else:
+            img_width, img_height = image_size
+        self.img_height, self.img_width = img_height, img_width
         self.image = image_rgb
 
-        self.x_min_person = img_width
-        self.y_min_person = img_height
-        self.x_max_person = 0
-        self.y_max_person = 0
-
-        ######## Face Detection Process ########
+        ######## Person Bounding Box ########
 
-        if hasattr(results.face_landmarks, 'landmark'):
-            (self.x_min_face,
-             self.y_min_face,
-             self.x_max_face,
-             self.y_max_face) = _get_bounding_box_limits(
-                results.face_landmarks.landmark,
-                img_width,
-                img_height
-            )
+        # Face and hands landmarks, plus the body ones in single body
+        # mode, reduced to a single bounding box
+        person_landmarks = [landmarks.face,
+                            landmarks.left_hand,
+                            landmarks.right_hand]
+        if self.single_body:
+            person_landmarks.append(landmarks.pose)
+        (self.x_min_person,
+         self.y_min_person,
+         self.x_max_person,
+         self.y_max_person) = _get_person_bounding_box(person_landmarks,
+                                                       img_width,
+                                                       img_height)
+
+        ######## Stages to run ########
+
+        # joint states and body links TF need the IK, which needs the body
+        # pose; without depth, the body position comes from the face pose
+        self.need_tf = self.demand["tf"]
+        self.need_ik = self.demand["joint_states"] or self.need_tf
+        need_body_pose = self.need_ik \
+            or self.demand["position"] \
+            or self.demand["velocity"]
+        need_face_pose = self.need_tf \
+            or (need_body_pose and not self.use_depth)
 
-            self.x_min_person = int(min(
-                self.x_min_person, 
-                self.x_min_face))
-            self.y_min_person = int(min(
-                self.y_min_person, 
-                self.y_min_face))
-            self.x_max_person = int(max(
-                self.x_max_person, 
-                self.x_max_face))
-            self.y_max_person = int(max(
-                self.y_max_person, 
-                self.y_max_face))
+        ######## Face Detection Process ########
 
+        if landmarks.face is None or not need_face_pose:
+            self.face_pose_tracker.reset()
+        else:
             if not self.use_depth and hasattr(self, "K"):
                 # K = camera intrisic matrix. See method camera_info_callback 
                 #     to understand more about it
-                for idx, landmark in enumerate(results.face_landmarks.landmark):
-                    if idx == FM_NOSE:
-                        nose_tip = [landmark.x, landmark.y]
-                    if idx == FM_MOUTH_CENTER:
-                        mouth_center = [landmark.x, landmark.y]
-                    if idx == FM_RIGHT_EYE:
-                        right_eye = [landmark.x, landmark.y]
-                    if idx == FM_RIGHT_EAR_TRAGION:
-                        right_ear_tragion = [landmark.x, landmark.y]
-                    if idx == FM_LEFT_EYE:
-                        left_eye = [landmark.x, landmark.y]
-                    if idx == FM_LEFT_EAR_TRAGION:
-                        left_ear_tragion = [landmark.x, landmark.y]
-
-                points_2D = np.array([
-                    _normalized_to_pixel_coordinates(
-                        nose_tip[0],
-                        nose_tip[1],
-                        self.img_width,
-                        self.img_height),
-                    _normalized_to_pixel_coordinates(
-                        right_eye[0],
-                        right_eye[1],
-                        self.img_width,
-                        self.img_height),
-                    _normalized_to_pixel_coordinates(
-                        left_eye[0],
-                        left_eye[1],
-                        self.img_width,
-                        self.img_height),
-                    _normalized_to_pixel_coordinates(
-                        mouth_center[0],
-                        mouth_center[1],
+                with self.timer.stage("face_pose"):
+                    face_pose = self.face_pose_tracker(
+                        landmarks.face,
                         self.img_width,
-                        self.img_height),
-                    _normalized_to_pixel_coordinates(
-                        right_ear_tragion[0],
-                        right_ear_tragion[1],
-                        self.img_width,
-                        self.img_height),
-                    _normalized_to_pixel_coordinates(
-                        left_eye[0],
-                        left_eye[1],
-                        self.img_width,
-                        self.img_height)], 
-                    dtype="double")
-
-                self.trans_vec, self.angles = \
-                    face_pose_estimation(points_2D, self.K)
+                        self.img_height,
+                        self.K,
+                        _stamp_to_seconds(header.stamp))
 
-                if not self.trans_vec[0] \
-                  or not self.trans_vec[1] \
-                  or not self.trans_vec[2]:
-                    self.valid_trans_vec = False
-                elif np.isnan(self.trans_vec).any():
+                if face_pose is None:
                     self.valid_trans_vec = False
                 else:
-                    self.valid_trans_vec = True
-
-                if self.valid_trans_vec:
-                    t = TransformStamped()
-                    
-                    t.header.stamp = self.node.get_clock().now().to_msg()
-                    t.header.frame_id = header.frame_id                    
-                    t.child_frame_id = "face_"+self.body_id
-
-                    t.transform.translation.x = self.trans_vec[0]/1000
-                    t.transform.translation.y = self.trans_vec[1]/1000
-                    t.transform.translation.z = self.trans_vec[2]/1000
-                    
+                    self.trans_vec, self.angles = face_pose
+                    if not self.trans_vec[0] \
+                      or not self.trans_vec[1] \
+                      or not self.trans_vec[2]:
+                        self.valid_trans_vec = False
+                    elif np.isnan(self.trans_vec).any():
+                        self.valid_trans_vec = False
+                    else:
+                        self.valid_trans_vec = True
+
+                if self.valid_trans_vec and self.need_tf:
                     q = quaternion_from_euler(self.angles[0]/180*np.pi, self.angles[1]/180*np.pi, self.angles[2]/180*np.pi)
-
-                    t.transform.rotation.x = q[0]
-                    t.transform.rotation.y = q[1]
-                    t.transform.rotation.z = q[2]
-                    t.transform.rotation.w = q[3]
-
-                    self.tb.sendTransform(t)
-                    
-                    t.header.frame_id = "gaze_" + self.body_id
-                    t.child_frame_id = "face_" + self.body_id
-
-                    t.transform.translation.x = 0.0
-                    t.transform.translation.y = 0.0
-                    t.transform.translation.z = 0.0
-
-                    q = quaternion_from_euler(-np.pi/2, 0.0, -np.pi/2)
-
-                    t.transform.rotation.x = q[0]
-                    t.transform.rotation.y = q[1]
-                    t.transform.rotation.z = q[2]
-                    t.transform.rotation.w = q[3]                 
-
-                    self.tb.sendTransform(t)
+                    # the gaze frame is a static child of the face
+                    # frame (see static_transforms)
+                    t = self.messages.face_tf
+                    t.header.stamp = self.node.get_clock().now().to_msg()
+                    t.header.frame_id = header.frame_id
+                    set_transform(t, np.ravel(self.trans_vec) / 1000, q)
+                    self.tf_batch.add(t)
                     
         ########################################
 
-        ######## Introducing Hand Landmarks ########
-
-        if hasattr(results.left_hand_landmarks, 'landmark'):
-            pose_keypoints = protobuf_to_dict(results.pose_landmarks)
-            pose_kpt = pose_keypoints.get('landmark')
-            landmarks = [None] * 21
-            for i in range(0, 21):
-                msg = NormalizedPointOfInterest2D()
-                msg.x = pose_kpt[i].get('x')
-                msg.y = pose_kpt[i].get('y')
-                msg.c = pose_kpt[i].get('visibility')
-                landmarks[i] = msg
-            (self.x_min_hand_left,
-             self.y_min_hand_left,
-             self.x_max_hand_left,
-             self.y_max_hand_left) = _get_bounding_box_limits(landmarks,
-                                                              img_width,
-                                                              img_height)
-            self.x_min_person = int(min(
-                self.x_min_person, 
-                self.x_min_hand_left))
-            self.y_min_person = int(min(
-                self.y_min_person, 
-                self.y_min_hand_left))
-            self.x_max_person = int(max(
-                self.x_max_person, 
-                self.x_max_hand_left))
-            self.y_max_person = int(max(
-                self.y_max_person, 
-                self.y_max_hand_left))
-
-        if hasattr(results.right_hand_landmarks, 'landmark'):
-            pose_keypoints = protobuf_to_dict(results.pose_landmarks)
-            pose_kpt = pose_keypoints.get('landmark')
-            landmarks = [None] * 21
-            for i in range(0, 21):
-                msg =  NormalizedPointOfInterest2D()
-                msg.x = pose_kpt[i].get('x')
-                msg.y = pose_kpt[i].get('y')
-                msg.c =  pose_kpt[i].get('visibility')
-
-                landmarks[i] = msg
-
-            (self.x_min_hand_right,
-             self.y_min_hand_right,
-             self.x_max_hand_right,
-             self.y_max_hand_right) = _get_bounding_box_limits(landmarks,
-                                                               img_width,
-                                                               img_height)
-            self.x_min_person = int(min(
-                self.x_min_person, 
-                self.x_min_hand_right))
-            self.y_min_person = int(min(
-                self.y_min_person, 
-                self.y_min_hand_right))
-            self.x_max_person = int(max(
-                self.x_max_person, 
-                self.x_max_hand_right))
-            self.y_max_person = int(max(
-                self.y_max_person, 
-                self.y_max_hand_right))
-
-        ############################################
-
         ######## Body Detection Process ########
 
-        if hasattr(results.pose_landmarks, 'landmark'):
-            pose_keypoints = protobuf_to_dict(results.pose_landmarks)
-            pose_world_keypoints = protobuf_to_dict(
-                results.pose_world_landmarks)
-            pose_kpt = pose_keypoints.get('landmark')
-            pose_world_kpt = pose_world_keypoints.get('landmark')
-            skel_msg = _make_2d_skeleton_msg(header, pose_kpt)
+        if landmarks.pose is not None:
+            stamp = _stamp_to_seconds(header.stamp)
+            # the depth of the body position keypoint is sampled from
+            # the raw landmarks, the body position being filtered already
+            pose_kpt = landmarks.pose
+            skeleton_kpt = pose_kpt.copy()
+            skeleton_kpt[:, [X, Y]] = self.smoothing(
+                "skeleton_2d", stamp, pose_kpt[:, [X, Y]])
+            pose_world_kpt = landmarks.pose_world
+            if pose_world_kpt is not None:
+                pose_world_kpt[:, [X, Y, Z]] = self.smoothing(
+                    "keypoints_3d", stamp, pose_world_kpt[:, [X, Y, Z]])
+            skel_msg = self.messages.fill_skeleton(header, skeleton_kpt)
             
-            if self.valid_trans_vec and not self.use_depth:
-                self.body_position_estimation = \
-                    self.face_to_body_position_estimation(skel_msg)
-                
-            elif not self.valid_trans_vec and not self.use_depth:
-                self.node.get_logger().error("It was not possible to estimate body position.")
-            if self.use_depth or self.valid_trans_vec:
-                js = self.make_jointstate(
-                    self.body_id,
-                    pose_world_kpt,
-                    pose_kpt,
-                    header
-                )
-                self.js_pub.publish(js)
-            self.skel_pub.publish(skel_msg)
-            if self.single_body:
-                landmarks = [None]*32
-                for i in range(0, 32):
-                    msg = NormalizedPointOfInterest2D()
-                    msg.x = pose_kpt[i].get('x')
-                    msg.y = pose_kpt[i].get('y')
-                    msg.c = pose_kpt[i].get('visibility')
-
-                    landmarks[i] = msg
-
-                
-                (self.x_min_body,
-                 self.y_min_body,
-                 self.x_max_body,
-                 self.y_max_body) = _get_bounding_box_limits(landmarks,
-                                                                img_width,
-                                                                img_height)
-                self.x_min_person = int(min(
-                    self.x_min_person, 
-                    self.x_min_body))
-                self.y_min_person = int(min(
-                    self.y_min_person, 
-                    self.y_min_body))
-                self.x_max_person = int(max(
-                    self.x_max_person, 
-                    self.x_max_body))
-                self.y_max_person = int(max(
-                    self.y_max_person, 
-                    self.y_max_body))
+            if need_body_pose and not self.use_depth:
+                if self.valid_trans_vec:
+                    self.body_position_estimation = \
+                        self.face_to_body_position_estimation(skel_msg)
+                else:
+                    self.node.get_logger().error("It was not possible to estimate body position.")
+            if need_body_pose and (self.use_depth or self.valid_trans_vec):
+                with self.timer.stage("jointstate"):
+                    js = self.make_jointstate(
+                        self.body_id,
+                        pose_world_kpt,
+                        pose_kpt,
+                        header
+                    )
+                if js is not None and self.demand["joint_states"]:
+                    self.js_pub.publish(js)
+            if self.demand["skeleton2d"]:
+                self.skel_pub.publish(skel_msg)
+        else:
+            self.smoothing.reset()
 
         if self.single_body:
-            ids_list = IdsList()
-            if self.x_min_person < self.x_max_person \
-                and self.y_min_person < self.y_max_person:
+            track_found = self.x_min_person < self.x_max_person \
+                and self.y_min_person < self.y_max_person
+            if self.tracking:
+                self.tracking_redetection_policy(track_found)
+            ids_list = self.messages.no_ids
+            if track_found:
                 self.x_min_person = max(0, self.x_min_person)
                 self.y_min_person = max(0, self.y_min_person)
                 self.x_max_person = min(img_width, self.x_max_person)
                 self.y_max_person = min(img_height, self.y_max_person)
-                ids_list.ids = [self.body_id]
-                roi = RegionOfInterest()
-                roi.x_offset = self.x_min_person
-                roi.y_offset = self.y_min_person
-                roi.width = self.x_max_person - self.x_min_person
-                roi.height = self.y_max_person - self.y_min_person
-                self.roi_pub.publish(roi)
+                ids_list = self.messages.ids
+                self.roi_pub.publish(self.messages.fill_roi(
+                    self.x_min_person,
+                    self.y_min_person,
+                    self.x_max_person - self.x_min_person,
+                    self.y_max_person - self.y_min_person))
             self.ids_pub.publish(ids_list)
 
         ########################################
@@ -1175,8 +1164,9 @@ class FullbodyDetector():
                 depth_img, 
                 depth_info):
 
-        rgb_img = self.br.imgmsg_to_cv2(rgb_img)
-        image_depth = self.br.imgmsg_to_cv2(depth_img, "16UC1")
+        with self.timer.stage("image_conversion"):
+            image, conversion = decode_imgmsg(self.br, rgb_img)
+            image_depth = self.br.imgmsg_to_cv2(depth_img, "16UC1")
         self.image_depth = image_depth
         if depth_info.header.stamp > rgb_info.header.stamp:
             header = copy.copy(depth_info.header)
@@ -1185,10 +1175,12 @@ class FullbodyDetector():
             header = copy.copy(rgb_info.header)
         self.depth_info = depth_info
         self.rgb_info = rgb_info
+        self.update_depth_registration()
         self.x_offset = roi.x_offset
         self.y_offset = roi.y_offset
         self.roi = roi
-        self.detect(rgb_img, header)
+        with self.timer.stage("detect"):
+            self.detect(image, conversion, header)
 
     def image_callback_depth_single_person(self, 
                 rgb_img, 
@@ -1200,8 +1192,9 @@ class FullbodyDetector():
             self.skeleton_generation()
             self.skeleton_to_set = False
 
-        rgb_img = self.br.imgmsg_to_cv2(rgb_img)
-        image_depth = self.br.imgmsg_to_cv2(depth_img, "16UC1")
+        with self.timer.stage("image_conversion"):
+            image, conversion = decode_imgmsg(self.br, rgb_img)
+            image_depth = self.br.imgmsg_to_cv2(depth_img, "16UC1")
         self.image_depth = image_depth
         if depth_info.header.stamp.nanosec > rgb_info.header.stamp.nanosec:
             header = copy.copy(depth_info.header)
@@ -1212,12 +1205,12 @@ class FullbodyDetector():
         self.node.get_logger().debug(f'Header we are working with: {header}')
         self.depth_info = depth_info
         self.rgb_info = rgb_info
+        self.update_depth_registration()
         self.x_offset = 0
         self.y_offset = 0
-        self.roi = RegionOfInterest()
-        self.roi.x_offset = 0
-        self.roi.y_offset = 0
-        self.detect(rgb_img, header)
+        self.roi = _FULL_FRAME_ROI
+        with self.timer.stage("detect"):
+            self.detect(image, conversion, header)
 
     def image_callback_rgb(self, rgb_img, rgb_info):
 
@@ -1230,11 +1223,13 @@ class FullbodyDetector():
             # todo(juandpenan) uncomment return
             return
         
-        rgb_img = self.br.imgmsg_to_cv2(rgb_img)        
+        with self.timer.stage("image_conversion"):
+            image, conversion = decode_imgmsg(self.br, rgb_img)
 
         header = copy.copy(rgb_info.header)
         self.rgb_info = rgb_info
-        self.detect(rgb_img, header)
+        with self.timer.stage("detect"):
+            self.detect(image, conversion, header)
 
     def get_image_topic(self):
         return self.image_subscriber.topic
@@ -0,0 +1,200 @@
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import mediapipe as mp
+import numpy as np
+
+from hri_fullbody.landmarks import HolisticLandmarks
+
+mp_holistic = mp.solutions.holistic
+
+
+class HolisticPool():
+    """ Fixed-size pool of Mediapipe Holistic models shared by all the
+        body detectors of a node.
+
+        Every worker owns one Holistic instance, created (and therefore
+        loaded) when the pool is built. Frames submitted by any body are
+        queued and processed by whichever worker is free, so memory use
+        does not grow with the number of tracked bodies and a new body
+        does not pay for loading a model graph.
+
+        With static_image_mode=False the models keep tracking state between
+        frames, which is only meaningful when all the frames come from the
+        same body: the pool is then restricted to one worker. """
+
+    def __init__(self, size=1, min_detection=0.7, static_image_mode=True):
+
+        self.static_image_mode = static_image_mode
+        self.size = max(1, int(size)) if static_image_mode else 1
+        self.min_detection = min_detection
+
+        self._jobs = queue.Queue()
+        self._workers = [self._start_worker(idx) for idx in range(self.size)]
+
+    def _start_worker(self, idx):
+        model = mp_holistic.Holistic(
+            min_detection_confidence=self.min_detection,
+            static_image_mode=self.static_image_mode)
+        worker = threading.Thread(
+            target=self._worker_loop,
+            args=(model,),
+            name="holistic_worker_%d" % idx,
+            daemon=True)
+        worker.start()
+        return worker
+
+    def _worker_loop(self, model):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                model.close()
+                return
+            image, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if image is None:
+                    model.reset()
+                    future.set_result(None)
+                else:
+                    future.set_result(HolisticLandmarks.from_results(
+                        model.process(image)))
+            except Exception as e:
+                future.set_exception(e)
+
+    def submit(self, image):
+        """ Queue an RGB image for inference. Returns a Future that
+            resolves to the HolisticLandmarks of the image. """
+        future = Future()
+        self._jobs.put((image, future))
+        return future
+
+    def process(self, image):
+        """ Blocking equivalent of Holistic.process(), running on the
+            first free worker of the pool. The results are returned as
+            HolisticLandmarks. """
+        return self.submit(image).result()
+
+    def reset(self):
+        """ Drop the tracking state of the models, forcing the next frame
+            to go through the full pose detector. Only useful when the pool
+            was created with static_image_mode=False. """
+        if self.static_image_mode:
+            return
+        self._jobs.put((None, Future()))
+
+    def close(self):
+        for _ in self._workers:
+            self._jobs.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+
+def _holistic_process_main(conn, min_detection, static_image_mode):
+    """ Worker process of HolisticProcessPool: runs Holistic on the images
+        found in the shared memory slot named by each request, and sends
+        back the packed landmarks """
+    model = mp_holistic.Holistic(
+        min_detection_confidence=min_detection,
+        static_image_mode=static_image_mode)
+    slot = None
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        if request == "reset":
+            model.reset()
+            conn.send(("ok", None))
+            continue
+        name, shape, dtype = request
+        try:
+            if slot is None or slot.name != name:
+                if slot is not None:
+                    slot.close()
+                slot = shared_memory.SharedMemory(name=name)
+            image = np.ndarray(shape, dtype, buffer=slot.buf)
+            landmarks = HolisticLandmarks.from_results(model.process(image))
+            del image
+            conn.send(("ok", landmarks.pack()))
+        except Exception as e:
+            conn.send(("error", repr(e)))
+    if slot is not None:
+        slot.close()
+    model.close()
+
+
+class HolisticProcessPool(HolisticPool):
+    """ HolisticPool whose models run in worker processes, so that
+        neither the inference nor the landmarks conversion compete for
+        the node's GIL.
+
+        Each worker process is driven by a thread of the node: images are
+        copied into a shared memory slot owned by that thread (never
+        pickled), and the landmarks come back as a single compact array
+        (see HolisticLandmarks.pack). """
+
+    def _start_worker(self, idx):
+        context = multiprocessing.get_context("spawn")
+        conn, worker_conn = context.Pipe()
+        process = context.Process(
+            target=_holistic_process_main,
+            args=(worker_conn, self.min_detection, self.static_image_mode),
+            name="holistic_process_%d" % idx,
+            daemon=True)
+        process.start()
+        worker = threading.Thread(
+            target=self._dispatch_loop,
+            args=(conn, process),
+            name="holistic_dispatcher_%d" % idx,
+            daemon=True)
+        worker.start()
+        return worker
+
+    def _dispatch_loop(self, conn, process):
+        slot = None
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            image, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if image is None:
+                    conn.send("reset")
+                    conn.recv()
+                    future.set_result(None)
+                    continue
+                image = np.ascontiguousarray(image)
+                # the slot only grows, and is reallocated when a larger
+                # image arrives
+                if slot is None or slot.size < image.nbytes:
+                    if slot is not None:
+                        slot.close()
+                        slot.unlink()
+                    slot = shared_memory.SharedMemory(
+                        create=True, size=image.nbytes)
+                np.ndarray(image.shape, image.dtype, buffer=slot.buf)[...] = \
+                    image
+                conn.send((slot.name, image.shape, image.dtype.str))
+                status, result = conn.recv()
+                if status != "ok":
+                    raise RuntimeError(
+                        "Holistic worker process error: %s" % result)
+                future.set_result(HolisticLandmarks.unpack(*result))
+            except Exception as e:
+                future.set_exception(e)
+
+        try:
+            conn.send(None)
+        except OSError:
+            pass  # the worker process already exited
+        process.join()
+        if slot is not None:
+            slot.close()
+            slot.unlink()
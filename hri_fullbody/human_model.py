@@ -0,0 +1,73 @@
+import io
+import threading
+
+from ikpy import chain
+
+from hri_fullbody.urdf_generator import make_urdf_human
+from hri_fullbody.forward_kinematics import URDFKinematics
+from hri_fullbody.batched_ik import IKChain, BatchedIKSolver
+
+# Placeholder body id used to generate the template URDF. Per-body
+# models are obtained by replacing it with the actual body id.
+TEMPLATE_ID = "hri_fullbody_template_id"
+
+# Base joints of the right arm, left arm, right leg and left leg
+# IK chains, in the order expected by compute_jointstate
+IK_CHAIN_BASE_JOINTS = ["r_y_shoulder", "l_y_shoulder", "r_y_hip", "l_y_hip"]
+IK_ACTIVE_LINKS_MASK = [False, True, True, True, True, False]
+
+
+def _make_ik_chain(urdf, base_joint):
+    return chain.Chain.from_urdf_file(
+        io.StringIO(urdf),
+        base_elements=["%s_%s" % (base_joint, TEMPLATE_ID)],
+        base_element_type="joint",
+        active_links_mask=IK_ACTIVE_LINKS_MASK)
+
+
+def _make_batched_ik_chain(kinematics, base_joint):
+    # ikpy prepends an origin link to the URDF joints
+    return IKChain(
+        kinematics.chain("%s_%s" % (base_joint, TEMPLATE_ID)),
+        IK_ACTIVE_LINKS_MASK[1:])
+
+
+class HumanModelTemplate():
+    """ Human URDF model, IK chains and forward kinematics, built once
+        for a given set of limb lengths and shared by all the bodies
+        with those lengths.
+
+        Only the link and joint names differ between two bodies, so the
+        per-body URDF and forward kinematics are stamped out from the
+        template by renaming. The ikpy chains and the batched IK solver do
+        not depend on names and are not modified when solving: they are
+        shared as is. """
+
+    def __init__(self, **lengths):
+        self.urdf = make_urdf_human(TEMPLATE_ID, **lengths)
+        self.ik_chains = [_make_ik_chain(self.urdf, base_joint)
+                          for base_joint in IK_CHAIN_BASE_JOINTS]
+        self.kinematics = URDFKinematics(self.urdf)
+        self.ik_solver = BatchedIKSolver(
+            [_make_batched_ik_chain(self.kinematics, base_joint)
+             for base_joint in IK_CHAIN_BASE_JOINTS])
+
+    def make_urdf(self, body_id):
+        return self.urdf.replace(TEMPLATE_ID, body_id)
+
+    def make_kinematics(self, body_id):
+        return self.kinematics.renamed(TEMPLATE_ID, body_id)
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def get_human_model_template(**lengths):
+    """ Return the HumanModelTemplate for the given limb lengths (see
+        make_urdf_human), building it on first use """
+    key = tuple(sorted(lengths.items()))
+    with _templates_lock:
+        if key not in _templates:
+            _templates[key] = HumanModelTemplate(**lengths)
+        return _templates[key]
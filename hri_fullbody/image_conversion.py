@@ -0,0 +1,70 @@
+import cv2
+
+# Encoding of the images expected by Mediapipe
+MODEL_ENCODING = "rgb8"
+
+# Encodings only differing from rgb8 by their channels: these images are
+# downscaled before their color conversion, on their original pixels
+_CHANNEL_CONVERSIONS = {
+    "rgb8": None,
+    "bgr8": cv2.COLOR_BGR2RGB,
+    "rgba8": cv2.COLOR_RGBA2RGB,
+    "bgra8": cv2.COLOR_BGRA2RGB,
+    "mono8": cv2.COLOR_GRAY2RGB,
+}
+
+
+def downscale(image, max_size):
+    """ image resized so that its largest side is at most max_size
+        pixels, keeping its aspect ratio. Returns image itself when it
+        is already small enough, or when max_size is 0.
+
+        Bilinear interpolation only reads the source pixels around each
+        output pixel, several times faster than area averaging on 1080p
+        and 4K frames, and close to what Holistic does internally. """
+    height, width = image.shape[:2]
+    if not max_size or max(height, width) <= max_size:
+        return image
+    scale = max_size / max(height, width)
+    return cv2.resize(
+        image,
+        (max(1, round(width * scale)), max(1, round(height * scale))),
+        interpolation=cv2.INTER_LINEAR)
+
+
+def decode_imgmsg(bridge, img_msg):
+    """ Array of a sensor_msgs/Image, and the OpenCV color conversion
+        code turning it into an RGB image (None if it already is one).
+
+        For rgb8, bgr8, rgba8, bgra8 and mono8 images, the array is a
+        view on the message data, so that they can be cropped and
+        downscaled before paying for any conversion. Other encodings
+        (yuv422, ...) are converted to rgb8 by cv_bridge. """
+    if img_msg.encoding in _CHANNEL_CONVERSIONS:
+        return (bridge.imgmsg_to_cv2(img_msg, "passthrough"),
+                _CHANNEL_CONVERSIONS[img_msg.encoding])
+    return bridge.imgmsg_to_cv2(img_msg, MODEL_ENCODING), None
+
+
+def to_rgb(image, conversion, max_size=0):
+    """ RGB image of an image decoded by decode_imgmsg (or of a crop of
+        it), downscaled to max_size (see downscale) before its color
+        conversion. Not copied when no resizing nor conversion is
+        needed. """
+    image = downscale(image, max_size)
+    if conversion is None:
+        return image
+    return cv2.cvtColor(image, conversion)
+
+
+def imgmsg_to_rgb(bridge, img_msg, max_size=0):
+    """ Image of a sensor_msgs/Image as an RGB array, whatever the
+        message encoding (rgb8, bgr8, rgba8, bgra8, mono8, yuv422, ...),
+        optionally downscaled so that its largest side is at most
+        max_size pixels.
+
+        Each image goes through at most one resizing and one color
+        conversion, the resizing first; rgb8 images that do not need
+        resizing are returned as is, as a view on the message data,
+        without any copy. """
+    return to_rgb(*decode_imgmsg(bridge, img_msg), max_size)
@@ -1,3 +1,7 @@
+import numpy as np
+
+# "batched": BatchedIKSolver, "ikpy": one ikpy optimization per limb
+IK_SOLVERS = ("batched", "ikpy")
 
 HUMAN_JOINT_NAMES = ["waist",
         "r_head",   
@@ -21,23 +25,77 @@ HUMAN_JOINT_NAMES = ["waist",
         "r_knee"]
 
 
-def compute_jointstate(ik_chains, torso, l_wrist, l_ankle, r_wrist, r_ankle):
+def _limbs_initial_guess(previous_jointstate):
+    """ Split the positions of a previous joint state (ordered as
+        HUMAN_JOINT_NAMES) by IK chain: right arm, left arm,
+        right leg, left leg """
+
+    p = list(previous_jointstate)
+    return [p[8:12], p[4:8], p[16:20], p[12:16]]
+
+
+def compute_jointstate(ik_chains, torso, l_wrist, l_ankle, r_wrist, r_ankle, previous_jointstate=None):
 
     r_arm, l_arm, r_leg, l_leg = ik_chains
 
+    # ikpy initial positions include the chains inactive first and last links
+    if previous_jointstate is not None:
+        r_arm_init, l_arm_init, r_leg_init, l_leg_init = [
+            [0.0] + limb + [0.0]
+            for limb in _limbs_initial_guess(previous_jointstate)]
+    else:
+        r_arm_init = l_arm_init = r_leg_init = l_leg_init = None
+
     r_arm_target = r_wrist - torso # TODO: INCORRECT! need to *transform* r_wrist in the torso's reference frame, eg account for the torso's rotation!!
-    r_arm_joints = r_arm.inverse_kinematics(r_arm_target)
+    r_arm_joints = r_arm.inverse_kinematics(r_arm_target, initial_position=r_arm_init)
 
     l_arm_target = l_wrist - torso
-    l_arm_joints = l_arm.inverse_kinematics(l_arm_target)
+    l_arm_joints = l_arm.inverse_kinematics(l_arm_target, initial_position=l_arm_init)
 
     r_leg_target = r_ankle - torso
-    r_leg_joints = r_leg.inverse_kinematics(r_leg_target)
+    r_leg_joints = r_leg.inverse_kinematics(r_leg_target, initial_position=r_leg_init)
 
     l_leg_target = l_ankle - torso
-    l_leg_joints = l_leg.inverse_kinematics(l_leg_target)
+    l_leg_joints = l_leg.inverse_kinematics(l_leg_target, initial_position=l_leg_init)
 
 
     return [0.0, 0.0, 0.0, 0.0] + list(l_arm_joints)[1:-1] + list(r_arm_joints)[1:-1] + list(l_leg_joints)[1:-1] + list(r_leg_joints)[1:-1]
 
 
+def limbs_targets(torso, l_wrist, l_ankle, r_wrist, r_ankle):
+    """ IK targets of the four limbs (right arm, left arm, right leg,
+        left leg), relative to the torso, as a (4, 3) array """
+
+    return np.stack([r_wrist, l_wrist, r_ankle, l_ankle]) - torso
+
+
+def limbs_initial_guess(previous_jointstate):
+    """ BatchedIKSolver initial guess of the four limbs from a previous
+        joint state, None without one """
+
+    if previous_jointstate is None:
+        return None
+    return _limbs_initial_guess(previous_jointstate)
+
+
+def limbs_jointstate(limbs_joints):
+    """ Joint state positions (ordered as HUMAN_JOINT_NAMES) of the
+        BatchedIKSolver solution of the four limbs """
+
+    r_arm_joints, l_arm_joints, r_leg_joints, l_leg_joints = limbs_joints
+
+    return [0.0, 0.0, 0.0, 0.0] + list(l_arm_joints) + list(r_arm_joints) + list(l_leg_joints) + list(r_leg_joints)
+
+
+def compute_jointstate_batched(ik_solver, torso, l_wrist, l_ankle, r_wrist, r_ankle, previous_jointstate=None, tol=1e-3, max_iter=20):
+    """ Same as compute_jointstate, solving the four limbs in a single
+        pass of a BatchedIKSolver (see HumanModelTemplate.ik_solver).
+        Also returns the number of iterations used for each limb """
+
+    joints, iterations = ik_solver.solve(
+        limbs_targets(torso, l_wrist, l_ankle, r_wrist, r_ankle),
+        limbs_initial_guess(previous_jointstate),
+        tol=tol,
+        max_iter=max_iter)
+
+    return limbs_jointstate(joints), iterations
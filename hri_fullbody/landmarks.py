@@ -0,0 +1,98 @@
+import numpy as np
+
+# Columns of the landmark arrays
+X = 0
+Y = 1
+Z = 2
+VISIBILITY = 3
+
+
+def landmarks_to_array(landmark_list):
+    """ Convert a Mediapipe (Normalized)LandmarkList to a contiguous
+        (N, 4) array of x, y, z, visibility. Returns None when
+        the landmark list is not available """
+
+    if landmark_list is None:
+        return None
+    landmarks = landmark_list.landmark
+    return np.fromiter(
+        (v for lm in landmarks for v in (lm.x, lm.y, lm.z, lm.visibility)),
+        dtype=float,
+        count=4 * len(landmarks)).reshape(-1, 4)
+
+
+class HolisticLandmarks():
+    """ Mediapipe Holistic results as landmark arrays (see
+        landmarks_to_array), converted once per frame and then shared by
+        the skeleton, bounding boxes, position and joint state code.
+        Missing landmark sets are None. """
+
+    def __init__(self,
+                 face=None,
+                 left_hand=None,
+                 right_hand=None,
+                 pose=None,
+                 pose_world=None):
+        self.face = face
+        self.left_hand = left_hand
+        self.right_hand = right_hand
+        self.pose = pose
+        self.pose_world = pose_world
+
+    @classmethod
+    def from_results(cls, results):
+        return cls(
+            landmarks_to_array(results.face_landmarks),
+            landmarks_to_array(results.left_hand_landmarks),
+            landmarks_to_array(results.right_hand_landmarks),
+            landmarks_to_array(results.pose_landmarks),
+            landmarks_to_array(results.pose_world_landmarks))
+
+    def to_frame(self, x_offset, y_offset, width, height):
+        """ Landmarks found in a crop of a frame, in the normalized
+            coordinates of the whole frame. The crop offsets and size
+            are given as fractions of the frame size. Landmark depths
+            (z) follow the x scale, as in Mediapipe; the metric pose
+            world landmarks are unchanged. """
+
+        def remap(landmarks):
+            if landmarks is None:
+                return None
+            landmarks = landmarks.copy()
+            landmarks[:, X] = x_offset + landmarks[:, X] * width
+            landmarks[:, Y] = y_offset + landmarks[:, Y] * height
+            landmarks[:, Z] *= width
+            return landmarks
+
+        return HolisticLandmarks(
+            remap(self.face),
+            remap(self.left_hand),
+            remap(self.right_hand),
+            remap(self.pose),
+            self.pose_world)
+
+    def pack(self):
+        """ All the landmark arrays as a (sizes, data) pair: the number
+            of landmarks of each set (-1 when missing), and a single
+            float32 array of all the landmarks, to be sent to another
+            process """
+        arrays = [self.face, self.left_hand, self.right_hand,
+                  self.pose, self.pose_world]
+        sizes = [-1 if a is None else len(a) for a in arrays]
+        present = [a for a in arrays if a is not None]
+        data = np.concatenate(present) if present else np.empty((0, 4))
+        return sizes, data.astype(np.float32)
+
+    @classmethod
+    def unpack(cls, sizes, data):
+        """ Inverse of pack() """
+        arrays = []
+        start = 0
+        data = data.astype(float)
+        for size in sizes:
+            if size < 0:
+                arrays.append(None)
+            else:
+                arrays.append(data[start:start + size])
+                start += size
+        return cls(*arrays)
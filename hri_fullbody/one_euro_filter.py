@@ -24,6 +24,8 @@ SOFTWARE.
 
 import math
 
+import numpy as np
+
 
 def smoothing_factor(t_e, cutoff):
     r = 2 * math.pi * cutoff * t_e
@@ -73,3 +75,113 @@ class OneEuroFilter:
 
         
         return x_hat, t_e
+
+
+class OneEuroFilterBank:
+    """ One Euro filters of all the channels of an N-dimensional signal
+        (eg, the 3D keypoints or joint angles of several bodies), updated
+        together in a single NumPy call.
+
+        min_cutoff, beta and d_cutoff are scalars or per-channel arrays,
+        broadcast to shape. Each channel is initialized with its first
+        valid (non-NaN) sample, and can be reset independently. """
+
+    def __init__(self, shape, min_cutoff=1.0, beta=0.0, d_cutoff=1.0):
+        self.min_cutoff = np.broadcast_to(
+            np.asarray(min_cutoff, dtype=float), shape)
+        self.beta = np.broadcast_to(np.asarray(beta, dtype=float), shape)
+        self.d_cutoff = np.broadcast_to(
+            np.asarray(d_cutoff, dtype=float), shape)
+        self.x_prev = np.full(shape, np.nan)
+        self.dx_prev = np.zeros(shape)
+        self.t_prev = np.full(shape, np.nan)
+        self.initialized = np.zeros(shape, dtype=bool)
+
+    def reset(self, mask=None):
+        """ Reset the channels selected by the boolean mask (all of them
+            if None): they are re-initialized by their next sample """
+        if mask is None:
+            mask = np.ones(self.initialized.shape, dtype=bool)
+        self.x_prev[mask] = np.nan
+        self.dx_prev[mask] = 0.0
+        self.t_prev[mask] = np.nan
+        self.initialized[mask] = False
+
+    def __call__(self, t, x):
+        """ Filter the sample x taken at time t (in seconds).
+
+            NaN samples leave their channel unchanged, as do samples not
+            more recent than the previous one. Returns the filtered
+            signal (NaN for channels never initialized) and the time
+            elapsed since the previous sample of each channel. """
+        x = np.asarray(x, dtype=float)
+        t_e = t - self.t_prev
+        valid = ~np.isnan(x)
+        update = valid & self.initialized & (t_e > 0)
+        init = valid & ~self.initialized
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # The filtered derivative of the signal.
+            a_d = smoothing_factor(t_e, self.d_cutoff)
+            dx = (x - self.x_prev) / t_e
+            dx_hat = exponential_smoothing(a_d, dx, self.dx_prev)
+
+            # The filtered signal.
+            cutoff = self.min_cutoff + self.beta * np.abs(dx_hat)
+            a = smoothing_factor(t_e, cutoff)
+            x_hat = exponential_smoothing(a, x, self.x_prev)
+
+        self.x_prev = np.where(update, x_hat, self.x_prev)
+        self.dx_prev = np.where(update, dx_hat, self.dx_prev)
+        self.x_prev[init] = x[init]
+        self.t_prev[update | init] = t
+        self.initialized |= init
+
+        return self.x_prev.copy(), t_e
+
+
+class OneEuroFilterArray:
+    """ Scalar OneEuroFilter of each channel of a small N-dimensional
+        signal (eg, a body position), with the interface of
+        OneEuroFilterBank (without per-channel parameters).
+
+        Below a few tens of channels, looping over scalar filters is
+        cheaper than the NumPy calls of the bank (see the filters
+        benchmark). """
+
+    def __init__(self, shape, min_cutoff=1.0, beta=0.0, d_cutoff=1.0):
+        self.shape = shape
+        self.params = dict(min_cutoff=min_cutoff, beta=beta,
+                           d_cutoff=d_cutoff)
+        self.filters = [None] * int(np.prod(shape))
+
+    @property
+    def initialized(self):
+        return np.reshape([f is not None for f in self.filters], self.shape)
+
+    def reset(self, mask=None):
+        """ Reset the channels selected by the boolean mask (all of them
+            if None): they are re-initialized by their next sample """
+        if mask is None:
+            self.filters = [None] * len(self.filters)
+            return
+        for idx in np.flatnonzero(mask):
+            self.filters[idx] = None
+
+    def __call__(self, t, x):
+        """ Same as OneEuroFilterBank.__call__ """
+        x_hat = np.empty(len(self.filters))
+        t_e = np.empty(len(self.filters))
+        for idx, value in enumerate(np.ravel(x).tolist()):
+            f = self.filters[idx]
+            if f is None:
+                if not math.isnan(value):
+                    self.filters[idx] = OneEuroFilter(t, value, **self.params)
+                x_hat[idx] = value
+                t_e[idx] = math.nan
+            elif math.isnan(value) or t <= f.t_prev:
+                x_hat[idx] = f.x_prev
+                t_e[idx] = t - f.t_prev
+            else:
+                x_hat[idx], t_e[idx] = f(t, value)
+        return x_hat.reshape(self.shape), t_e.reshape(self.shape)
@@ -0,0 +1,103 @@
+import contextlib
+import time
+
+import numpy as np
+from diagnostic_msgs.msg import DiagnosticStatus, KeyValue
+
+# Percentiles reported for each stage
+PERCENTILES = (50, 95, 99)
+
+_NULL_STAGE = contextlib.nullcontext()
+
+
+class _Stage():
+    """ Context manager recording the duration of one stage run """
+
+    def __init__(self, samples):
+        self.samples = samples
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.samples.add(time.perf_counter() - self.start)
+        return False
+
+
+class _RollingSamples():
+    """ Fixed size ring buffer of the last latency samples of a stage """
+
+    def __init__(self, window):
+        self.values = np.zeros(window)
+        self.count = 0
+
+    def add(self, value):
+        self.values[self.count % len(self.values)] = value
+        self.count += 1
+
+    def latest(self):
+        return self.values[:min(self.count, len(self.values))]
+
+
+class StageTimer():
+    """ Rolling latency statistics of the processing stages of a body
+        (image conversion, Holistic inference, IK, ...), over the last
+        window runs of each stage.
+
+        Stages are timed with `with timer.stage(name): ...`. When
+        disabled, stage() returns a shared no-op context manager, so
+        the instrumentation can be left in place at (almost) no cost. """
+
+    def __init__(self, enabled=True, window=300):
+        self.enabled = enabled
+        self.window = window
+        self.stages = {}
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL_STAGE
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = _Stage(_RollingSamples(self.window))
+        return stage
+
+    def record(self, name, seconds):
+        """ Record a duration measured outside of a stage() block """
+        if self.enabled:
+            self.stage(name).samples.add(seconds)
+
+    def stats(self):
+        """ Per-stage statistics: number of runs, and latency percentiles
+            (in milliseconds) over the rolling window, as a dict
+            {stage: {"runs": ..., "p50_ms": ..., ...}} """
+        stats = {}
+        # stages are added by the processing threads while the node
+        # reads the statistics: iterating over a snapshot
+        for name, stage in list(self.stages.items()):
+            samples = stage.samples.latest().copy()
+            if not samples.size:
+                continue
+            stats[name] = {"runs": stage.samples.count}
+            for p, value in zip(PERCENTILES,
+                                np.percentile(samples, PERCENTILES) * 1e3):
+                stats[name]["p%d_ms" % p] = float(value)
+        return stats
+
+    def diagnostic_status(self, name, hardware_id="", counters=None):
+        """ The stages statistics as a DiagnosticStatus message, with
+            the optional counters dict as additional values """
+        status = DiagnosticStatus()
+        status.level = DiagnosticStatus.OK
+        status.name = name
+        status.hardware_id = hardware_id
+        status.message = "Per-stage latency"
+        for stage, values in self.stats().items():
+            for key, value in values.items():
+                status.values.append(KeyValue(
+                    key="%s %s" % (stage, key),
+                    value="%d" % value if key == "runs" else "%.3f" % value))
+        for key, value in (counters or {}).items():
+            status.values.append(KeyValue(key=key, value=str(value)))
+        return status
@@ -0,0 +1,286 @@
+""" Offline replay of recorded frames through the full FullbodyDetector
+    pipeline (message synchronization, image conversion, detection, joint
+    state and TF computation), without camera nor ROS graph.
+
+    A recording is a directory containing:
+    - rgb/: one color image file per frame, sorted by file name;
+    - depth/ (optional): one 16 bits depth image file (in mm) per frame;
+    - camera_info.yaml, depth_info.yaml (optional): RGB and depth camera
+      calibrations, in the camera_calibration YAML format. Default
+      intrinsics are derived from the image size when missing. """
+
+import logging
+import os
+import resource
+import time
+
+import cv2
+from cv_bridge import CvBridge
+from rclpy.clock import Clock
+from sensor_msgs.msg import CameraInfo, RegionOfInterest
+
+from hri_fullbody.fullbody_detector import FullbodyDetector
+from hri_fullbody.holistic_pool import HolisticPool
+
+REPLAY_FRAME_ID = "replay_camera"
+
+
+class RecordingPublisher():
+    """ Stand-in for a rclpy publisher, counting the published messages
+        and keeping the last one """
+
+    def __init__(self, msg_type, topic):
+        self.msg_type = msg_type
+        self.topic = topic
+        self.count = 0
+        self.last = None
+
+    def publish(self, msg):
+        self.count += 1
+        self.last = msg
+
+
+class _ReplaySubscription():
+
+    def __init__(self, msg_type, topic, callback):
+        self.msg_type = msg_type
+        self.topic = topic
+        self.callback = callback
+
+
+class ReplayNode():
+    """ Stand-in for the rclpy node used by FullbodyDetector (and by the
+        message_filters subscribers and TF broadcasters it creates).
+
+        Publishers are RecordingPublisher, and subscriptions are only
+        called when a message is fed to their topic with deliver(), in the
+        calling thread. Parameters are kept in a plain dictionary. """
+
+    def __init__(self, name="fullbody_replay"):
+        self.name = name
+        self.publishers = []
+        self.subscriptions = {}
+        self.parameters = {}
+        self._logger = logging.getLogger(name)
+        self._clock = Clock()
+
+    def get_name(self):
+        return self.name
+
+    def get_logger(self):
+        return self._logger
+
+    def get_clock(self):
+        return self._clock
+
+    def create_publisher(self, msg_type, topic, qos_profile=None, **kwargs):
+        publisher = RecordingPublisher(msg_type, topic)
+        self.publishers.append(publisher)
+        return publisher
+
+    def destroy_publisher(self, publisher):
+        self.publishers.remove(publisher)
+
+    def create_subscription(self, msg_type, topic, callback,
+                            qos_profile=None, **kwargs):
+        subscription = _ReplaySubscription(msg_type, topic, callback)
+        self.subscriptions.setdefault(topic, []).append(subscription)
+        return subscription
+
+    def destroy_subscription(self, subscription):
+        self.subscriptions[subscription.topic].remove(subscription)
+
+    def declare_parameter(self, name, value=None, *args, **kwargs):
+        self.parameters[name] = value
+
+    def set_parameters(self, parameters):
+        for parameter in parameters:
+            self.parameters[parameter.name] = parameter.value
+
+    def has_parameter(self, name):
+        return name in self.parameters
+
+    def undeclare_parameter(self, name):
+        del self.parameters[name]
+
+    def deliver(self, topic, msg):
+        """ Call the subscriptions of topic with msg """
+        for subscription in list(self.subscriptions.get(topic, [])):
+            subscription.callback(msg)
+
+    def published(self):
+        """ Number of messages published on each topic """
+        counts = {}
+        for publisher in self.publishers:
+            counts[publisher.topic] = \
+                counts.get(publisher.topic, 0) + publisher.count
+        return counts
+
+
+def _default_camera_info(width, height):
+    """ Pinhole intrinsics with a ~53 degrees horizontal field of view """
+    info = CameraInfo()
+    info.width = width
+    info.height = height
+    f = float(width)
+    info.k = [f, 0.0, width / 2, 0.0, f, height / 2, 0.0, 0.0, 1.0]
+    info.r = [1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0]
+    info.p = [f, 0.0, width / 2, 0.0, 0.0, f, height / 2, 0.0,
+              0.0, 0.0, 1.0, 0.0]
+    info.distortion_model = "plumb_bob"
+    info.d = [0.0] * 5
+    return info
+
+
+def _load_camera_info(path, width, height):
+    """ CameraInfo from a camera_calibration YAML file, or default
+        intrinsics when the file does not exist """
+    if not os.path.exists(path):
+        return _default_camera_info(width, height)
+
+    import yaml
+
+    with open(path) as f:
+        calibration = yaml.safe_load(f)
+    info = CameraInfo()
+    info.width = calibration["image_width"]
+    info.height = calibration["image_height"]
+    info.k = [float(v) for v in calibration["camera_matrix"]["data"]]
+    info.distortion_model = calibration.get("distortion_model", "plumb_bob")
+    info.d = [float(v) for v in
+              calibration.get("distortion_coefficients", {}).get("data", [])]
+    info.r = [float(v) for v in calibration.get(
+        "rectification_matrix", {}).get("data", _default_camera_info(
+            info.width, info.height).r)]
+    info.p = [float(v) for v in calibration.get(
+        "projection_matrix", {}).get("data", _default_camera_info(
+            info.width, info.height).p)]
+    return info
+
+
+def _load_images(path, flags):
+    images = []
+    for name in sorted(os.listdir(path)):
+        image = cv2.imread(os.path.join(path, name), flags)
+        if image is not None:
+            images.append(image)
+    if not images:
+        raise RuntimeError("No image found in %s" % path)
+    return images
+
+
+class Recording():
+    """ Frames of a recording directory (see module documentation),
+        loaded in memory. Color images are kept in BGR order, as
+        published by the camera drivers. """
+
+    def __init__(self, path, max_frames=None):
+        self.path = path
+        self.rgb = _load_images(os.path.join(path, "rgb"),
+                                cv2.IMREAD_COLOR)[:max_frames]
+        height, width = self.rgb[0].shape[:2]
+        self.rgb_info = _load_camera_info(
+            os.path.join(path, "camera_info.yaml"), width, height)
+
+        self.depth = None
+        self.depth_info = None
+        if os.path.isdir(os.path.join(path, "depth")):
+            self.depth = _load_images(os.path.join(path, "depth"),
+                                      cv2.IMREAD_ANYDEPTH)[:len(self.rgb)]
+            if len(self.depth) != len(self.rgb):
+                raise RuntimeError(
+                    "%d depth images for %d color images in %s"
+                    % (len(self.depth), len(self.rgb), path))
+            height, width = self.depth[0].shape[:2]
+            self.depth_info = _load_camera_info(
+                os.path.join(path, "depth_info.yaml"), width, height)
+
+    def __len__(self):
+        return len(self.rgb)
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def replay(recording, bodies=1, use_depth=False, runs=1,
+           holistic_pool_size=1, min_detection=0.7, **detector_args):
+    """ Replay the frames of recording through FullbodyDetector, in
+        single body mode for bodies=1, or with bodies detectors in multi
+        body mode, each receiving the full frame as its cropped image.
+
+        Returns the per-frame latencies (in seconds), the per-stage
+        statistics of each body (see StageTimer.stats), the number of
+        messages published on each topic and the peak resident memory
+        of the process (in MB). """
+    if use_depth and recording.depth is None:
+        raise RuntimeError("No depth images in %s" % recording.path)
+
+    node = ReplayNode()
+    bridge = CvBridge()
+    single_body = bodies == 1
+    pool = HolisticPool(
+        1 if single_body else holistic_pool_size, min_detection)
+    detectors = [
+        FullbodyDetector(
+            node,
+            use_depth,
+            False,
+            "replay%d" % idx,
+            single_body=single_body,
+            min_detection=min_detection,
+            holistic_pool=pool,
+            profiling=True,
+            **detector_args)
+        for idx in range(bodies)]
+
+    latencies = []
+    try:
+        for _ in range(runs):
+            for idx in range(len(recording)):
+                # the synchronizers stamp headerless messages (the ROIs)
+                # with the current time: frames are stamped likewise
+                stamp = node.get_clock().now().to_msg()
+                rgb_msg = bridge.cv2_to_imgmsg(recording.rgb[idx], "bgr8")
+                rgb_msg.header.stamp = stamp
+                rgb_msg.header.frame_id = REPLAY_FRAME_ID
+                rgb_info = recording.rgb_info
+                rgb_info.header = rgb_msg.header
+                if use_depth:
+                    depth_msg = bridge.cv2_to_imgmsg(
+                        recording.depth[idx], "16UC1")
+                    depth_msg.header = rgb_msg.header
+                    depth_info = recording.depth_info
+                    depth_info.header = rgb_msg.header
+
+                start = time.perf_counter()
+                node.deliver("camera_info", rgb_info)
+                node.deliver("/camera_info", rgb_info)
+                if use_depth:
+                    node.deliver("/depth_image", depth_msg)
+                    node.deliver("/depth_info", depth_info)
+                if single_body:
+                    node.deliver("/image", rgb_msg)
+                else:
+                    roi = RegionOfInterest()
+                    roi.width = rgb_info.width
+                    roi.height = rgb_info.height
+                    for detector in detectors:
+                        node.deliver(
+                            "/humans/bodies/%s/roi" % detector.body_id, roi)
+                        node.deliver(
+                            "/humans/bodies/%s/cropped" % detector.body_id,
+                            rgb_msg)
+                latencies.append(time.perf_counter() - start)
+    finally:
+        for detector in detectors:
+            detector.unregister()
+        pool.close()
+
+    return {
+        "latencies": latencies,
+        "stages": {d.body_id: d.timer.stats() for d in detectors},
+        "published": node.published(),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
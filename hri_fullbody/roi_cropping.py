@@ -0,0 +1,84 @@
+import numpy as np
+
+from hri_fullbody.landmarks import X, Y, VISIBILITY
+
+
+class RoiCropper():
+    """ Single body mode: region of the next frame to run Holistic on,
+        from the person found in the previous frames.
+
+        The person box (all its landmarks, in normalized frame
+        coordinates) is smoothed over time: its size is low-pass
+        filtered, but never smaller than the latest box, and its center
+        is extrapolated with its smoothed velocity. The crop is that
+        box grown by margin times its size on each side.
+
+        The whole frame is used when no person has been found yet, after
+        a detection with a mean pose visibility below min_confidence (see
+        reset()), or when the crop would cover most of the frame anyway
+        (more than max_area of it). """
+
+    def __init__(self, margin=0.25, min_confidence=0.5, smoothing=0.5,
+                 max_area=0.8):
+        self.margin = margin
+        self.min_confidence = min_confidence
+        self.smoothing = smoothing
+        self.max_area = max_area
+        self.reset()
+
+    def reset(self):
+        """ Go back to whole frames, until the next update() """
+        self.center = None
+        self.size = None
+        self.velocity = np.zeros(2)
+
+    def confident(self, landmarks):
+        """ Whether landmarks hold a person found with enough
+            confidence to guide the next crops """
+        return landmarks.pose is not None \
+            and landmarks.pose[:, VISIBILITY].mean() >= self.min_confidence
+
+    def update(self, landmarks):
+        """ Track the person of landmarks, in normalized frame
+            coordinates. Resets the tracking if not confident. """
+        if not self.confident(landmarks):
+            self.reset()
+            return
+        points = np.concatenate([
+            lm[:, [X, Y]] for lm in (landmarks.face,
+                                     landmarks.left_hand,
+                                     landmarks.right_hand,
+                                     landmarks.pose)
+            if lm is not None])
+        points = np.clip(points, 0.0, 1.0)
+        box_min = points.min(axis=0)
+        box_max = points.max(axis=0)
+        center = (box_min + box_max) / 2
+        size = box_max - box_min
+
+        if self.center is None:
+            self.center = center
+            self.size = size
+            return
+        a = self.smoothing
+        self.velocity = a * (center - self.center) + (1 - a) * self.velocity
+        self.center = center
+        self.size = np.maximum(size, a * size + (1 - a) * self.size)
+
+    def crop(self, width, height):
+        """ Pixel region (x_min, y_min, x_max, y_max) of the next frame,
+            of the given size, to run Holistic on. None for the whole
+            frame. """
+        if self.center is None:
+            return None
+        center = self.center + self.velocity
+        half = self.size * (0.5 + self.margin)
+        box_min = np.clip(center - half, 0.0, 1.0)
+        box_max = np.clip(center + half, 0.0, 1.0)
+        if np.prod(box_max - box_min) > self.max_area:
+            return None
+        x_min, y_min = np.floor(box_min * [width, height]).astype(int).tolist()
+        x_max, y_max = np.ceil(box_max * [width, height]).astype(int).tolist()
+        if x_max <= x_min or y_max <= y_min:
+            return None
+        return x_min, y_min, x_max, y_max
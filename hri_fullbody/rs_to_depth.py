@@ -1,6 +1,97 @@
 import numpy as np
 from image_geometry import PinholeCameraModel
 
+from hri_fullbody.depth_sampling import sample_depth
+
+
+def _camera_intrinsics(camera_info):
+    return (camera_info.width, camera_info.height, tuple(camera_info.k))
+
+
+class DepthRegistration():
+    """ Mapping from RGB image pixels to depth image pixels, and
+        back-projection of depth pixels to 3D points, for a pair of
+        RGB and depth cameras.
+
+        The pixel mapping and back-projection factors are precomputed as
+        per-column and per-row lookup tables, so a registration is built
+        once per CameraInfo pair and reused as long as the intrinsics do
+        not change (see matches()). """
+
+    def __init__(self, rgb_camera_info, depth_camera_info):
+        self.intrinsics = (_camera_intrinsics(rgb_camera_info),
+                           _camera_intrinsics(depth_camera_info))
+
+        depth_model = PinholeCameraModel()
+        rgb_model = PinholeCameraModel()
+
+        depth_model.fromCameraInfo(depth_camera_info)
+        rgb_model.fromCameraInfo(rgb_camera_info)
+
+        self.rgb_width = rgb_model.width
+        self.rgb_height = rgb_model.height
+
+        # RGB column/row -> depth column/row, -1 when outside
+        # of the depth image
+        x_d = (((np.arange(rgb_model.width) - rgb_model.cx())
+                * depth_model.fx()
+                / rgb_model.fx())
+               + depth_model.cx()).astype(int)
+        y_d = (((np.arange(rgb_model.height) - rgb_model.cy())
+                * depth_model.fy()
+                / rgb_model.fy())
+               + depth_model.cy()).astype(int)
+        x_d[(x_d <= 0) | (x_d >= depth_model.width)] = -1
+        y_d[(y_d <= 0) | (y_d >= depth_model.height)] = -1
+        self.x_lut = x_d
+        self.y_lut = y_d
+
+        # depth column/row -> x/z and y/z ratios of the 3D point
+        self.x_factor = \
+            (np.arange(depth_model.width) - depth_model.cx()) / depth_model.fx()
+        self.y_factor = \
+            (np.arange(depth_model.height) - depth_model.cy()) / depth_model.fy()
+
+    def matches(self, rgb_camera_info, depth_camera_info):
+        """ Whether this registration is still valid for the given
+            CameraInfo pair """
+        return self.intrinsics == (_camera_intrinsics(rgb_camera_info),
+                                   _camera_intrinsics(depth_camera_info))
+
+    def rgb_to_depth_pixels(self, x_rgb, y_rgb, x_offset=0, y_offset=0):
+        """ Depth image pixels corresponding to the RGB pixels
+            (x_rgb + x_offset, y_rgb + y_offset). Returns the depth
+            columns, rows and a validity mask """
+        x_rgb = np.clip(np.asarray(x_rgb, dtype=int) + x_offset,
+                        0, self.rgb_width - 1)
+        y_rgb = np.clip(np.asarray(y_rgb, dtype=int) + y_offset,
+                        0, self.rgb_height - 1)
+        x_d = self.x_lut[x_rgb]
+        y_d = self.y_lut[y_rgb]
+        return x_d, y_d, (x_d >= 0) & (y_d >= 0)
+
+    def rgb_to_xyz(self, x_rgb, y_rgb, depth_data, x_offset=0, y_offset=0,
+                   window=1, statistic="median"):
+        """ 3D points, in the depth camera frame, of a set of RGB pixels.
+            Returns a (N, 3) array, with NaN rows for the pixels
+            falling outside of the depth image.
+
+            With window > 1, the depth of each point is a robust statistic
+            of the window x window depth pixels around it, ignoring
+            invalid (zero) ones (see sample_depth) """
+        x_d, y_d, valid = self.rgb_to_depth_pixels(
+            x_rgb, y_rgb, x_offset, y_offset)
+        xyz = np.full(x_d.shape + (3,), np.nan)
+        if window > 1:
+            z = sample_depth(depth_data, x_d[valid], y_d[valid],
+                             window, statistic) / 1000
+        else:
+            z = depth_data[y_d[valid], x_d[valid]] / 1000  # check this huh
+        xyz[valid, 0] = self.x_factor[x_d[valid]] * z
+        xyz[valid, 1] = self.y_factor[y_d[valid]] * z
+        xyz[valid, 2] = z
+        return xyz
+
 
 def rgb_to_xyz(
         x_rgb,
@@ -10,34 +101,8 @@ def rgb_to_xyz(
         depth_data,
         x_offset = 0,
         y_offset = 0):
-    depth_model = PinholeCameraModel()
-    rgb_model = PinholeCameraModel()
-
-    depth_model.fromCameraInfo(depth_camera_info)
-    rgb_model.fromCameraInfo(rgb_camera_info)
-
-    x_rgb = x_rgb + x_offset
-    y_rgb = y_rgb + y_offset
-
-    if x_rgb > rgb_model.width:
-        x_rgb = rgb_model.width - 1
-    if y_rgb > rgb_model.height:
-        y_rgb = rgb_model.height - 1
-
-    x_d = int(((x_rgb - rgb_model.cx())
-               * depth_model.fx()
-               / rgb_model.fx())
-              + depth_model.cx())
-    y_d = int(((y_rgb - rgb_model.cy())
-               * depth_model.fy()
-               / rgb_model.fy())
-              + depth_model.cy())
-    if not (0 < x_d < depth_model.width and 0 < y_d < depth_model.height):
+    xyz = DepthRegistration(rgb_camera_info, depth_camera_info).rgb_to_xyz(
+        [x_rgb], [y_rgb], depth_data, x_offset, y_offset)[0]
+    if np.isnan(xyz).any():
         return np.array([None, None, None])
-    z = depth_data[y_d][x_d]/1000  # check this huh
-    x = (x_d - depth_model.cx())*z/depth_model.fx()
-    y = (y_d - depth_model.cy())*z/depth_model.fy()
-
-    return np.array([x, y, z])
-
-
+    return xyz
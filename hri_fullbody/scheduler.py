@@ -0,0 +1,76 @@
+import logging
+import threading
+import time
+
+
+class LatestOnlyScheduler():
+    """ Runs callback in a dedicated thread, on the most recently
+        submitted arguments only.
+
+        submit() returns immediately. Arguments submitted while the
+        callback is busy replace the pending ones, which are dropped: when
+        processing is slower than the input rate, the newest frame is
+        always the next one processed and the latency stays bounded
+        instead of growing with a queue of stale frames.
+
+        The number of submitted, processed and dropped calls is kept, and
+        the age of each processed call (time between its submission and
+        the start of its processing) is recorded as the "frame_age" stage
+        of timer, if any (see StageTimer). """
+
+    def __init__(self, callback, timer=None, logger=None,
+                 name="latest_only_scheduler"):
+        self.callback = callback
+        self.timer = timer
+        self.logger = logger or logging.getLogger(name)
+        self.submitted = 0
+        self.processed = 0
+        self.dropped = 0
+
+        self._pending = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._worker = threading.Thread(
+            target=self._worker_loop, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, *args):
+        with self._condition:
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = (args, time.perf_counter())
+            self.submitted += 1
+            self._condition.notify()
+
+    def _worker_loop(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                args, submitted_at = self._pending
+                self._pending = None
+
+            if self.timer is not None:
+                self.timer.record(
+                    "frame_age", time.perf_counter() - submitted_at)
+            try:
+                self.callback(*args)
+            except Exception as e:
+                self.logger.error("Error while processing a frame: %s" % e)
+            self.processed += 1
+
+    def stats(self):
+        return {"submitted_frames": self.submitted,
+                "processed_frames": self.processed,
+                "dropped_frames": self.dropped}
+
+    def close(self, timeout=1.0):
+        """ Stop the worker thread once the frame being processed, if
+            any, is done. Pending arguments are dropped. """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if threading.current_thread() is not self._worker:
+            self._worker.join(timeout)
@@ -0,0 +1,159 @@
+import numpy as np
+
+from hri_fullbody.one_euro_filter import OneEuroFilterArray, \
+    OneEuroFilterBank
+
+SMOOTHING_METHODS = ("none", "one_euro", "kalman")
+
+# Number of channels from which One Euro filtering is cheaper with a
+# OneEuroFilterBank than with scalar filters (see the filters benchmark)
+BANK_MIN_CHANNELS = 16
+
+# Filter parameters of each smoothed signal, in the signal units:
+# normalized image coordinates for the 2D skeleton, meters for the
+# 3D keypoints, millimeters for the face translation and unit
+# quaternion components for the face rotation
+SMOOTHING_PARAMS = {
+    "skeleton_2d": {
+        "one_euro": dict(min_cutoff=1.0, beta=10.0, d_cutoff=1.0),
+        "kalman": dict(process_noise=1.0, measurement_noise=2.5e-5),
+    },
+    "keypoints_3d": {
+        "one_euro": dict(min_cutoff=1.0, beta=5.0, d_cutoff=1.0),
+        "kalman": dict(process_noise=2.0, measurement_noise=4e-4),
+    },
+    "face_translation": {
+        "one_euro": dict(min_cutoff=1.0, beta=0.01, d_cutoff=1.0),
+        "kalman": dict(process_noise=1e4, measurement_noise=100.0),
+    },
+    "face_rotation": {
+        "one_euro": dict(min_cutoff=1.0, beta=1.0, d_cutoff=1.0),
+        "kalman": dict(process_noise=0.02, measurement_noise=1e-4),
+    },
+}
+
+
+class ConstantVelocityKalmanBank():
+    """ Constant velocity Kalman filters of all the channels of an
+        N-dimensional signal, updated together in a single NumPy call.
+
+        Each channel state is its value and rate of change, with a white
+        acceleration process noise of spectral density process_noise and
+        a measurement noise of variance measurement_noise (scalars or
+        per-channel arrays). Same interface as OneEuroFilterBank. """
+
+    def __init__(self, shape, process_noise=1.0, measurement_noise=1e-4,
+                 velocity_variance=1.0):
+        self.q = np.broadcast_to(np.asarray(process_noise, dtype=float), shape)
+        self.r = np.broadcast_to(
+            np.asarray(measurement_noise, dtype=float), shape)
+        self.velocity_variance = velocity_variance
+        self.x_prev = np.full(shape, np.nan)
+        self.v_prev = np.zeros(shape)
+        # state covariance, [[p00, p01], [p01, p11]] per channel
+        self.p00 = np.zeros(shape)
+        self.p01 = np.zeros(shape)
+        self.p11 = np.zeros(shape)
+        self.t_prev = np.full(shape, np.nan)
+        self.initialized = np.zeros(shape, dtype=bool)
+
+    def reset(self, mask=None):
+        """ Reset the channels selected by the boolean mask (all of them
+            if None): they are re-initialized by their next sample """
+        if mask is None:
+            mask = np.ones(self.initialized.shape, dtype=bool)
+        self.x_prev[mask] = np.nan
+        self.v_prev[mask] = 0.0
+        self.t_prev[mask] = np.nan
+        self.initialized[mask] = False
+
+    def __call__(self, t, x):
+        """ Filter the sample x taken at time t (in seconds). NaN samples
+            leave their channel unchanged, as do samples not more recent
+            than the previous one. Returns the filtered signal (NaN for
+            channels never initialized) and the time elapsed since the
+            previous sample of each channel. """
+        x = np.asarray(x, dtype=float)
+        dt = t - self.t_prev
+        valid = ~np.isnan(x)
+        update = valid & self.initialized & (dt > 0)
+        init = valid & ~self.initialized
+
+        with np.errstate(invalid="ignore"):
+            # prediction
+            x_pred = self.x_prev + self.v_prev * dt
+            p00 = self.p00 + dt * (2 * self.p01 + dt * self.p11) \
+                + self.q * dt**3 / 3
+            p01 = self.p01 + dt * self.p11 + self.q * dt**2 / 2
+            p11 = self.p11 + self.q * dt
+
+            # correction
+            s = p00 + self.r
+            k0 = p00 / s
+            k1 = p01 / s
+            innovation = x - x_pred
+
+        self.x_prev = np.where(update, x_pred + k0 * innovation, self.x_prev)
+        self.v_prev = np.where(update, self.v_prev + k1 * innovation,
+                               self.v_prev)
+        self.p00 = np.where(update, (1 - k0) * p00, self.p00)
+        self.p01 = np.where(update, (1 - k0) * p01, self.p01)
+        self.p11 = np.where(update, p11 - k1 * p01, self.p11)
+
+        self.x_prev[init] = x[init]
+        self.v_prev[init] = 0.0
+        self.p00[init] = self.r[init]
+        self.p01[init] = 0.0
+        self.p11[init] = self.velocity_variance
+        self.t_prev[update | init] = t
+        self.initialized |= init
+
+        return self.x_prev.copy(), dt
+
+
+def make_smoothing_filter(method, signal, shape):
+    """ Filter bank of the given method ("one_euro" or "kalman") for a
+        signal of SMOOTHING_PARAMS, with the given shape """
+    params = SMOOTHING_PARAMS[signal][method]
+    if method == "one_euro":
+        if np.prod(shape) < BANK_MIN_CHANNELS:
+            return OneEuroFilterArray(shape, **params)
+        return OneEuroFilterBank(shape, **params)
+    if method == "kalman":
+        return ConstantVelocityKalmanBank(shape, **params)
+    raise ValueError("Unknown smoothing method: %s" % method)
+
+
+class SmoothingStage():
+    """ Smoothing of the signals of a body (2D skeleton and 3D
+        keypoints), one filter bank per signal. The joint angles are
+        computed from the smoothed 3D keypoints, and are not filtered
+        again.
+
+        Filter banks are created on the first sample of each signal, and
+        re-created if its shape changes. With method "none", the signals
+        are returned as is. """
+
+    def __init__(self, method="one_euro"):
+        if method not in SMOOTHING_METHODS:
+            raise ValueError("Unknown smoothing method: %s" % method)
+        self.method = method
+        self.filters = {}
+
+    def __call__(self, signal, t, values):
+        """ Smoothed values of signal, sampled at time t (in seconds).
+            NaN values are kept as is. """
+        values = np.asarray(values, dtype=float)
+        if self.method == "none":
+            return values
+        bank = self.filters.get(signal)
+        if bank is None or bank.initialized.shape != values.shape:
+            bank = make_smoothing_filter(self.method, signal, values.shape)
+            self.filters[signal] = bank
+        smoothed, _ = bank(t, values)
+        return np.where(np.isnan(values), values, smoothed)
+
+    def reset(self):
+        """ Forget the past samples, eg when the body is lost """
+        for bank in self.filters.values():
+            bank.reset()
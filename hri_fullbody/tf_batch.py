@@ -0,0 +1,87 @@
+import threading
+
+from geometry_msgs.msg import TransformStamped
+
+
+def set_transform(t, translation, rotation=(0.0, 0.0, 0.0, 1.0)):
+    """ Update in place the (x, y, z) translation and (x, y, z, w)
+        quaternion of the TransformStamped t """
+    t.transform.translation.x = float(translation[0])
+    t.transform.translation.y = float(translation[1])
+    t.transform.translation.z = float(translation[2])
+    t.transform.rotation.x = float(rotation[0])
+    t.transform.rotation.y = float(rotation[1])
+    t.transform.rotation.z = float(rotation[2])
+    t.transform.rotation.w = float(rotation[3])
+    return t
+
+
+def make_transform(frame_id, child_frame_id, stamp, translation,
+                   rotation=(0.0, 0.0, 0.0, 1.0)):
+    """ TransformStamped from a (x, y, z) translation and a (x, y, z, w)
+        quaternion """
+    t = TransformStamped()
+    t.header.stamp = stamp
+    t.header.frame_id = frame_id
+    t.child_frame_id = child_frame_id
+    return set_transform(t, translation, rotation)
+
+
+class TransformBatch():
+    """ Transforms computed while processing a frame, for one body or
+        for all the bodies of the frame, sent together in a single
+        TFMessage by flush() instead of one message per transform """
+
+    def __init__(self, broadcaster):
+        self.broadcaster = broadcaster
+        self.transforms = []
+        self.sent_messages = 0
+        self.sent_transforms = 0
+
+    def add(self, transform):
+        self.transforms.append(transform)
+
+    def extend(self, transforms):
+        self.transforms.extend(transforms)
+
+    def flush(self):
+        """ Send the gathered transforms, if any """
+        if not self.transforms:
+            return
+        self.broadcaster.sendTransform(self.transforms)
+        self.sent_messages += 1
+        self.sent_transforms += len(self.transforms)
+        self.transforms = []
+
+    def stats(self):
+        """ Number of TF messages and transforms sent so far """
+        return {"tf_messages": self.sent_messages,
+                "tf_transforms": self.sent_transforms}
+
+
+class StaticTransforms():
+    """ Static transforms of all the bodies, sent through a single
+        StaticTransformBroadcaster shared by the node. The latched
+        /tf_static message only holds the last transforms sent by a
+        publisher: each update resends the transforms of every body """
+
+    def __init__(self, broadcaster):
+        self.broadcaster = broadcaster
+        self.transforms = {}
+        # bodies are added and removed from several callback threads
+        self.lock = threading.Lock()
+
+    def set(self, key, transforms):
+        """ Set (or replace) the static transforms of key, a body id """
+        with self.lock:
+            self.transforms[key] = list(transforms)
+            self.send()
+
+    def remove(self, key):
+        with self.lock:
+            if self.transforms.pop(key, None) is not None:
+                self.send()
+
+    def send(self):
+        self.broadcaster.sendTransform(
+            [t for transforms in self.transforms.values() for t in transforms])
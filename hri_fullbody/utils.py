@@ -24,4 +24,26 @@ def quaternion_from_euler(ai, aj, ak):
     q[2] = cj*cs - sj*sc
     q[3] = cj*cc + sj*ss
 
-    return q
\ No newline at end of file
+    return q
+
+
+def quaternion_multiply(q1, q0):
+    x0, y0, z0, w0 = q0
+    x1, y1, z1, w1 = q1
+
+    q = np.empty((4, ))
+    q[0] = x1*w0 + y1*z0 - z1*y0 + w1*x0
+    q[1] = -x1*z0 + y1*w0 + z1*x0 + w1*y0
+    q[2] = x1*y0 - y1*x0 + z1*w0 + w1*z0
+    q[3] = -x1*x0 - y1*y0 - z1*z0 + w1*w0
+
+    return q
+
+
+def quaternion_about_axis(angle, axis):
+    q = np.empty((4, ))
+    q[0:3] = axis
+    q[0:3] *= math.sin(angle / 2.0)
+    q[3] = math.cos(angle / 2.0)
+
+    return q
@@ -20,6 +20,7 @@ setup(
     tests_require=['pytest'],
     entry_points={
         'console_scripts': ['detect = hri_fullbody.detect:main',
+                            'benchmark = hri_fullbody.benchmark:main',
         ],
     },
 )
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from hri_fullbody.depth_sampling import sample_depth
+
+WINDOW = 5
+
+
+def _depth_with_holes():
+    """ Noisy synthetic depth image (in mm), with 30% of invalid (zero)
+        pixels, and a fully invalid region """
+    rng = np.random.default_rng(0)
+    depth = rng.normal(1500.0, 50.0, (48, 64))
+    depth[rng.uniform(size=depth.shape) < 0.3] = 0.0
+    depth[:10, :10] = 0.0
+    return depth.astype(np.uint16)
+
+
+def _windows(depth, x, y):
+    """ Valid values of the WINDOW x WINDOW neighbourhood of each pixel,
+        clamped to the image borders """
+    half = WINDOW // 2
+    height, width = depth.shape
+    windows = []
+    for px, py in zip(x, y):
+        rows = np.clip(np.arange(py - half, py + half + 1), 0, height - 1)
+        cols = np.clip(np.arange(px - half, px + half + 1), 0, width - 1)
+        values = depth[np.ix_(rows, cols)].ravel().astype(float)
+        windows.append(values[values > 0])
+    return windows
+
+
+def _keypoints():
+    rng = np.random.default_rng(1)
+    # including pixels on the borders and in the invalid region
+    x = np.concatenate([rng.integers(0, 64, 200), [0, 63, 3]])
+    y = np.concatenate([rng.integers(0, 48, 200), [0, 47, 3]])
+    return x, y
+
+
+def test_median_matches_numpy():
+    depth = _depth_with_holes()
+    x, y = _keypoints()
+    z = sample_depth(depth, x, y, WINDOW, "median")
+    for value, window in zip(z, _windows(depth, x, y)):
+        if window.size:
+            assert value == pytest.approx(np.median(window))
+        else:
+            assert np.isnan(value)
+
+
+def test_trimmed_mean_matches_numpy():
+    depth = _depth_with_holes()
+    x, y = _keypoints()
+    z = sample_depth(depth, x, y, WINDOW, "trimmed_mean", trim=0.2)
+    for value, window in zip(z, _windows(depth, x, y)):
+        if window.size:
+            cut = int(window.size * 0.2)
+            kept = np.sort(window)[cut:window.size - cut]
+            assert value == pytest.approx(kept.mean())
+        else:
+            assert np.isnan(value)
+
+
+def test_robust_to_holes():
+    depth = _depth_with_holes()
+    x, y = _keypoints()
+    z = sample_depth(depth, x, y, WINDOW, "median")
+    single = depth[y, x].astype(float)
+    # the windowed median only misses the fully invalid region
+    assert np.isnan(z).sum() < (single == 0).sum()
+    assert np.nanmax(np.abs(z - 1500.0)) < 100.0
+
+
+def test_no_keypoint():
+    depth = _depth_with_holes()
+    for statistic in ("median", "trimmed_mean"):
+        z = sample_depth(depth, [], [], WINDOW, statistic)
+        assert z.shape == (0,)
+        assert z.dtype == float
+
+
+def test_unknown_statistic():
+    with pytest.raises(ValueError):
+        sample_depth(_depth_with_holes(), [1], [1], WINDOW, "mean")
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+cv_bridge = pytest.importorskip('cv_bridge')
+sensor_msgs = pytest.importorskip('sensor_msgs.msg')
+
+from hri_fullbody.image_conversion import imgmsg_to_rgb  # noqa: E402
+
+HEIGHT = 4
+WIDTH = 6
+
+
+def _rgb_image():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, (HEIGHT, WIDTH, 3), dtype=np.uint8)
+
+
+def _gray_image():
+    return np.arange(HEIGHT * WIDTH, dtype=np.uint8).reshape(HEIGHT, WIDTH) * 10
+
+
+def _imgmsg(encoding, data, step):
+    msg = sensor_msgs.Image()
+    msg.height = HEIGHT
+    msg.width = WIDTH
+    msg.encoding = encoding
+    msg.step = step
+    msg.data = np.ascontiguousarray(data).tobytes()
+    return msg
+
+
+def _yuv422_gray(gray):
+    # UYVY with neutral chroma: U Y0 V Y1
+    uyvy = np.full((HEIGHT, WIDTH * 2), 128, dtype=np.uint8)
+    uyvy[:, 1::2] = gray
+    return uyvy
+
+
+@pytest.mark.parametrize('encoding', ['rgb8', 'bgr8', 'rgba8', 'bgra8'])
+def test_color_encodings(encoding):
+    rgb = _rgb_image()
+    channels = {
+        'rgb8': rgb,
+        'bgr8': rgb[..., ::-1],
+        'rgba8': np.dstack([rgb, np.full((HEIGHT, WIDTH), 255, np.uint8)]),
+        'bgra8': np.dstack([rgb[..., ::-1],
+                            np.full((HEIGHT, WIDTH), 255, np.uint8)]),
+    }[encoding]
+    msg = _imgmsg(encoding, channels, WIDTH * channels.shape[2])
+
+    image = imgmsg_to_rgb(cv_bridge.CvBridge(), msg)
+
+    assert image.shape == (HEIGHT, WIDTH, 3)
+    assert image.dtype == np.uint8
+    np.testing.assert_array_equal(image, rgb)
+
+
+def test_rgb8_is_not_copied():
+    msg = _imgmsg('rgb8', _rgb_image(), WIDTH * 3)
+
+    image = imgmsg_to_rgb(cv_bridge.CvBridge(), msg)
+
+    assert not image.flags.owndata
+
+
+def test_mono8():
+    gray = _gray_image()
+    msg = _imgmsg('mono8', gray, WIDTH)
+
+    image = imgmsg_to_rgb(cv_bridge.CvBridge(), msg)
+
+    np.testing.assert_array_equal(image, np.dstack([gray] * 3))
+
+
+def test_yuv422():
+    gray = _gray_image()
+    msg = _imgmsg('yuv422', _yuv422_gray(gray), WIDTH * 2)
+
+    image = imgmsg_to_rgb(cv_bridge.CvBridge(), msg)
+
+    assert image.shape == (HEIGHT, WIDTH, 3)
+    # neutral chroma: equal channels, close to the luma (video range)
+    np.testing.assert_allclose(image[..., 0], image[..., 2], atol=1)
+    np.testing.assert_allclose(image[..., 1], image[..., 0], atol=1)
+    np.testing.assert_allclose(image[..., 1].astype(float), gray, atol=32)
+
+
+@pytest.mark.parametrize('encoding', ['rgb8', 'bgr8'])
+def test_downscaling(encoding):
+    rgb = _rgb_image()
+    data = rgb if encoding == 'rgb8' else rgb[..., ::-1]
+    msg = _imgmsg(encoding, data, WIDTH * 3)
+
+    image = imgmsg_to_rgb(cv_bridge.CvBridge(), msg, max_size=WIDTH // 2)
+
+    assert image.shape == (HEIGHT // 2, WIDTH // 2, 3)
+    # downscaling commutes with the channels reordering
+    expected = imgmsg_to_rgb(cv_bridge.CvBridge(), _imgmsg(
+        'rgb8', rgb, WIDTH * 3), max_size=WIDTH // 2)
+    np.testing.assert_array_equal(image, expected)
+
+
+def test_small_images_are_not_resized():
+    msg = _imgmsg('rgb8', _rgb_image(), WIDTH * 3)
+
+    image = imgmsg_to_rgb(cv_bridge.CvBridge(), msg, max_size=WIDTH)
+
+    assert image.shape == (HEIGHT, WIDTH, 3)
+    assert not image.flags.owndata